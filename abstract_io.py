@@ -1,14 +1,21 @@
 import select
 import signal
 import sys
+import time
 
 SLEEP_FOR_IO = 0.2
 
+# boxes hold their output and write it out at most this often, in seconds
+FRAME_SECS = 1/60
+# or once they hold this many characters
+FLUSH_CHARS = 4096
+
 ########################################
 # basic select for I/O
 ########################################
 
 __select_fd = {}
+__select_write_fd = {}
 __select_entered = False
 
 def select_fd_on(name, fd, callback):
@@ -19,22 +26,52 @@ def select_fd_on(name, fd, callback):
 def select_fd_off(name):
     del __select_fd[name]
 
+def select_write_fd_on(name, fd, callback):
+    """
+    callback(name, fd) when fd can be written to, until select_write_fd_off
+    """
+    __select_write_fd[name] = (fd, callback)
+
+def select_write_fd_off(name):
+    __select_write_fd.pop(name, None)
+
+__idle_callbacks = []
+
+def add_idle_callback(callback):
+    """
+    callback() each time the emulator is about to wait for input
+    """
+    __idle_callbacks.append(callback)
+
+def __call_selected(selected, fds):
+    for x in selected:
+        for name, fd_callback in list(fds.items()):
+            fd, callback = fd_callback
+            if x == fd:
+                callback(name, fd)
+                break
+        else:
+            print("sleep_for_input error")
+
 def sleep_for_input(timeout):
     global __monitor_bell, __executing_monitor, __select_entered
     global __select_fd
 
+    if timeout > 0:
+        for callback in __idle_callbacks:
+            callback()
+
+    # about to wait, show everything, otherwise only once a frame
+    flush_output(timeout > 0)
+
     while True:
         # warn: this will not return when ^C is pressed and caught
         __select_entered = True
-        rlist, _, _ = select.select(list(fd for fd, callback in __select_fd.values()), [], [], timeout)
-        for x in rlist:
-            for name, fd_callback in __select_fd.items():
-                fd, callback = fd_callback
-                if x == fd:
-                    callback(name, fd)
-                    break
-            else:
-                print("sleep_for_input error")
+        rlist, wlist, _ = select.select(
+            list(fd for fd, callback in __select_fd.values()),
+            list(fd for fd, callback in __select_write_fd.values()), [], timeout)
+        __call_selected(wlist, __select_write_fd)
+        __call_selected(rlist, __select_fd)
         if not __executing_monitor and __monitor_bell:
             __select_entered = False
             run_monitor()
@@ -43,6 +80,37 @@ def sleep_for_input(timeout):
             __select_entered = False
             break
 
+########################################
+# output, coalesced into frames
+########################################
+
+__pending_boxes = set()
+__last_flush = 0
+
+def mark_pending(box):
+    __pending_boxes.add(box)
+
+def flush_output(force=True):
+    """
+    write out what the boxes hold, when not forced only if a frame has gone
+    by since the last time
+    """
+    global __last_flush
+
+    if not __pending_boxes:
+        return
+    now = time.monotonic()
+    if not force and now - __last_flush < FRAME_SECS:
+        return
+    __last_flush = now
+    # a box can be pending again as soon as it is flushed
+    boxes = list(__pending_boxes)
+    __pending_boxes.clear()
+    for box in boxes:
+        box.flush()
+    if __curses_on:
+        curses.doupdate()
+
 ########################################
 # keyboard and the monitor
 ########################################
@@ -240,7 +308,7 @@ class DisplayBox:
         else:
             self.win.addstr(string)
         if self.refresh:
-            self.win.refresh()
+            mark_pending(self)
 
     def print_xy(self, row, col, string, color=-1):
         if color == -1:
@@ -250,7 +318,11 @@ class DisplayBox:
         else:
             self.win.addstr(row, col, string)
         if self.refresh:
-            self.win.refresh()
+            mark_pending(self)
+
+    def flush(self):
+        # the screen is updated once for all the boxes, see flush_output
+        self.win.noutrefresh()
 
 def curses_init():
     global __stdscr, __curses_on
@@ -321,6 +393,10 @@ def log(message, color=-1):
 ########################################
 
 class StdoutBox:
+    def __init__(self):
+        self.pending = []
+        self.pending_len = 0
+
     def refresh_on(self):
         pass
 
@@ -331,12 +407,29 @@ class StdoutBox:
         pass
 
     def print(self, string, color=-1):
-        sys.stdout.write(string);
-        sys.stdout.flush()
+        self.pending.append(string)
+        self.pending_len += len(string)
+        if self.pending_len >= FLUSH_CHARS:
+            self.flush()
+        else:
+            mark_pending(self)
+
+    def flush(self):
+        if self.pending:
+            sys.stdout.write("".join(self.pending))
+            sys.stdout.flush()
+            self.pending = []
+            self.pending_len = 0
 
     def print_xy(self, row, col, string, color=-1):
         raise Exception('print_xy not supported')
 
+__stdout_box = None
+
 def get_stdout_box():
-    return StdoutBox()
+    # one box, so what is written out stays in order
+    global __stdout_box
+    if not __stdout_box:
+        __stdout_box = StdoutBox()
+    return __stdout_box
 
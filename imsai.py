@@ -1,5 +1,6 @@
 #!/usr/bin/python3
 
+import os
 import sys
 import curses
 import time
@@ -9,6 +10,9 @@ import intel8080
 import imsai_devices
 import imsai_disk
 import imsai_hex
+import imsai_bin
+import imsai_bdos
+import imsai_bios
 
 do_socket_1 = False
 do_socket_2 = False
@@ -16,6 +20,8 @@ do_asm_debug = False
 disk_type = 2
 run_basic = None
 hex_file = None
+bin_file = None
+rom_files = []
 basic_4k = False
 do_mem = 64
 dsk_file = []
@@ -23,9 +29,22 @@ do_vio = False
 do_curses = False
 do_kb = False
 do_ku = False
+com_file = None
+com_args = []
+cpm_dir = '.'
+bios_traps = None
+cache_sectors = imsai_disk.CACHE_SECTORS
+overlay_action = None
+overlay_dir = None
+disk_async = False
+disk_timing = 'instant'
+disk_stats_file = None
 
 for arg in sys.argv[1:]:
-    if arg == "-a":
+    if com_file:
+        # everything after the .COM file is its command tail
+        com_args.append(arg)
+    elif arg == "-a":
         do_asm_debug = True
     elif arg.startswith("-m="):
         do_mem = int(arg[3:])
@@ -34,13 +53,37 @@ for arg in sys.argv[1:]:
             sys.exit(1)
     elif arg == "-v":
         do_vio = True
+    elif arg == "-ov":
+        overlay_action = "discard"
+    elif arg.startswith("-ov="):
+        overlay_action = "keep"
+        overlay_dir = arg[4:]
+    elif arg == "-ovc":
+        overlay_action = "commit"
+    elif arg.startswith("-dc="):
+        cache_sectors = int(arg[4:])
+    elif arg == "-da":
+        disk_async = True
+    elif arg.startswith("-dt="):
+        disk_timing = arg[4:]
+    elif arg == "-ds":
+        disk_stats_file = "diskstats.json"
+    elif arg.startswith("-ds="):
+        disk_stats_file = arg[4:]
     elif arg.startswith("-d"):
         disk_type = int(args[2:])
+    elif arg.startswith("-baud="):
+        # serial speed, in emulated time, 0 for no delay
+        imsai_devices.set_baud(int(arg[6:]))
     elif arg == "-kb":
         do_kb = True
     elif arg == "-ku":
         do_ku = True
         abstract_io.__uppercase_keys = True
+    elif arg == "-bt":
+        bios_traps = "all"
+    elif arg == "-btc":
+        bios_traps = "console"
     elif arg == "-c":
         do_curses = True
     elif arg == "-s":
@@ -56,8 +99,22 @@ for arg in sys.argv[1:]:
         run_basic = arg
     elif arg.lower().endswith('.hex'):
         hex_file = arg
-    elif arg.lower().endswith('.dsk'):
+    elif arg.split('@')[0].lower().endswith('.bin'):
+        # file.bin@<hex addr>, run from there
+        bin_file = arg
+    elif arg.split('@')[0].lower().endswith('.rom'):
+        # file.rom@<hex addr>, read only, on top of whatever else is loaded
+        rom_files.append(arg)
+    elif arg.split('@')[0].lower().endswith(('.dsk', '.dsz')):
+        # file.dsk@<geometry>@<timing>, see imsai_disk.GEOMETRIES and TIMINGS
         dsk_file.append(arg)
+    elif os.path.isdir(arg.split('@')[0]):
+        # a host directory as a drive, see imsai_hostdir
+        dsk_file.append(arg)
+    elif arg.startswith("-cpm_dir="):
+        cpm_dir = arg[9:]
+    elif arg.lower().endswith('.com'):
+        com_file = arg
 
 device_factory = imsai_devices.DeviceFactory()
 cpu = intel8080.CPU8080(device_factory, do_mem*1024)
@@ -73,9 +130,19 @@ if run_basic:
         hex_file = 'IMSAI/basic8k.hex'
 
 disk_device = None
-if dsk_file:
-    disk_device = imsai_disk.DiskDevice(device_factory, disk_type, dsk_file)
+bdos_device = None
+start_addr = 0
+if com_file:
+    bdos_device = imsai_bdos.BdosDevice(device_factory, cpu, cpm_dir)
+    bdos_device.load_com(com_file, com_args)
+elif dsk_file:
+    disk_device = imsai_disk.DiskDevice(device_factory, disk_type, dsk_file, cache_sectors,
+        overlay_action, overlay_dir, disk_async, disk_timing)
     disk_device.boot(cpu)
+elif bin_file:
+    bin_loader = imsai_bin.get_loader(bin_file)
+    bin_loader.boot(cpu)
+    start_addr = bin_loader.addr
 elif hex_file:
     imsai_hex.HexLoader(hex_file).boot(cpu)
 elif basic_4k:
@@ -89,6 +156,22 @@ else:
     cpu.extend_symbol('BEGPR', 250)
     cpu.set_read_only_end('RAM')
 
+for rom_file in rom_files:
+    imsai_bin.get_loader(rom_file).boot(cpu)
+
+########################################
+# run a .COM file headless, no devices needed
+########################################
+
+if bdos_device:
+    if do_asm_debug:
+        cpu.show_inst = True
+    try:
+        cpu.run()
+    finally:
+        bdos_device.done()
+    sys.exit(0)
+
 ########################################
 # setup devices
 ########################################
@@ -108,6 +191,8 @@ def monitor_func(keyboard, display_box):
             cpu.tron()
         elif line == 'troff':
             cpu.troff()
+        elif line == 'trdis':
+            cpu.trdis()
         elif line == 'keys':
             all_names = abstract_io.get_keyboard_names()
             all_names.sort()
@@ -129,11 +214,32 @@ def monitor_func(keyboard, display_box):
                     display_box.print("\n")
             except Exception:
                 display_box.print("error")
+        elif line == 'flush':
+            if disk_device:
+                disk_device.flush()
+                display_box.print("disks flushed\n")
+        elif line == 'cache':
+            if disk_device:
+                for drive, stats in disk_device.cache_stats().items():
+                    display_box.print("  %s: %s\n"%(drive, " ".join(
+                        "%s:%d"%(name, value) for name, value in stats.items())))
+        elif line == 'diskstats':
+            if disk_device:
+                for drive, stats in disk_device.disk_stats().items():
+                    display_box.print("  %s: %s\n"%(drive, " ".join(
+                        "%s:%d"%(name, value) for name, value in stats.items()
+                        if isinstance(value, int))))
+                    for operation, histogram in stats['latency'].items():
+                        display_box.print("    %-5s %s\n"%(operation, " ".join(
+                            "%s:%d"%(bucket, count) for bucket, count in histogram.items())))
         elif line.startswith('baud '):
             try:
                 baud_rate = int(line[5:])
                 imsai_devices.set_baud(baud_rate)
-                display_box.print("set baud rate to %d\n"%(baud_rate))
+                if baud_rate:
+                    display_box.print("set baud rate to %d\n"%(baud_rate))
+                else:
+                    display_box.print("set baud rate to no delay\n")
             except Exception:
                 display_box.print("error")
         elif line.startswith('read '):
@@ -144,21 +250,38 @@ def monitor_func(keyboard, display_box):
                 return fh
             except Exception:
                 display_box.print('error opening file %s'%(fn))
+        elif line.startswith('dis '):
+            try:
+                args = line[4:].split()
+                addr = cpu.addr_to_number(args[0])
+                count = 16
+                if len(args) > 1:
+                    count = int(args[1])
+                lines, next_addr = cpu.get_disassembler().disassemble(addr, count)
+                for dis_line in lines:
+                    display_box.print('  %s\n'%dis_line)
+            except Exception:
+                display_box.print("error")
         elif line == 's' or line == 'status':
             display_box.print('PC: %04x\n'%(cpu.pc))
             display_box.print('SP: %04x\n'%(cpu.sp))
-            for i in range(-5,5):
-                display_box.print('  %04x %s\n'%(cpu.pc+i, cpu.addr_to_str(cpu.pc+i)))
+            lines, next_addr = cpu.get_disassembler().disassemble(cpu.pc, 10)
+            for dis_line in lines:
+                display_box.print('  %s\n'%dis_line)
         elif line == 'help':
             display_box.print('cmds:\n')
-            display_box.print('  baud <#>\n')
+            display_box.print('  baud <#> (0 for no delay)\n')
+            display_box.print('  dis <addr> [count]\n')
+            display_box.print('  flush\n')
+            display_box.print('  cache\n')
+            display_box.print('  diskstats\n')
             display_box.print('  s|status\n')
             display_box.print('  x|exit\n')
     display_box.set_color(old_color)
 
-serial_status_chanel_a = imsai_devices.StatusSerialDevice()
+serial_status_chanel_a = imsai_devices.StatusSerialDevice(cpu)
 device_factory.add_input_device(3, serial_status_chanel_a)
-serial_status_chanel_b = imsai_devices.StatusSerialDevice()
+serial_status_chanel_b = imsai_devices.StatusSerialDevice(cpu)
 device_factory.add_input_device(5, serial_status_chanel_b)
 
 in_chanel_a = None
@@ -237,6 +360,11 @@ try:
     if in_chanel_b:
         device_factory.add_input_device(4, in_chanel_b)
         device_factory.add_output_device(4, out_chanel_b)
+    imsai_devices.InputPump(cpu)
+
+    if bios_traps and disk_device:
+        imsai_bios.BiosTraps(cpu, device_factory,
+            disk_device if bios_traps == "all" else None)
 
     ########################################
     # set debug options
@@ -248,20 +376,25 @@ try:
         cpu.show_mem_get = True
 
     ########################################
-    # run, starting at addr 0
+    # run, starting at addr 0, or that of a .bin file
     ########################################
 
-    cpu.reset(0)
+    cpu.reset(start_addr)
     abstract_io.run_monitor("READY TO RUN")
     cpu.run()
     abstract_io.run_monitor("SYSTEM HALTED")
 finally:
+    abstract_io.flush_output()
     if do_curses:
         abstract_io.curses_done()
     if in_chanel_a:
         in_chanel_a.done()
     if out_chanel_a:
         out_chanel_a.done()
+    if disk_device:
+        if disk_stats_file:
+            disk_device.save_stats(disk_stats_file)
+        disk_device.done()
 
 # see IMSAI/basic4k.hex
 # see IMSAI/basic4k.asm
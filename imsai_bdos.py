@@ -0,0 +1,467 @@
+# standalone CP/M .COM runner
+#
+# the program is loaded at x0100 like the CCP would, no disk or BIOS code
+# runs: BDOS and BIOS entry points are small stubs that OUT to a trap port,
+# the trap is serviced in python against the console (stdin/stdout) and a
+# host directory, a warm boot halts the cpu
+#
+#   x0000 JMP BIOS+3 (warm boot)
+#   x0005 JMP BDOS
+#   x005C default FCB 1, x006C default FCB 2
+#   x0080 command tail, default DMA buffer
+#   x0100 TPA
+#   BDOS  OUT BDOS_PORT, RET
+#   BIOS  jump table, each entry: MVI A,<n>, OUT BIOS_PORT, RET
+
+import os
+import sys
+import select
+
+import abstract_io
+import intel8080
+import imsai_bin
+
+BDOS_PORT = 0xE5
+BIOS_PORT = 0xE6
+
+REC_SZ = 0x80
+TPA = 0x0100
+DEFAULT_DMA = 0x0080
+FCB1 = 0x005C
+FCB2 = 0x006C
+
+BIOS_ENTRIES = 17
+
+# FCB fields
+FCB_DR = 0
+FCB_NAME = 1
+FCB_EX = 12
+FCB_S1 = 13
+FCB_S2 = 14
+FCB_RC = 15
+FCB_CR = 32
+FCB_R0 = 33
+
+def make_fcb_name(name):
+    """
+    "foo.asm" -> "FOO     ASM", None if the host name isn't a CP/M 8.3 name
+    """
+    base, dot, ext = name.upper().partition('.')
+    if not base or len(base) > 8 or len(ext) > 3 or '.' in ext:
+        return None
+    if not all(0x20 < ord(c) < 0x7F and c not in '<>.,;:=?*[]' for c in base + ext):
+        return None
+    return "%-8s%-3s"%(base, ext)
+
+class BdosDevice:
+    def __init__(self, device_factory, cpu, host_dir='.'):
+        self.name = 'BDOS'
+        self.cpu = cpu
+        self.host_dir = host_dir
+        self.dma = DEFAULT_DMA
+        self.user = 0
+
+        # host file name -> open file
+        self.open_files = {}
+        self.search_results = []
+
+        # BIOS at the top of memory, the BDOS just below it
+        self.bios_addr = (len(cpu.mem) - 3*BIOS_ENTRIES - 5*BIOS_ENTRIES) & 0xFF00
+        self.bdos_addr = self.bios_addr - 0x10
+
+        device_factory.add_output_device(BDOS_PORT, self)
+        device_factory.add_output_device(BIOS_PORT, self)
+
+    ########################################
+    # setting up memory
+    ########################################
+
+    def load_com(self, com_file, args=()):
+        cpu = self.cpu
+        mem = cpu.mem
+        loader = imsai_bin.ComLoader(com_file)
+        if TPA + os.path.getsize(com_file) > self.bdos_addr:
+            raise Exception('%s does not fit in the TPA'%com_file)
+        loader.boot(cpu)
+
+        # page zero
+        bios_wboot = self.bios_addr + 3
+        mem[0:3] = [0xC3, bios_wboot & 0xFF, bios_wboot >> 8]
+        mem[5:8] = [0xC3, self.bdos_addr & 0xFF, self.bdos_addr >> 8]
+
+        # BDOS stub
+        mem[self.bdos_addr:self.bdos_addr+3] = [0xD3, BDOS_PORT, 0xC9]
+
+        # BIOS jump table, followed by the stubs it jumps to
+        stubs = self.bios_addr + 3*BIOS_ENTRIES
+        for i in range(BIOS_ENTRIES):
+            stub = stubs + 5*i
+            mem[self.bios_addr+3*i:self.bios_addr+3*i+3] = [0xC3, stub & 0xFF, stub >> 8]
+            mem[stub:stub+5] = [0x3E, i, 0xD3, BIOS_PORT, 0xC9]
+
+        # command tail and default FCBs
+        tail = "".join(" " + arg for arg in args).upper()[:REC_SZ-2]
+        mem[DEFAULT_DMA] = len(tail)
+        mem[DEFAULT_DMA+1:DEFAULT_DMA+1+len(tail)] = [ord(c) for c in tail]
+        mem[DEFAULT_DMA+1+len(tail)] = 0
+        for fcb, i in ((FCB1, 0), (FCB2, 1)):
+            self.parse_fcb(fcb, args[i] if i < len(args) else "")
+
+        # a RET from the program goes to the warm boot at x0000
+        cpu.reset(TPA)
+        cpu.sp = self.bdos_addr
+        cpu.push(0x0000)
+
+    def parse_fcb(self, fcb, arg):
+        mem = self.cpu.mem
+        arg = arg.upper()
+        drive = 0
+        if len(arg) >= 2 and arg[1] == ':':
+            drive = ord(arg[0]) - ord('A') + 1
+            arg = arg[2:]
+        base, dot, ext = arg.partition('.')
+
+        def field(text, size):
+            if '*' in text:
+                text = text[:text.index('*')].ljust(size, '?')
+            return text[:size].ljust(size)
+
+        name = field(base, 8) + field(ext, 3)
+        mem[fcb] = drive
+        mem[fcb+FCB_NAME:fcb+FCB_NAME+11] = [ord(c) for c in name]
+        mem[fcb+FCB_EX:fcb+FCB_EX+4] = [0]*4
+
+    ########################################
+    # the trap ports
+    ########################################
+
+    def put_OUT_op(self, device_id, value):
+        if device_id == BDOS_PORT:
+            self.bdos_call(self.cpu.rs[intel8080.REG_C])
+        else:
+            self.bios_call(value)
+
+    def set_result(self, value):
+        """BDOS returns the same value in HL and BA"""
+        rs = self.cpu.rs
+        rs[intel8080.REG_A] = rs[intel8080.REG_L] = value & 0xFF
+        rs[intel8080.REG_B] = rs[intel8080.REG_H] = (value >> 8) & 0xFF
+
+    def bios_call(self, func):
+        rs = self.cpu.rs
+        if func <= 1:
+            # BOOT, WBOOT
+            self.cpu.halt = True
+        elif func == 2:
+            # CONST
+            rs[intel8080.REG_A] = 0xFF if self.console_ready() else 0
+        elif func == 3:
+            # CONIN
+            rs[intel8080.REG_A] = self.console_in()
+        elif func == 4:
+            # CONOUT
+            self.console_out(rs[intel8080.REG_C])
+        elif func == 7:
+            # READER
+            rs[intel8080.REG_A] = 0x1A
+        elif func in (5, 6):
+            # LIST, PUNCH
+            pass
+        else:
+            abstract_io.log("BIOS call %d not supported"%func, 1)
+            rs[intel8080.REG_A] = 0xFF
+
+    def bdos_call(self, func):
+        cpu = self.cpu
+        mem = cpu.mem
+        de = cpu.get_de()
+        e = cpu.rs[intel8080.REG_E]
+
+        if func == 0:
+            # P_TERMCPM
+            cpu.halt = True
+        elif func == 1:
+            # C_READ
+            c = self.console_in()
+            self.console_echo(c)
+            self.set_result(c)
+        elif func == 2:
+            # C_WRITE
+            self.console_out(e)
+        elif func == 3:
+            # A_READ
+            self.set_result(0x1A)
+        elif func in (4, 5):
+            # A_WRITE, L_WRITE
+            pass
+        elif func == 6:
+            # C_RAWIO
+            if e == 0xFF:
+                self.set_result(self.console_in() if self.console_ready() else 0)
+            elif e == 0xFE:
+                self.set_result(0xFF if self.console_ready() else 0)
+            else:
+                self.console_out(e)
+        elif func == 9:
+            # C_WRITESTR
+            addr = de
+            while addr < len(mem) and mem[addr] != ord('$'):
+                self.console_out(mem[addr])
+                addr += 1
+        elif func == 10:
+            # C_READSTR
+            self.read_line(de)
+        elif func == 11:
+            # C_STAT
+            self.set_result(0xFF if self.console_ready() else 0)
+        elif func == 12:
+            # S_BDOSVER, CP/M 2.2
+            self.set_result(0x0022)
+        elif func == 13:
+            # DRV_ALLRESET
+            self.dma = DEFAULT_DMA
+            self.set_result(0)
+        elif func in (14, 25, 28, 30, 37):
+            # DRV_SET, DRV_GET, DRV_SETRO, F_ATTRIB, DRV_RESET
+            self.set_result(0)
+        elif func in (24, 29):
+            # DRV_LOGINVEC, DRV_ROVEC
+            self.set_result(0x0001 if func == 24 else 0)
+        elif func == 15:
+            self.set_result(self.f_open(de))
+        elif func == 16:
+            self.set_result(self.f_close(de))
+        elif func == 17:
+            self.set_result(self.f_search_first(de))
+        elif func == 18:
+            self.set_result(self.f_search_next())
+        elif func == 19:
+            self.set_result(self.f_delete(de))
+        elif func == 20:
+            self.set_result(self.f_read(de, self.get_seq_record(de), True))
+        elif func == 21:
+            self.set_result(self.f_write(de, self.get_seq_record(de), True))
+        elif func == 22:
+            self.set_result(self.f_make(de))
+        elif func == 23:
+            self.set_result(self.f_rename(de))
+        elif func == 26:
+            # F_DMAOFF
+            self.dma = de
+        elif func == 32:
+            # F_USERNUM
+            if e == 0xFF:
+                self.set_result(self.user)
+            else:
+                self.user = e & 0x0F
+        elif func == 33:
+            self.set_result(self.f_read(de, self.get_rand_record(de), False))
+        elif func in (34, 40):
+            self.set_result(self.f_write(de, self.get_rand_record(de), False))
+        elif func == 35:
+            # F_SIZE
+            fh = self.get_file(de)
+            if fh:
+                size = os.fstat(fh.fileno()).st_size
+                self.set_rand_record(de, (size + REC_SZ - 1) // REC_SZ)
+            self.set_result(0 if fh else 0xFF)
+        elif func == 36:
+            # F_RANDREC
+            self.set_rand_record(de, self.get_seq_record(de))
+        else:
+            abstract_io.log("BDOS call %d not supported"%func, 1)
+            self.set_result(0xFF)
+
+    ########################################
+    # console
+    ########################################
+
+    def console_ready(self):
+        rlist, _, _ = select.select([sys.stdin], [], [], 0)
+        return bool(rlist)
+
+    def console_in(self):
+        sys.stdout.flush()
+        c = sys.stdin.buffer.read(1)
+        if not c:
+            return 0x1A
+        c = c[0]
+        if c == 0x0A:
+            c = 0x0D
+        return c
+
+    def console_echo(self, c):
+        # a terminal echoes the keys itself
+        if not sys.stdin.isatty():
+            self.console_out(c)
+
+    def console_out(self, c):
+        c &= 0x7F
+        if c != 0x0D:
+            sys.stdout.write(chr(c))
+
+    def read_line(self, addr):
+        mem = self.cpu.mem
+        max_len = mem[addr]
+        sys.stdout.flush()
+        line = sys.stdin.buffer.readline()
+        if not sys.stdin.isatty():
+            sys.stdout.write(line.decode('latin-1'))
+        line = line.rstrip(b'\r\n')[:max_len]
+        mem[addr+1] = len(line)
+        mem[addr+2:addr+2+len(line)] = line
+
+    def done(self):
+        sys.stdout.flush()
+        for fh in self.open_files.values():
+            fh.close()
+        self.open_files = {}
+
+    ########################################
+    # files
+    ########################################
+
+    def get_fcb_name(self, fcb):
+        return "".join(chr(c & 0x7F) for c in self.cpu.mem[fcb+FCB_NAME:fcb+FCB_NAME+11])
+
+    def host_names(self, fcb_name):
+        """
+        host files matching an FCB name, which may have '?' wildcards
+        """
+        names = []
+        for name in sorted(os.listdir(self.host_dir)):
+            cpm_name = make_fcb_name(name)
+            if not cpm_name or not os.path.isfile(os.path.join(self.host_dir, name)):
+                continue
+            if all(p == '?' or p == c for p, c in zip(fcb_name, cpm_name)):
+                names.append(name)
+        return names
+
+    def host_path(self, fcb):
+        """
+        the host file for an FCB, existing or to be created
+        """
+        fcb_name = self.get_fcb_name(fcb)
+        names = self.host_names(fcb_name)
+        if names:
+            name = names[0]
+        else:
+            base = fcb_name[:8].strip()
+            ext = fcb_name[8:].strip()
+            name = (base + ('.' + ext if ext else '')).lower()
+        return os.path.join(self.host_dir, name)
+
+    def get_file(self, fcb):
+        path = self.host_path(fcb)
+        fh = self.open_files.get(path, None)
+        if not fh and os.path.isfile(path):
+            fh = self.open_files[path] = open(path, 'r+b')
+        return fh
+
+    def get_seq_record(self, fcb):
+        mem = self.cpu.mem
+        return (mem[fcb+FCB_S2] * 32 + (mem[fcb+FCB_EX] & 0x1F)) * 128 + mem[fcb+FCB_CR]
+
+    def set_seq_record(self, fcb, record):
+        mem = self.cpu.mem
+        mem[fcb+FCB_CR] = record % 128
+        mem[fcb+FCB_EX] = (record // 128) % 32
+        mem[fcb+FCB_S2] = record // (128*32)
+
+    def get_rand_record(self, fcb):
+        mem = self.cpu.mem
+        return mem[fcb+FCB_R0] + mem[fcb+FCB_R0+1] * 0x100 + mem[fcb+FCB_R0+2] * 0x10000
+
+    def set_rand_record(self, fcb, record):
+        mem = self.cpu.mem
+        mem[fcb+FCB_R0:fcb+FCB_R0+3] = [record & 0xFF, (record >> 8) & 0xFF, (record >> 16) & 0xFF]
+
+    def f_open(self, fcb):
+        fh = self.get_file(fcb)
+        if not fh:
+            return 0xFF
+        size = os.fstat(fh.fileno()).st_size
+        records = (size + REC_SZ - 1) // REC_SZ - (self.get_seq_record(fcb) // 128) * 128
+        self.cpu.mem[fcb+FCB_RC] = max(0, min(records, 128))
+        return 0
+
+    def f_close(self, fcb):
+        fh = self.get_file(fcb)
+        if not fh:
+            return 0xFF
+        fh.flush()
+        return 0
+
+    def f_make(self, fcb):
+        path = self.host_path(fcb)
+        fh = self.open_files.pop(path, None)
+        if fh:
+            fh.close()
+        self.open_files[path] = open(path, 'w+b')
+        mem = self.cpu.mem
+        mem[fcb+FCB_EX] = mem[fcb+FCB_S2] = mem[fcb+FCB_RC] = mem[fcb+FCB_CR] = 0
+        return 0
+
+    def f_delete(self, fcb):
+        names = self.host_names(self.get_fcb_name(fcb))
+        for name in names:
+            path = os.path.join(self.host_dir, name)
+            fh = self.open_files.pop(path, None)
+            if fh:
+                fh.close()
+            os.remove(path)
+        return 0 if names else 0xFF
+
+    def f_rename(self, fcb):
+        old_path = self.host_path(fcb)
+        if not os.path.isfile(old_path):
+            return 0xFF
+        new_path = self.host_path(fcb + 16)
+        fh = self.open_files.pop(old_path, None)
+        if fh:
+            fh.close()
+        os.rename(old_path, new_path)
+        return 0
+
+    def f_read(self, fcb, record, sequential):
+        fh = self.get_file(fcb)
+        if not fh:
+            return 0xFF
+        fh.seek(record * REC_SZ)
+        data = fh.read(REC_SZ)
+        if not data:
+            # end of file, or unwritten data for random access
+            return 1
+        data = data + b'\x1A' * (REC_SZ - len(data))
+        self.cpu.mem[self.dma:self.dma+REC_SZ] = data
+        self.set_seq_record(fcb, record + 1 if sequential else record)
+        return 0
+
+    def f_write(self, fcb, record, sequential):
+        fh = self.get_file(fcb)
+        if not fh:
+            return 0xFF
+        fh.seek(record * REC_SZ)
+        fh.write(bytes(self.cpu.mem[self.dma:self.dma+REC_SZ]))
+        self.set_seq_record(fcb, record + 1 if sequential else record)
+        return 0
+
+    def f_search_first(self, fcb):
+        fcb_name = self.get_fcb_name(fcb)
+        if self.cpu.mem[fcb] == ord('?'):
+            fcb_name = '?'*11
+        self.search_results = self.host_names(fcb_name)
+        return self.f_search_next()
+
+    def f_search_next(self):
+        if not self.search_results:
+            return 0xFF
+        name = self.search_results.pop(0)
+        size = os.path.getsize(os.path.join(self.host_dir, name))
+        records = (size + REC_SZ - 1) // REC_SZ
+        extent = max(records - 1, 0) // 128
+        entry = [self.user] + [ord(c) for c in make_fcb_name(name)]
+        entry += [extent % 32, 0, extent // 32, records - extent * 128]
+        entry += [0]*16
+        self.cpu.mem[self.dma:self.dma+32] = entry
+        return 0
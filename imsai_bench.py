@@ -0,0 +1,327 @@
+#!/usr/bin/python3
+
+# headless benchmarks for the emulator
+#
+#   ./imsai_bench.py                  run all, compare against bench_baseline.json
+#   ./imsai_bench.py ops_alu basic8k  run some of them
+#   ./imsai_bench.py -save            run, then store the results as the new baseline
+#   ./imsai_bench.py -b=FILE          use another baseline file
+#   ./imsai_bench.py -t=15            fail when more than 15% slower than the baseline
+#   ./imsai_bench.py -j=FILE          also write the results as JSON
+#
+# a workload whose files (IMSAI/*.hex, DISKS/*.dsk) are missing is skipped
+
+import sys
+import os
+import time
+import json
+import shutil
+import tempfile
+
+import abstract_io
+import intel8080
+import imsai_devices
+import imsai_disk
+import imsai_hex
+
+BASELINE_FILE = 'bench_baseline.json'
+THRESHOLD_PCT = 10
+
+PROG_ADDR = 0x0100
+
+########################################
+# headless devices
+########################################
+
+class NullBox:
+    """a display box that keeps the last output, instead of showing it"""
+    def __init__(self):
+        self.tail = ""
+
+    def refresh_on(self):
+        pass
+
+    def set_color(self, color):
+        return 0
+
+    def refresh_off(self):
+        pass
+
+    def print(self, string, color=-1):
+        self.tail = (self.tail + string)[-80:]
+
+    def print_xy(self, row, col, string, color=-1):
+        pass
+
+class NullOutputDevice:
+    def put_OUT_op(self, device_id, c):
+        pass
+
+class ScriptedConsoleDevice:
+    """
+    a serial console that waits for each prompt in a script, then types the
+    text that goes with it, the cpu is halted once the script is done
+    """
+    def __init__(self, name, serial_status_device, cpu, script):
+        self.name = name
+        self.serial_status_device = serial_status_device
+        serial_status_device.add_monitored_device(self)
+        self.cpu = cpu
+        self.script = list(script)
+        self.out_box = NullBox()
+        self.keys = []
+        self.done_script = False
+
+    def status_checked(self, cpu, in_tight_loop):
+        self.serial_status_device.tx_rdy = True
+        self.serial_status_device.rx_rdy = bool(self.keys)
+        return True
+
+    def get_IN_op(self, cpu, device_id):
+        self.serial_status_device.rx_rdy = False
+        if self.keys:
+            return self.keys.pop(0)
+        return 0
+
+    def put_OUT_op(self, device_id, c):
+        if not 0 < c < 0x80:
+            return
+        self.out_box.print(chr(c))
+        if self.script:
+            prompt, keys = self.script[0]
+            if self.out_box.tail.endswith(prompt):
+                self.script.pop(0)
+                self.out_box.tail = ""
+                if keys is None:
+                    self.cpu.halt = True
+                else:
+                    self.keys.extend(ord(k) for k in keys)
+
+    def done(self):
+        pass
+
+########################################
+# workloads
+########################################
+
+# small programs that loop forever, they are stopped by limit_steps
+OPS_PROGRAMS = {
+    # ADD B, SUB C, ANA D, ORA E, XRA H, CMP L, INR A, DCR B, MOV C,A, ADI, CPI, JMP
+    'ops_alu': [
+        0x80, 0x91, 0xA2, 0xB3, 0xAC, 0xBD, 0x3C, 0x05, 0x4F, 0xC6, 0x11, 0xFE, 0x40,
+        0xC3, 0x00, 0x01],
+    # LXI H,x2000, MOV M,A, INX H, MOV A,M, STA x3000, LDA x3001, SHLD x3002, LHLD x3004,
+    # LXI D,x3010, STAX D, LDAX D, JMP
+    'ops_mem': [
+        0x21, 0x00, 0x20, 0x77, 0x23, 0x7E, 0x32, 0x00, 0x30, 0x3A, 0x01, 0x30,
+        0x22, 0x02, 0x30, 0x2A, 0x04, 0x30, 0x11, 0x10, 0x30, 0x12, 0x1A,
+        0xC3, 0x00, 0x01],
+    # CALL x0110, PUSH B, POP B, JMP; x0110: PUSH PSW, POP PSW, XTHL, XTHL, RET
+    'ops_call': [
+        0xCD, 0x10, 0x01, 0xC5, 0xC1, 0xC3, 0x00, 0x01,
+        0, 0, 0, 0, 0, 0, 0, 0,
+        0xF5, 0xF1, 0xE3, 0xE3, 0xC9],
+    # DCR B, JNZ x0100, INR C, CZ x0110, JMP; x0110: RNZ, RET
+    'ops_branch': [
+        0x05, 0xC2, 0x00, 0x01, 0x0C, 0xCC, 0x10, 0x01, 0xC3, 0x00, 0x01,
+        0, 0, 0, 0, 0,
+        0xC0, 0xC9],
+    # OUT x20, IN x21, OUT x20, IN x21, JMP
+    'ops_io': [
+        0xD3, 0x20, 0xDB, 0x21, 0xD3, 0x20, 0xDB, 0x21, 0xC3, 0x00, 0x01],
+}
+OPS_STEPS = 200000
+
+def setup_ops(name):
+    device_factory = imsai_devices.DeviceFactory()
+    cpu = intel8080.CPU8080(device_factory, 64*1024)
+    program = OPS_PROGRAMS[name]
+    cpu.mem[PROG_ADDR:PROG_ADDR+len(program)] = program
+    device_factory.add_output_device(0x20, NullOutputDevice())
+    device_factory.add_input_device(0x21, imsai_devices.ConstantInputDevice(0x55))
+    cpu.reset(PROG_ADDR)
+    cpu.sp = 0xF000
+    cpu.limit_steps = OPS_STEPS
+    return cpu, None
+
+def setup_basic(name):
+    hex_file = {'basic4k': 'IMSAI/basic4k.hex', 'basic8k': 'IMSAI/basic8k.hex'}[name]
+    if not os.path.exists(hex_file) or not os.path.exists('count.bas'):
+        return None, None
+    device_factory = imsai_devices.DeviceFactory()
+    cpu = intel8080.CPU8080(device_factory, 64*1024)
+    imsai_hex.HexLoader(hex_file).boot(cpu)
+    if name == 'basic4k':
+        cpu.extend_symbol('IOBUF', -2)
+        cpu.extend_symbol('BEGPR', -2)
+    else:
+        cpu.extend_symbol('BEGPR', 250)
+        cpu.set_read_only_end('RAM')
+
+    serial_status = imsai_devices.StatusSerialDevice(cpu)
+    device_factory.add_input_device(3, serial_status)
+    console = imsai_devices.ScriptedSerialInputDevice("Channel A", serial_status, NullBox(), cpu)
+    console.load_file('count.bas')
+    device_factory.add_input_device(2, console)
+    device_factory.add_output_device(2, console)
+    cpu.reset(0)
+    cpu.limit_steps = 5000000
+    return cpu, console
+
+CPM_DISKS = ['DISKS/cpm22.dsk', 'DISKS/blank1.dsk']
+
+def setup_cpm(name, work_dir):
+    for dsk_file in CPM_DISKS:
+        if not os.path.exists(dsk_file):
+            return None, None
+
+    # work on copies, the copy workload writes to the disks
+    dsk_files = []
+    for dsk_file in CPM_DISKS:
+        dsk_copy = os.path.join(work_dir, os.path.basename(dsk_file))
+        shutil.copyfile(dsk_file, dsk_copy)
+        dsk_files.append(dsk_copy)
+
+    device_factory = imsai_devices.DeviceFactory()
+    cpu = intel8080.CPU8080(device_factory, 64*1024)
+    disk_device = imsai_disk.DiskDevice(device_factory, 2, dsk_files)
+    disk_device.boot(cpu)
+
+    if name == 'cpm22_boot':
+        script = [('A>', None)]
+    else:
+        script = [('A>', 'PIP B:=A:*.*\r'), ('A>', None)]
+
+    serial_status = imsai_devices.StatusSerialDevice(cpu)
+    device_factory.add_input_device(3, serial_status)
+    console = ScriptedConsoleDevice("Channel A", serial_status, cpu, script)
+    device_factory.add_input_device(2, console)
+    device_factory.add_output_device(2, console)
+    device_factory.add_output_device(1, NullOutputDevice())
+    cpu.reset(0)
+    cpu.limit_steps = 500000000
+    return cpu, console
+
+WORKLOADS = [
+    'ops_alu', 'ops_mem', 'ops_call', 'ops_branch', 'ops_io',
+    'basic4k', 'basic8k',
+    'cpm22_boot', 'cpm22_copy',
+]
+
+def run_workload(name, work_dir):
+    """
+    returns a dict of results, or None if the workload can't run here
+    """
+    if name.startswith('ops_'):
+        cpu, console = setup_ops(name)
+    elif name.startswith('basic'):
+        cpu, console = setup_basic(name)
+    else:
+        cpu, console = setup_cpm(name, work_dir)
+    if not cpu:
+        return None
+
+    start = time.perf_counter()
+    try:
+        cpu.run()
+    except Exception as e:
+        # BASIC programs end by printing "BYE BYE"
+        if str(e) != 'bye bye':
+            raise
+    wall = time.perf_counter() - start
+
+    result = {
+        'instr': cpu.instr_count,
+        'cycles': cpu.cycles,
+        'wall': wall,
+        'ips': cpu.instr_count / wall if wall else 0,
+        'cps': cpu.cycles / wall if wall else 0,
+    }
+    if isinstance(console, ScriptedConsoleDevice) and console.script:
+        result['error'] = 'script not finished, waiting for %s'%repr(console.script[0][0])
+    return result
+
+########################################
+# baselines
+########################################
+
+def compare(name, result, baseline, threshold_pct):
+    """
+    returns an error string if result is too slow compared to the baseline
+    """
+    base = baseline.get(name, None)
+    if not base:
+        return None
+    threshold_pct = base.get('threshold', threshold_pct)
+    limit = base['ips'] * (1 - threshold_pct / 100)
+    if result['ips'] < limit:
+        return "%.3f MIPS is more than %d%% below baseline %.3f MIPS"%(
+            result['ips'] / 1e6, threshold_pct, base['ips'] / 1e6)
+    return None
+
+def main(args):
+    baseline_file = BASELINE_FILE
+    threshold_pct = THRESHOLD_PCT
+    json_file = None
+    do_save = False
+    names = []
+    for arg in args:
+        if arg == '-save':
+            do_save = True
+        elif arg.startswith('-b='):
+            baseline_file = arg[3:]
+        elif arg.startswith('-t='):
+            threshold_pct = int(arg[3:])
+        elif arg.startswith('-j='):
+            json_file = arg[3:]
+        elif arg in WORKLOADS:
+            names.append(arg)
+        else:
+            print("unknown arg %s, workloads are: %s"%(arg, " ".join(WORKLOADS)))
+            return 2
+    if not names:
+        names = WORKLOADS
+
+    baseline = {}
+    if os.path.exists(baseline_file):
+        with open(baseline_file) as fh:
+            baseline = json.load(fh)
+
+    results = {}
+    failures = 0
+    print("%-12s %10s %12s %8s %8s %8s"%("workload", "instr", "cycles", "wall", "MIPS", "MHz"))
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name in names:
+            result = run_workload(name, work_dir)
+            if not result:
+                print("%-12s skipped, missing files"%name)
+                continue
+            results[name] = result
+            error = result.get('error', None) or compare(name, result, baseline, threshold_pct)
+            print("%-12s %10d %12d %8.3f %8.3f %8.3f%s"%(
+                name, result['instr'], result['cycles'], result['wall'],
+                result['ips'] / 1e6, result['cps'] / 1e6,
+                "  FAIL: " + error if error else ""))
+            if error:
+                failures += 1
+
+    if json_file:
+        with open(json_file, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+
+    if do_save:
+        for name, result in results.items():
+            if 'error' in result:
+                continue
+            saved = {'ips': result['ips'], 'cps': result['cps'], 'wall': result['wall']}
+            if 'threshold' in baseline.get(name, {}):
+                saved['threshold'] = baseline[name]['threshold']
+            baseline[name] = saved
+        with open(baseline_file, 'w') as fh:
+            json.dump(baseline, fh, indent=2, sort_keys=True)
+        print("saved baseline %s"%baseline_file)
+
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,80 @@
+# loaders for binary memory images, chosen by extension
+#
+#   file.bin[@addr]   raw bytes at addr (hex, default x0000), run from there
+#   file.com          a CP/M program at x0100
+#   file.rom[@addr]   raw bytes at addr (hex, default x0000), read only
+#
+# each is one read of the file and one slice copy into memory, a ROM then
+# has a memory device over it that puts back whatever the cpu writes there
+
+import mmap
+
+import abstract_io
+
+COM_ADDR = 0x0100
+
+class BinLoader:
+    def __init__(self, bin_file, addr=0):
+        self.bin_file = bin_file
+        self.addr = addr
+        self.size = 0
+
+    def read(self):
+        with open(self.bin_file, 'rb') as fh:
+            try:
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    return mm[:]
+            except ValueError:
+                # an empty file can't be mapped
+                return b''
+
+    def boot(self, cpu):
+        data = self.read()
+        if self.addr + len(data) > len(cpu.mem):
+            raise Exception("%s does not fit in memory at x%04x"%(self.bin_file, self.addr))
+        cpu.mem[self.addr:self.addr+len(data)] = data
+        self.size = len(data)
+        return True
+
+class ComLoader(BinLoader):
+    def __init__(self, com_file):
+        super().__init__(com_file, COM_ADDR)
+
+class RomDevice:
+    """
+    a memory device over a ROM, writes to it are undone
+    """
+    def __init__(self, name, cpu):
+        self.name = name
+        self.cpu = cpu
+        self.writes = 0
+
+    def set_mem_op(self, addr, old_value, new_value):
+        if old_value != new_value:
+            self.cpu.mem[addr] = old_value
+            self.writes += 1
+            abstract_io.log("%s: write x%02x to x%04x"%(self.name, new_value, addr), 5)
+
+class RomLoader(BinLoader):
+    def boot(self, cpu):
+        super().boot(cpu)
+        cpu.set_mem_device(RomDevice("ROM " + self.bin_file, cpu), self.addr, self.addr + self.size)
+        return True
+
+LOADERS = {
+    '.bin': BinLoader,
+    '.com': ComLoader,
+    '.rom': RomLoader,
+}
+
+def get_loader(arg):
+    """
+    file.bin@D800 -> loader for it, None if it isn't a binary image
+    """
+    image_file, at, addr = arg.partition('@')
+    for ext, loader_class in LOADERS.items():
+        if image_file.lower().endswith(ext):
+            if loader_class is ComLoader:
+                return ComLoader(image_file)
+            return loader_class(image_file, int(addr, 16) if addr else 0)
+    return None
@@ -0,0 +1,202 @@
+# high level emulation of CP/M BIOS entry points
+#
+# the guest OS is not changed: once CP/M has booted, the BIOS jump table is
+# found through the warm boot vector at x0000, and traps are set on the
+# entry points, a trapped call is serviced in python and then returns to the
+# guest as if the BIOS routine had done a RET
+#
+# console: CONST, CONIN, CONOUT go straight to the serial device on the
+#   console port, instead of through the status port polling loop, CONOUT
+#   waits while a socket console has SOCKET_HIGH_WATER bytes unsent
+# disk: SETTRK, SETSEC, SETDMA are remembered, READ and WRITE go straight to
+#   the DiskDevice image, HOME and SELDSK are watched, but left to the guest
+#   since SELDSK has to return the guest's own DPH
+#
+# sectors given to SETSEC are taken to be the physical sectors of the image,
+# numbered from 1, as the standard SECTRAN skew table gives them, so the disk
+# traps are only set when every drive has 128 byte sectors, the size of the
+# DMA buffer, drives with bigger sectors are left for the guest to deblock
+
+import abstract_io
+import intel8080
+import imsai_devices
+
+# BIOS jump table entries
+BIOS_BOOT = 0
+BIOS_WBOOT = 1
+BIOS_CONST = 2
+BIOS_CONIN = 3
+BIOS_CONOUT = 4
+BIOS_HOME = 8
+BIOS_SELDSK = 9
+BIOS_SETTRK = 10
+BIOS_SETSEC = 11
+BIOS_SETDMA = 12
+BIOS_READ = 13
+BIOS_WRITE = 14
+
+BIOS_ENTRIES = 17
+
+# how often to look for the BIOS jump table, in instructions
+FIND_EVERY = 20000
+
+# a CP/M record, what READ and WRITE move to and from the DMA address
+REC_SZ = 128
+
+class BiosTraps:
+    def __init__(self, cpu, device_factory, disk_device=None, console_port=2, do_console=True):
+        self.cpu = cpu
+        self.device_factory = device_factory
+        self.disk_device = disk_device
+        self.console_port = console_port
+        self.do_console = do_console
+
+        self.bios_addr = None
+        self.drive = 0
+        self.trk = 0
+        self.sec = 1
+        self.dma = 0x80
+
+        self.calls = 0
+        cpu.add_periodic(self.find_bios, FIND_EVERY)
+
+    def find_bios(self, cpu):
+        """
+        the BIOS jump table is 17 JMPs, the warm boot vector points at its 2nd
+        """
+        mem = cpu.mem
+        if mem[0] != 0xC3:
+            return
+        bios_addr = mem[1] + mem[2] * 0x100 - 3
+        if bios_addr == self.bios_addr or bios_addr < 0 or bios_addr + 3*BIOS_ENTRIES > len(mem):
+            return
+        for i in range(BIOS_ENTRIES):
+            if mem[bios_addr + 3*i] != 0xC3:
+                return
+        self.install(bios_addr)
+
+    def install(self, bios_addr):
+        cpu = self.cpu
+        if self.bios_addr is not None:
+            for i in range(BIOS_ENTRIES):
+                cpu.pc_traps.pop(self.bios_addr + 3*i, None)
+        self.bios_addr = bios_addr
+        abstract_io.log("BIOS traps at x%04x"%bios_addr, 3)
+
+        traps = {}
+        if self.do_console:
+            traps[BIOS_CONST] = self.trap_const
+            traps[BIOS_CONIN] = self.trap_conin
+            traps[BIOS_CONOUT] = self.trap_conout
+        if self.disk_device and self.records_only():
+            traps[BIOS_HOME] = self.trap_home
+            traps[BIOS_SELDSK] = self.trap_seldsk
+            traps[BIOS_SETTRK] = self.trap_settrk
+            traps[BIOS_SETSEC] = self.trap_setsec
+            traps[BIOS_SETDMA] = self.trap_setdma
+            traps[BIOS_READ] = self.trap_read
+            traps[BIOS_WRITE] = self.trap_write
+
+        for entry, trap in traps.items():
+            addr = bios_addr + 3*entry
+            cpu.pc_traps[addr] = trap
+
+    def records_only(self):
+        for geometry in self.disk_device.geometries:
+            if geometry and geometry.sec_size != REC_SZ:
+                abstract_io.log("BIOS disk traps not set, %d byte sectors"%geometry.sec_size, 3)
+                return False
+        return True
+
+    def ret(self, cpu):
+        self.calls += 1
+        cpu.pc = cpu.pop()
+        return True
+
+    ########################################
+    # console
+    ########################################
+
+    def console(self):
+        return self.device_factory.in_devices.get(self.console_port, None)
+
+    def trap_const(self, cpu):
+        console = self.console()
+        if not console or not hasattr(console, 'rx_ready'):
+            return False
+        # input arrives through the imsai_devices.InputPump
+        cpu.rs[intel8080.REG_A] = 0xFF if console.rx_ready() else 0
+        return self.ret(cpu)
+
+    def trap_conin(self, cpu):
+        console = self.console()
+        if not console or not hasattr(console, 'rx_ready'):
+            return False
+        while not console.rx_ready():
+            abstract_io.sleep_for_input(abstract_io.SLEEP_FOR_IO)
+            if cpu.halt:
+                return True
+        cpu.rs[intel8080.REG_A] = console.get_IN_op(cpu, self.console_port) & 0x7F
+        return self.ret(cpu)
+
+    def trap_conout(self, cpu):
+        console = self.device_factory.out_devices.get(self.console_port, None)
+        if not console:
+            return False
+        # a client that is behind holds the guest here, as the status port
+        # does when it isn't trapped
+        while len(getattr(console, 'out_buffer', b'')) >= imsai_devices.SOCKET_HIGH_WATER:
+            abstract_io.sleep_for_input(abstract_io.SLEEP_FOR_IO)
+            if cpu.halt:
+                return True
+        console.put_OUT_op(self.console_port, cpu.rs[intel8080.REG_C])
+        return self.ret(cpu)
+
+    ########################################
+    # disk
+    ########################################
+
+    def trap_home(self, cpu):
+        self.trk = 0
+        return False
+
+    def trap_seldsk(self, cpu):
+        self.drive = cpu.rs[intel8080.REG_C]
+        return False
+
+    def trap_settrk(self, cpu):
+        self.trk = cpu.get_bc()
+        return self.ret(cpu)
+
+    def trap_setsec(self, cpu):
+        self.sec = cpu.get_bc()
+        return self.ret(cpu)
+
+    def trap_setdma(self, cpu):
+        self.dma = cpu.get_bc()
+        return self.ret(cpu)
+
+    def disk_number(self):
+        disk_number = self.drive + 1
+        disks = self.disk_device.disks
+        if disk_number < len(disks) and disks[disk_number]:
+            return disk_number
+        return None
+
+    def trap_read(self, cpu):
+        disk_number = self.disk_number()
+        if disk_number and self.disk_device.geometries[disk_number].valid(self.trk, 0, self.sec):
+            self.disk_device.read_sector(disk_number, self.trk, self.sec, self.dma)
+            cpu.rs[intel8080.REG_A] = 0
+        else:
+            cpu.rs[intel8080.REG_A] = 1
+        return self.ret(cpu)
+
+    def trap_write(self, cpu):
+        disk_number = self.disk_number()
+        if disk_number and self.disk_device.geometries[disk_number].valid(self.trk, 0, self.sec):
+            self.disk_device.write_sector(disk_number, self.trk, self.sec, self.dma)
+            cpu.rs[intel8080.REG_A] = 0
+        else:
+            cpu.rs[intel8080.REG_A] = 1
+        return self.ret(cpu)
@@ -0,0 +1,451 @@
+#!/usr/bin/python3
+
+# offline access to the CP/M 2.2 file system in a disk image
+#
+#   ./imsai_cpmfs.py DISKS/cpm22.dsk ls                     list files
+#   ./imsai_cpmfs.py DISKS/cpm22.dsk get '*.ASM' -d=out     extract files
+#   ./imsai_cpmfs.py DISKS/cpm22.dsk put foo.asm bar.com    insert files
+#   ./imsai_cpmfs.py DISKS/cpm22.dsk rm FOO.ASM             erase files
+#
+# options: -u=<user> (default 0), -d=<host dir> for get (default .), and
+# -bs=<block size> -dir=<directory entries> -off=<reserved tracks> -skew=<n>
+# to override the disk parameters that go with the image geometry
+#
+# the image may be given as file.dsk@<geometry>, see imsai_disk.GEOMETRIES
+#
+# the directory is read once and kept, with the allocation map worked out
+# from it, changes to it are written back by flush() and close()
+
+import os
+import sys
+import fnmatch
+
+import imsai_disk
+import imsai_bdos
+
+REC_SZ = 0x80
+DIR_ENTRY_SZ = 32
+DELETED = 0xE5
+EOF_BYTE = 0x1A
+
+# a logical extent is 16K
+EXTENT_RECS = 128
+
+# directory entry fields
+DIR_USER = 0
+DIR_NAME = 1
+DIR_EX = 12
+DIR_S2 = 14
+DIR_RC = 15
+DIR_ALLOC = 16
+
+class DiskParams:
+    """
+    the parts of the CP/M disk parameter block that the BIOS of an image uses
+    """
+    def __init__(self, block_size, dir_entries, reserved_tracks, skew):
+        self.block_size = block_size
+        self.dir_entries = dir_entries
+        self.reserved_tracks = reserved_tracks
+        self.skew = skew
+
+def default_params(geometry):
+    if geometry.sec_size == REC_SZ and geometry.secs_per_trk == 26 and geometry.heads == 1:
+        # IBM 3740, as CP/M 2.2 ships
+        return DiskParams(1024, 64, 2, 6)
+    if geometry.size() <= 2*1024*1024:
+        return DiskParams(2048, 128, 2, 1)
+    return DiskParams(4096, 512, 1, 1)
+
+def skew_table(sectors, skew):
+    """
+    logical -> physical sector (from 1), stepping by skew, moving on one
+    when the step lands on a sector already used
+    """
+    table = []
+    used = [False]*sectors
+    sec = 0
+    for i in range(sectors):
+        while used[sec]:
+            sec = (sec + 1) % sectors
+        used[sec] = True
+        table.append(sec + 1)
+        sec = (sec + skew) % sectors
+    return table
+
+def to_dir_name(name):
+    """
+    "foo.asm" -> "FOO     ASM"
+    """
+    dir_name = imsai_bdos.make_fcb_name(name)
+    if not dir_name:
+        raise Exception("%s is not a CP/M file name"%name)
+    return dir_name
+
+def from_dir_name(dir_name):
+    """
+    "FOO     ASM" -> "FOO.ASM"
+    """
+    base = dir_name[:8].strip()
+    ext = dir_name[8:].strip()
+    return base + ('.' + ext if ext else '')
+
+class CpmLayout:
+    """
+    where the blocks and directory entries of a CP/M file system are, for
+    a geometry and disk parameters
+    """
+    def __init__(self, geometry, params=None):
+        self.geometry = geometry
+        self.params = params or default_params(geometry)
+
+        self.recs_per_sec = geometry.sec_size // REC_SZ
+        self.recs_per_trk = geometry.secs_per_trk * self.recs_per_sec
+        self.block_recs = self.params.block_size // REC_SZ
+        data_tracks = geometry.tracks * geometry.heads - self.params.reserved_tracks
+        self.blocks = data_tracks * self.recs_per_trk // self.block_recs
+        # more than 256 blocks need 16 bit block numbers, 8 to an entry
+        self.wide = self.blocks > 256
+        self.ptrs = 8 if self.wide else 16
+        self.exm = self.ptrs * self.params.block_size // (EXTENT_RECS * REC_SZ) - 1
+        self.dir_blocks = -(-self.params.dir_entries * DIR_ENTRY_SZ // self.params.block_size)
+        self.xlate = skew_table(geometry.secs_per_trk, self.params.skew)
+        self.unxlate = {sec: i for i, sec in enumerate(self.xlate)}
+
+    def record_offset(self, record):
+        """
+        where a 128 byte record of the data area is in the image
+        """
+        geometry = self.geometry
+        trk, rec = divmod(record, self.recs_per_trk)
+        trk += self.params.reserved_tracks
+        sec = self.xlate[rec // self.recs_per_sec]
+        offset = geometry.offset(trk // geometry.heads, trk % geometry.heads, sec)
+        return offset + (rec % self.recs_per_sec) * REC_SZ
+
+    def offset_record(self, offset):
+        """
+        the record of the data area at an image offset, None on the
+        reserved tracks
+        """
+        geometry = self.geometry
+        trk, in_trk = divmod(offset, geometry.track_bytes())
+        if trk < self.params.reserved_tracks:
+            return None
+        sec, in_sec = divmod(in_trk, geometry.sec_size)
+        rec = self.unxlate[sec + 1] * self.recs_per_sec + in_sec // REC_SZ
+        return (trk - self.params.reserved_tracks) * self.recs_per_trk + rec
+
+    def entry_name(self, entry):
+        return "".join(chr(c & 0x7F) for c in entry[DIR_NAME:DIR_NAME+11])
+
+    def entry_extent(self, entry):
+        return entry[DIR_S2] * 32 + entry[DIR_EX]
+
+    def entry_blocks(self, entry):
+        alloc = entry[DIR_ALLOC:DIR_ALLOC+16]
+        if self.wide:
+            blocks = [alloc[i] + alloc[i+1] * 0x100 for i in range(0, 16, 2)]
+        else:
+            blocks = list(alloc)
+        return [block for block in blocks if block]
+
+    def file_records(self, entries):
+        last = entries[-1]
+        return self.entry_extent(last) * EXTENT_RECS + last[DIR_RC]
+
+    def make_entries(self, dir_name, user, blocks, records):
+        """
+        the directory entries of a file of so many records in these blocks
+        """
+        entry_recs = self.ptrs * self.block_recs
+        entries = []
+        for k in range(max(1, -(-records // entry_recs))):
+            n_recs = min(records - k * entry_recs, entry_recs)
+            extent = k * (self.exm + 1) + max(0, n_recs - 1) // EXTENT_RECS
+            entry = bytearray(DIR_ENTRY_SZ)
+            entry[DIR_USER] = user
+            entry[DIR_NAME:DIR_NAME+11] = dir_name.encode('ascii')
+            entry[DIR_EX] = extent & 0x1F
+            entry[DIR_S2] = extent >> 5
+            entry[DIR_RC] = n_recs - max(0, n_recs - 1) // EXTENT_RECS * EXTENT_RECS
+            for i, block in enumerate(blocks[k*self.ptrs:(k+1)*self.ptrs]):
+                if self.wide:
+                    entry[DIR_ALLOC+2*i] = block & 0xFF
+                    entry[DIR_ALLOC+2*i+1] = block >> 8
+                else:
+                    entry[DIR_ALLOC+i] = block
+            entries.append(entry)
+        return entries
+
+    def parse_directory(self, directory):
+        """
+        (user, "NAME.EXT") -> directory entries, in extent order
+        """
+        files = {}
+        for index in range(len(directory) // DIR_ENTRY_SZ):
+            entry = directory[index*DIR_ENTRY_SZ:(index+1)*DIR_ENTRY_SZ]
+            if entry[DIR_USER] < 16:
+                key = (entry[DIR_USER], from_dir_name(self.entry_name(entry)))
+                files.setdefault(key, []).append(entry)
+        for entries in files.values():
+            entries.sort(key=self.entry_extent)
+        return files
+
+class CpmDisk(CpmLayout):
+    def __init__(self, image_file, read_only=False, params=None):
+        image_file, *options = image_file.split('@')
+        self.image_file = image_file
+        self.image = imsai_disk.open_image(image_file, read_only)
+        self.read_only = read_only
+        geometry = imsai_disk.default_geometry(self.image)
+        for option in options:
+            geometry = imsai_disk.parse_geometry(option)
+        super().__init__(geometry, params)
+
+        self.directory = None
+        self.dir_dirty = False
+
+    ########################################
+    # blocks
+    ########################################
+
+    def read_block(self, block):
+        first = block * self.block_recs
+        return b''.join(
+            self.image.read(self.record_offset(record), REC_SZ)
+            for record in range(first, first + self.block_recs))
+
+    def write_block(self, block, data):
+        data = bytes(data) + b'\xE5' * (self.params.block_size - len(data))
+        first = block * self.block_recs
+        sec_size = self.geometry.sec_size
+        i = 0
+        while i < self.block_recs:
+            # a whole sector at a time, some images can't write part of one
+            offset = self.record_offset(first + i)
+            in_sector = offset % sec_size
+            n = min((sec_size - in_sector) // REC_SZ, self.block_recs - i)
+            sector = bytearray(self.image.read(offset - in_sector, sec_size)) \
+                if n * REC_SZ < sec_size else bytearray(sec_size)
+            sector[in_sector:in_sector+n*REC_SZ] = data[i*REC_SZ:(i+n)*REC_SZ]
+            self.image.write(offset - in_sector, sector)
+            i += n
+
+    ########################################
+    # directory
+    ########################################
+
+    def load_directory(self):
+        if self.directory is None:
+            data = b''.join(self.read_block(block) for block in range(self.dir_blocks))
+            self.directory = bytearray(data[:self.params.dir_entries * DIR_ENTRY_SZ])
+        return self.directory
+
+    def entry(self, index):
+        directory = self.load_directory()
+        return directory[index*DIR_ENTRY_SZ:(index+1)*DIR_ENTRY_SZ]
+
+    def used_entries(self):
+        """
+        (index, entry) of the entries in use
+        """
+        for index in range(self.params.dir_entries):
+            entry = self.entry(index)
+            if entry[DIR_USER] < 16:
+                yield index, entry
+
+    def files(self):
+        """
+        (user, "NAME.EXT") -> directory entries, in extent order
+        """
+        return self.parse_directory(self.load_directory())
+
+    def used_blocks(self):
+        used = set(range(self.dir_blocks))
+        for index, entry in self.used_entries():
+            used.update(self.entry_blocks(entry))
+        return used
+
+    def free_blocks(self):
+        used = self.used_blocks()
+        return [block for block in range(self.blocks) if block not in used]
+
+    def free_entries(self):
+        return [index for index in range(self.params.dir_entries)
+            if self.entry(index)[DIR_USER] == DELETED]
+
+    def set_entry(self, index, entry):
+        self.load_directory()[index*DIR_ENTRY_SZ:(index+1)*DIR_ENTRY_SZ] = entry
+        self.dir_dirty = True
+
+    ########################################
+    # files
+    ########################################
+
+    def match(self, pattern, user=0):
+        """
+        "NAME.EXT" of the files of user that match a wildcard pattern
+        """
+        pattern = pattern.upper()
+        return sorted(name for file_user, name in self.files()
+            if file_user == user and fnmatch.fnmatchcase(name, pattern))
+
+    def list(self, user=None):
+        """
+        (user, "NAME.EXT", size in bytes), for one user or all of them
+        """
+        return sorted(
+            (file_user, name, self.file_records(entries) * REC_SZ)
+            for (file_user, name), entries in self.files().items()
+            if user is None or file_user == user)
+
+    def read_file(self, name, user=0):
+        entries = self.files().get((user, name.upper()), None)
+        if not entries:
+            raise Exception("%d:%s not found"%(user, name))
+        blocks = [block for entry in entries for block in self.entry_blocks(entry)]
+        data = b''.join(self.read_block(block) for block in blocks)
+        return data[:self.file_records(entries) * REC_SZ]
+
+    def erase(self, name, user=0):
+        """
+        returns True if there was such a file
+        """
+        dir_name = to_dir_name(name)
+        found = False
+        for index, entry in self.used_entries():
+            if entry[DIR_USER] == user and self.entry_name(entry) == dir_name:
+                entry[DIR_USER] = DELETED
+                self.set_entry(index, entry)
+                found = True
+        return found
+
+    def write_file(self, name, data, user=0):
+        """
+        make a file, replacing one of the same name, text that doesn't fill
+        its last record is padded with ^Z
+        """
+        if self.read_only:
+            raise Exception("disk image %s is read only"%self.image_file)
+        dir_name = to_dir_name(name)
+
+        # the file being replaced is only erased once the new one fits,
+        # its blocks and entries count as free, its blocks are used last
+        old_entries = [(index, entry) for index, entry in self.used_entries()
+            if entry[DIR_USER] == user and self.entry_name(entry) == dir_name]
+        old_blocks = sorted(set(block for index, entry in old_entries
+            for block in self.entry_blocks(entry)))
+
+        data = bytes(data)
+        if len(data) % REC_SZ:
+            data += bytes([EOF_BYTE]) * (REC_SZ - len(data) % REC_SZ)
+        block_size = self.params.block_size
+        n_blocks = -(-len(data) // block_size)
+        n_entries = max(1, -(-len(data) // (self.ptrs * block_size)))
+
+        free_blocks = self.free_blocks() + old_blocks
+        free_entries = sorted(self.free_entries() + [index for index, entry in old_entries])
+        if n_blocks > len(free_blocks):
+            raise Exception("disk full, %s needs %d blocks, %d free"%(name, n_blocks, len(free_blocks)))
+        if n_entries > len(free_entries):
+            raise Exception("directory full, %s needs %d entries, %d free"%(
+                name, n_entries, len(free_entries)))
+        self.erase(name, user)
+
+        blocks = sorted(free_blocks[:n_blocks])
+        for i, block in enumerate(blocks):
+            self.write_block(block, data[i*block_size:(i+1)*block_size])
+
+        entries = self.make_entries(dir_name, user, blocks, len(data) // REC_SZ)
+        for index, entry in zip(free_entries, entries):
+            self.set_entry(index, entry)
+
+    def flush(self):
+        if self.dir_dirty:
+            block_size = self.params.block_size
+            for block in range(self.dir_blocks):
+                self.write_block(block, self.directory[block*block_size:(block+1)*block_size])
+            self.dir_dirty = False
+        self.image.flush()
+
+    def close(self):
+        self.flush()
+        self.image.close()
+
+def main(args):
+    user = 0
+    host_dir = '.'
+    overrides = {}
+    words = []
+    for arg in args:
+        if arg.startswith('-u='):
+            user = int(arg[3:])
+        elif arg.startswith('-d='):
+            host_dir = arg[3:]
+        elif arg.startswith('-bs='):
+            overrides['block_size'] = int(arg[4:])
+        elif arg.startswith('-dir='):
+            overrides['dir_entries'] = int(arg[5:])
+        elif arg.startswith('-off='):
+            overrides['reserved_tracks'] = int(arg[5:])
+        elif arg.startswith('-skew='):
+            overrides['skew'] = int(arg[6:])
+        else:
+            words.append(arg)
+
+    if len(words) < 2 or words[1] not in ('ls', 'get', 'put', 'rm'):
+        print("usage: imsai_cpmfs.py [-u=N] [-d=DIR] [-bs=N -dir=N -off=N -skew=N] "
+            "image[@geometry] ls | get NAME... | put FILE... | rm NAME...")
+        return 2
+    image_file, cmd, names = words[0], words[1], words[2:]
+
+    disk = CpmDisk(image_file, read_only=cmd in ('ls', 'get'))
+    if overrides:
+        params = disk.params
+        disk.close()
+        disk = CpmDisk(image_file, read_only=cmd in ('ls', 'get'), params=DiskParams(
+            overrides.get('block_size', params.block_size),
+            overrides.get('dir_entries', params.dir_entries),
+            overrides.get('reserved_tracks', params.reserved_tracks),
+            overrides.get('skew', params.skew)))
+
+    status = 0
+    try:
+        if cmd == 'ls':
+            total = 0
+            for file_user, name, size in disk.list():
+                print("%2d:%-12s %8d"%(file_user, name, size))
+                total += size
+            free = len(disk.free_blocks()) * disk.params.block_size
+            print("%d bytes in files, %d bytes free"%(total, free))
+        elif cmd == 'get':
+            for pattern in names or ['*']:
+                matches = disk.match(pattern, user)
+                if not matches:
+                    print("%s: no such file"%pattern)
+                    status = 1
+                for name in matches:
+                    with open(os.path.join(host_dir, name.lower()), 'wb') as fh:
+                        fh.write(disk.read_file(name, user))
+                    print("got %s"%name)
+        elif cmd == 'put':
+            for host_file in names:
+                with open(host_file, 'rb') as fh:
+                    disk.write_file(os.path.basename(host_file), fh.read(), user)
+                print("put %s"%host_file)
+        elif cmd == 'rm':
+            for pattern in names:
+                matches = disk.match(pattern, user)
+                if not matches:
+                    print("%s: no such file"%pattern)
+                    status = 1
+                for name in matches:
+                    disk.erase(name, user)
+                    print("erased %s"%name)
+    finally:
+        disk.close()
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
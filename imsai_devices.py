@@ -1,25 +1,53 @@
 import socket
 import time
 import sys
-import queue
+import collections
 
 import abstract_io
+import intel8080
 import imsai_hex
 
 DBG_ON = False # "parsed"
 
 def set_baud(baud, bits=7):
-    global BAUD_NS
+    """
+    a serial character takes BAUD_CYCLES cpu cycles, in emulated time, baud 0
+    has no delay, TX is always ready and RX is whenever there is a key
+    """
+    global BAUD_CYCLES
     if baud:
-        BAUD_NS = int(1e9/(baud/(bits + 2)))
+        BAUD_CYCLES = int(intel8080.CLOCK_HZ * (bits + 2) / baud)
     else:
-        BAUD_NS = 0
+        BAUD_CYCLES = 0
 
 set_baud(9600)
 
 TIGHT_LOOP_LEN = 5
 TIGHT_LOOP_COUNT = 5
 
+# how often host input is polled, in instructions
+POLL_EVERY = 5000
+
+# socket output waiting to be sent, TX is held not ready above this
+SOCKET_HIGH_WATER = 8192
+
+# socket input is taken this much at a time, and files given to read
+RECV_SIZE = 65536
+READ_SIZE = 4096
+
+# bytes that aren't keys, dropped from a run of plain keys
+NOT_KEYS = bytes([0]) + bytes(range(0x80, 0x100))
+
+# routines that only look for ^C, and eat whatever key they find, a paste
+# is held back while they read the status
+HOLD_RX_SYMBOLS = ['TSTCC', 'TSTCH']
+
+def no_input(cpu, device_id):
+    return 0
+
+def no_output(device_id, value):
+    pass
+
 class DeviceFactory:
     def __init__(self):
         self.in_devices = {}
@@ -27,6 +55,20 @@ class DeviceFactory:
         self.in_missing = set()
         self.out_missing = set()
 
+        # port -> handler, what IN and OUT call, an unmapped port's handler
+        # logs it once, then leaves no_input or no_output in its place
+        self.in_ops = [self.missing_in] * 256
+        self.out_ops = [self.missing_out] * 256
+
+    def missing_in(self, cpu, device_id):
+        self.get_in_device(device_id)
+        self.in_ops[device_id] = no_input
+        return 0
+
+    def missing_out(self, device_id, value):
+        self.get_out_device(device_id)
+        self.out_ops[device_id] = no_output
+
     def get_out_device(self, device_id):
         out_device = self.out_devices.get(device_id, None)
         if not out_device:
@@ -44,15 +86,44 @@ class DeviceFactory:
         return in_device
 
     def add_input_device(self, device_id, device):
+        """
+        a device that handles ports differently can give a handler for each
+        from get_IN_handler(device_id), instead of checking device_id itself
+        """
         self.in_devices[device_id] = device
+        if hasattr(device, 'get_IN_handler'):
+            self.in_ops[device_id] = device.get_IN_handler(device_id)
+        else:
+            self.in_ops[device_id] = device.get_IN_op
 
     def add_output_device(self, device_id, device):
+        """
+        see add_input_device, put_OUT_handler(device_id) gives a handler
+        """
         self.out_devices[device_id] = device
+        if hasattr(device, 'put_OUT_handler'):
+            self.out_ops[device_id] = device.put_OUT_handler(device_id)
+        else:
+            self.out_ops[device_id] = device.put_OUT_op
 
 ########################################
 # devices
 ########################################
 
+class InputPump:
+    """
+    polls the host keyboard and sockets every so many instructions, with no
+    wait, so that reading a status or data port doesn't have to, a port only
+    waits for input when the guest is in a tight loop on it
+    """
+    def __init__(self, cpu, every=POLL_EVERY):
+        self.polls = 0
+        cpu.add_periodic(self.poll, every)
+
+    def poll(self, cpu):
+        self.polls += 1
+        abstract_io.sleep_for_input(0)
+
 class ConstantInputDevice:
     def __init__(self, value):
         self.value = value
@@ -62,11 +133,17 @@ class ConstantInputDevice:
 
 class StatusSerialDevice:
     """The TTY reports its TX and RX status through this device"""
-    def __init__(self):
+    def __init__(self, cpu):
         self.name = "TTY Status"
+        self.cpu = cpu
         self.tx_rdy = True
         self.rx_rdy = False
 
+        # cpu cycles when the last character was read and written
+        self.in_cycles = 0
+        self.out_cycles = 0
+        self.hold_rx_addrs = None
+
         self.monitored_devices = []
         self.halt = False
 
@@ -76,6 +153,42 @@ class StatusSerialDevice:
     def add_monitored_device(self, device):
         self.monitored_devices.append(device)
 
+    def char_read(self):
+        # mark input not ready, to simulate the BAUD rate
+        self.rx_rdy = False
+        self.in_cycles = self.cpu.cycles
+
+    def char_written(self):
+        # mark output not ready, to simulate the BAUD rate
+        self.out_cycles = self.cpu.cycles
+        if BAUD_CYCLES:
+            self.tx_rdy = False
+
+    def get_hold_rx_addrs(self):
+        # looked up the first time there is a paste, the symbols load lazily
+        if self.hold_rx_addrs is None:
+            sym_to_mem = self.cpu.sym_to_mem
+            self.hold_rx_addrs = set(sym_to_mem[sym] for sym in HOLD_RX_SYMBOLS if sym in sym_to_mem)
+        return self.hold_rx_addrs
+
+    def update_ready(self, rx_waiting):
+        """
+        mark input and output ready once a character time has gone by,
+        rx_waiting is the number of keys waiting, returns True when output
+        was not ready or input is waiting
+        """
+        now_cycles = self.cpu.cycles
+        if rx_waiting > 1 and self.cpu.pc - 2 in self.get_hold_rx_addrs():
+            self.rx_rdy = False
+        elif rx_waiting and now_cycles - self.in_cycles >= BAUD_CYCLES:
+            self.rx_rdy = True
+
+        out_was_not_ready = not self.tx_rdy
+        if now_cycles - self.out_cycles >= BAUD_CYCLES:
+            self.tx_rdy = True
+
+        return out_was_not_ready or rx_waiting
+
     def get_IN_op(self, cpu, device_id):
         if self.halt:
             return -1
@@ -97,13 +210,11 @@ class StatusSerialDevice:
             if device.status_checked(cpu, in_tight_loop):
                 in_tight_loop = False
 
-        # if this really is a tight loop, chill
+        # if this really is a tight loop, the guest is idle, wait for input
         if in_tight_loop:
             if cpu.show_inst:
                 print("SLEEP STAT %04x %d"%(cpu.pc-2, elapsed_instr_count), file=cpu.debug_fh)
             abstract_io.sleep_for_input(abstract_io.SLEEP_FOR_IO)
-        else:
-            abstract_io.sleep_for_input(0.001)
 
         # return the status
         return self.tx_rdy * 0x01 | self.rx_rdy * 0x02
@@ -114,8 +225,9 @@ class ScriptedSerialInputDevice:
         self.serial_status_device = serial_status_device
         self.out_box = out_box
         serial_status_device.add_monitored_device(self)
-        self.bad_time_addr = cpu.sym_to_mem.get('TSTCC',
-            cpu.sym_to_mem.get('TSTCH', 0))
+        # looked up the first time the status is checked, see get_bad_time_addr
+        self.cpu = cpu
+        self.bad_time_addr = None
 
         self.stack = None
 
@@ -128,17 +240,27 @@ class ScriptedSerialInputDevice:
         self.stack.reverse()
         fh.close()
 
+    def get_bad_time_addr(self):
+        # the symbols load lazily
+        if self.bad_time_addr is None:
+            sym_to_mem = self.cpu.sym_to_mem
+            self.bad_time_addr = sym_to_mem.get('TSTCC', sym_to_mem.get('TSTCH', 0))
+        return self.bad_time_addr
+
     def status_checked(self, cpu, in_tight_loop):
         # 8k basic reads and discards key strokes looking for ^C
         # if the characters are eaten and not read, the input goes missing
         # either this condition is detected, or keyboard speed needs to be delayed
-        bad_time = self.bad_time_addr == cpu.pc - 2
+        bad_time = self.get_bad_time_addr() == cpu.pc - 2
         if bad_time:
             self.serial_status_device.rx_rdy = False
         elif self.stack:
             self.serial_status_device.rx_rdy = True
         return True
 
+    def rx_ready(self):
+        return bool(self.stack)
+
     def get_IN_op(self, cpu, device_id):
         if self.serial_status_device.halt:
             return -1
@@ -173,15 +295,12 @@ class SocketToSerialDevice:
         serial_status_device.add_monitored_device(self)
 
         self.src_socket = None
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.server_socket.bind(('localhost', port))
-        self.server_socket.listen(0x40)
-        abstract_io.select_fd_on("svr_socket:%d"%port, self.server_socket, self.callback_accept_socket)
+        self.server_socket = None
+        self.listen()
 
-        self.queue = queue.Queue()
-        self.in_time = 0
-        self.out_time = 0
+        self.keys = collections.deque()
+        # sent by abstract_io.flush_output, or when the socket can take more
+        self.out_buffer = bytearray()
 
         self.prev_instr_count = 0
         self.in_tight_loop_count = 0
@@ -222,70 +341,103 @@ class SocketToSerialDevice:
         LF: x1b x5b x44
 
         """
-        buffer = self.src_socket.recv(4096)
+        buffer = self.src_socket.recv(RECV_SIZE)
         if len(buffer) == 0:
-            self.src_socket.close()
-            self.src_socket = None
-            abstract_io.select_fd_off("socket:%d"%self.port)
-        for key in buffer:
-            if DBG_ON == "raw":
-                print("READ %s %02x %d"%(self.name, key, key))
+            self.close_socket()
+            return
+        if DBG_ON:
+            for key in buffer:
+                self.ingest_key(key)
+            return
 
+        i = 0
+        while i < len(buffer):
             if self.state == 0:
-                if key == 0xFF:
-                    self.state = 1
-                elif key == 0x1B:
-                    self.state = 10
-                elif 0 < key < 0x80:
-                    if DBG_ON == "parsed":
-                        print("READ %s %02x (%s)"%(self.name, key, repr(chr(key))[1:-1]))
-
-                    # uppercase
-                    if self.uppercase_keys and ord('a') <= key <= ord('z'):
-                        key -= 0x20
-                    self.queue.put(key)
-                elif DBG_ON == "parsed":
-                    print("READ %s %02x"%(self.name, key))
-
-            elif self.state == 1:
-                if 0xFB <= key:
-                    self.telnet_cmd = key
-                    self.state = 2
-                elif 0xF0 <= key:
-                    self.state = 0
-                    if DBG_ON == "parsed":
-                        print("READ %s TELNET-CMD %02x"%(self.name, key))
-                else:
-                    self.state = 0
-
-            elif self.state == 2:
-                if self.telnet_cmd == 0xFD and 0x06 <= key <= 0x10:
-                    self.queue.put(key)
+                # plain keys, up to the next telnet command or escape, go in as a run
+                end = len(buffer)
+                for special in (b'\xff', b'\x1b'):
+                    found = buffer.find(special, i, end)
+                    if found >= 0:
+                        end = found
+                if end > i:
+                    self.add_keys(buffer[i:end])
+                    i = end
+                    continue
+            self.ingest_key(buffer[i])
+            i += 1
+
+    def add_keys(self, keys):
+        keys = keys.translate(None, NOT_KEYS)
+        if self.uppercase_keys:
+            keys = keys.upper()
+        self.keys.extend(keys)
+
+    def ingest_key(self, key):
+        if DBG_ON == "raw":
+            print("READ %s %02x %d"%(self.name, key, key))
+
+        if self.state == 0:
+            if key == 0xFF:
+                self.state = 1
+            elif key == 0x1B:
+                self.state = 10
+            elif 0 < key < 0x80:
                 if DBG_ON == "parsed":
-                    s_telnet_cmd = "%02x"%self.telnet_cmd
-                    i = self.telnet_cmd - 0xfb
-                    if 0 <= i < 4:
-                        s_telnet_cmd = "CMD_" + ["WILL", "WOUN'T", "DO", "DON'T"][i]
-                    print("READ %s TELNET-CMD %s %02x"%(self.name, s_telnet_cmd, key))
+                    print("READ %s %02x (%s)"%(self.name, key, repr(chr(key))[1:-1]))
+
+                # uppercase
+                if self.uppercase_keys and ord('a') <= key <= ord('z'):
+                    key -= 0x20
+                self.keys.append(key)
+            elif DBG_ON == "parsed":
+                print("READ %s %02x"%(self.name, key))
+
+        elif self.state == 1:
+            if 0xFB <= key:
+                self.telnet_cmd = key
+                self.state = 2
+            elif 0xF0 <= key:
                 self.state = 0
-                self.telnet_protocol = True
-            elif self.state == 10:
-                if key == 0x5B:
-                    self.state = 11
-                else:
-                    self.state = 0
-            elif self.state == 11:
-                if key == 0x41:
-                    self.queue.put(ord('N')-0x40)
-                elif key == 0x42:
-                    self.queue.put(ord('O')-0x40)
-                elif key == 0x43:
-                    self.queue.put(ord('I')-0x40)
-                elif key == 0x44:
-                    self.queue.put(ord('H')-0x40)
+                if DBG_ON == "parsed":
+                    print("READ %s TELNET-CMD %02x"%(self.name, key))
+            else:
                 self.state = 0
+
+        elif self.state == 2:
+            if self.telnet_cmd == 0xFD and 0x06 <= key <= 0x10:
+                self.keys.append(key)
+            if DBG_ON == "parsed":
+                s_telnet_cmd = "%02x"%self.telnet_cmd
+                i = self.telnet_cmd - 0xfb
+                if 0 <= i < 4:
+                    s_telnet_cmd = "CMD_" + ["WILL", "WOUN'T", "DO", "DON'T"][i]
+                print("READ %s TELNET-CMD %s %02x"%(self.name, s_telnet_cmd, key))
+            self.state = 0
+            self.telnet_protocol = True
+        elif self.state == 10:
+            if key == 0x5B:
+                self.state = 11
             else:
                 self.state = 0
+        elif self.state == 11:
+            if key == 0x41:
+                self.keys.append(ord('N')-0x40)
+            elif key == 0x42:
+                self.keys.append(ord('O')-0x40)
+            elif key == 0x43:
+                self.keys.append(ord('I')-0x40)
+            elif key == 0x44:
+                self.keys.append(ord('H')-0x40)
+            self.state = 0
+        else:
+            self.state = 0
+
+    def listen(self):
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind(('localhost', self.port))
+        self.server_socket.listen(0x40)
+        abstract_io.select_fd_on("svr_socket:%d"%self.port, self.server_socket, self.callback_accept_socket)
 
     def callback_accept_socket(self, name, fd):
         if self.src_socket:
@@ -293,38 +445,72 @@ class SocketToSerialDevice:
             src_socket.send(b"connection already exists\n")
             src_socket.close()
         else:
-            self.src_socket, self.src_address = fd.accept()
-            abstract_io.select_fd_on("socket:%d"%self.port, self.src_socket, self.callback_read_socket)
-            self.setup_telnet_chars()
+            self.attach(*fd.accept())
+
+    def attach(self, src_socket, src_address):
+        self.src_socket, self.src_address = src_socket, src_address
+        self.src_socket.setblocking(False)
+        abstract_io.select_fd_on("socket:%d"%self.port, self.src_socket, self.callback_read_socket)
+        self.setup_telnet_chars()
+
+    def close_socket(self):
+        abstract_io.select_fd_off("socket:%d"%self.port)
+        abstract_io.select_write_fd_off("socket_out:%d"%self.port)
+        self.src_socket.close()
+        self.src_socket = None
+        self.out_buffer = bytearray()
+
+    def send(self, data):
+        self.out_buffer += data
+        abstract_io.mark_pending(self)
+
+    def flush(self):
+        """
+        send what the socket will take without waiting, the rest is sent
+        when select says it can take more
+        """
+        if not self.src_socket or not self.out_buffer:
+            return
+        try:
+            sent = self.src_socket.send(self.out_buffer)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self.close_socket()
+            return
+        del self.out_buffer[:sent]
+        if self.out_buffer:
+            abstract_io.select_write_fd_on("socket_out:%d"%self.port, self.src_socket,
+                lambda name, fd: self.flush())
+        else:
+            abstract_io.select_write_fd_off("socket_out:%d"%self.port)
 
     def setup_telnet_linemode(self):
-        self.src_socket.send(b"\xff\xfe\03")
-        self.src_socket.send(b"\xff\xfe\01")
+        self.send(b"\xff\xfe\03")
+        self.send(b"\xff\xfe\01")
 
     def setup_telnet_chars(self):
-        self.src_socket.send(b"\xff\xfd\03")
-        self.src_socket.send(b"\xff\xfd\01")
+        self.send(b"\xff\xfd\03")
+        self.send(b"\xff\xfd\01")
 
     def clear(self):
-        self.queue = queue.Queue()
+        self.keys.clear()
 
     ########################################
     # interaction with I/O ports
     ########################################
 
     def status_checked(self, cpu, in_tight_loop):
-        now_time = time.time_ns()
-
-        # mark output ready, to simulate the BAUD rate
-        if now_time - self.in_time >= BAUD_NS and not self.queue.empty():
-            self.serial_status_device.rx_rdy = True
-
-        out_was_not_ready = not self.serial_status_device.tx_rdy
-        # mark input ready, to simulate the BAUD rate
-        if now_time - self.out_time >= BAUD_NS:
-            self.serial_status_device.tx_rdy = True
+        changed = self.serial_status_device.update_ready(len(self.keys))
+        if len(self.out_buffer) >= SOCKET_HIGH_WATER:
+            # the client is behind, hold TX until some has been sent, the
+            # guest is left to wait in its loop, which waits on the socket
+            self.serial_status_device.tx_rdy = False
+            return self.rx_ready()
+        return changed
 
-        return out_was_not_ready or bool(not self.queue.empty())
+    def rx_ready(self):
+        return bool(self.keys)
 
     def get_IN_op(self, cpu, device_id):
         if cpu.pc - 2 == 0x000f:
@@ -341,23 +527,19 @@ class SocketToSerialDevice:
         else:
             self.in_tight_loop_count = 0
 
-        # if this really is a tight loop, chill
-        if in_tight_loop:
+        # if this really is a tight loop with nothing to read, wait for input
+        if in_tight_loop and not self.rx_ready():
             if cpu.debug_fh:
                 print("SLEEP KEY %04x %d"%(cpu.pc-2, elapsed_instr_count), file=cpu.debug_fh)
             abstract_io.sleep_for_input(abstract_io.SLEEP_FOR_IO)
-        else:
-            abstract_io.sleep_for_input(0.001)
 
-        if not self.queue.empty():
-            key = self.queue.get()
+        if self.keys:
+            key = self.keys.popleft()
             self.last_value = key
         else:
             key = self.last_value
 
-        # mark input not ready, to simulate the BAUD rate
-        self.serial_status_device.rx_rdy = False
-        self.in_time = time.time_ns()
+        self.serial_status_device.char_read()
 
         # return one key
         return key
@@ -366,15 +548,13 @@ class SocketToSerialDevice:
         if DBG_ON:
             print("WRITE %s %02x (%s)"%(self.name, c, repr(chr(c))[1:-1]))
 
-        # mark output not ready, to simulate the BAUD rate
-        self.out_time = time.time_ns()
-        self.serial_status_device.tx_rdy = False
+        self.serial_status_device.char_written()
 
         if c == 0xFF:
             return
 
         if self.src_socket:
-            self.src_socket.send(c.to_bytes(1, 'big'))
+            self.send(c.to_bytes(1, 'big'))
 
 class OutputSerialDevice():
     def __init__(self, name, serial_status_device, out_box):
@@ -389,21 +569,11 @@ class OutputSerialDevice():
         pass
 
     def status_checked(self, cpu, in_tight_loop):
-        now_time = time.time_ns()
-
-        if self.serial_status_device:
-            out_was_not_ready = not self.serial_status_device.tx_rdy
-            # mark input ready, to simulate the BAUD rate
-            if now_time - self.out_time >= BAUD_NS:
-                self.serial_status_device.tx_rdy = True
-
-        return out_was_not_ready or bool(not self.queue.empty() or self.read_fh)
+        return self.serial_status_device.update_ready(False)
 
     def put_OUT_op(self, device_id, c):
-        # mark output not ready, to simulate the BAUD rate
-        self.out_time = time.time_ns()
         if self.serial_status_device:
-            self.serial_status_device.tx_rdy = False
+            self.serial_status_device.char_written()
 
         if c == 0xFF:
             return
@@ -427,9 +597,9 @@ class KeyboardToSerialDevice():
         ########################################
 
         abstract_io.register_keyboard_callback(name, self.callback_keyboard)
-        self.queue = queue.Queue()
-        self.in_time = 0
-        self.out_time = 0
+        self.keys = collections.deque()
+        # keys from a file given to read, they go ahead of typed keys
+        self.read_keys = collections.deque()
         self.prev_instr_count = 0
         self.in_tight_loop_count = 0
         self.last_value = 0
@@ -452,21 +622,29 @@ class KeyboardToSerialDevice():
         # uppercase
         if self.uppercase_keys and ord('a') <= key <= ord('z'):
             key -= 0x20
-        self.queue.put(key)
-
-    def status_checked(self, cpu, in_tight_loop):
-        now_time = time.time_ns()
+        self.keys.append(key)
+
+    def fill_read_keys(self):
+        # a file given to read is taken a chunk at a time, as the guest reads it
+        if self.read_fh and not self.read_keys:
+            data = self.read_fh.read(READ_SIZE)
+            if data:
+                # convert LF to CR
+                self.read_keys.extend(data.replace(b'\n', b'\r'))
+            else:
+                self.read_fh.close()
+                self.read_fh = None
+                self.out_box.print('\n---read done ---\n', 1)
 
-        # mark output ready, to simulate the BAUD rate
-        if now_time - self.in_time >= BAUD_NS and (not self.queue.empty() or self.read_fh):
-            self.serial_status_device.rx_rdy = True
+    def rx_waiting(self):
+        self.fill_read_keys()
+        return len(self.read_keys) + len(self.keys)
 
-        out_was_not_ready = not self.serial_status_device.tx_rdy
-        # mark input ready, to simulate the BAUD rate
-        if now_time - self.out_time >= BAUD_NS:
-            self.serial_status_device.tx_rdy = True
+    def status_checked(self, cpu, in_tight_loop):
+        return self.serial_status_device.update_ready(self.rx_waiting())
 
-        return out_was_not_ready or bool(not self.queue.empty() or self.read_fh)
+    def rx_ready(self):
+        return self.rx_waiting() > 0
 
     def get_IN_op(self, cpu, device_id):
         # detect if we're in a tight loop
@@ -481,39 +659,22 @@ class KeyboardToSerialDevice():
         else:
             self.in_tight_loop_count = 0
 
-        # if this really is a tight loop, chill
-        if in_tight_loop:
+        # if this really is a tight loop with nothing to read, wait for input
+        if in_tight_loop and not self.rx_ready():
             if cpu.debug_fh:
                 print("SLEEP KEY %04x %d"%(cpu.pc-2, elapsed_instr_count), file=cpu.debug_fh)
             abstract_io.sleep_for_input(abstract_io.SLEEP_FOR_IO)
-        else:
-            abstract_io.sleep_for_input(0.001)
 
-        key = -1
-        if self.read_fh:
-            c = self.read_fh.read(1)
-            if len(c) == 0:
-                self.read_fh.close()
-                self.read_fh = None
-                self.out_box.print('\n---read done ---\n', 1)
-            else:
-                key = ord(c)
-
-                # convert CR to LF
-                if key == 0x0a:
-                    key = 0x0d
-
-        if key != -1:
-            pass
-        elif not self.queue.empty():
-            key = self.queue.get()
+        self.fill_read_keys()
+        if self.read_keys:
+            key = self.read_keys.popleft()
+        elif self.keys:
+            key = self.keys.popleft()
             self.last_value = key
         else:
             key = self.last_value
 
-        # mark input not ready, to simulate the BAUD rate
-        self.serial_status_device.rx_rdy = False
-        self.in_time = time.time_ns()
+        self.serial_status_device.char_read()
 
         if key == 3:
             abstract_io.ate_cntrl_c()
@@ -522,9 +683,7 @@ class KeyboardToSerialDevice():
         return key
 
     def put_OUT_op(self, device_id, c):
-        # mark output not ready, to simulate the BAUD rate
-        self.out_time = time.time_ns()
-        self.serial_status_device.tx_rdy = False
+        self.serial_status_device.char_written()
 
         if c == 0xFF:
             return
@@ -575,13 +734,25 @@ class VIODevice():
         if firmware:
             imsai_hex.HexLoader("IMSAI/viofm1.hex").boot(cpu)
 
-    def get_IN_op(self, cpu, device_id):
-        abstract_io.log("VIO-IN %02x"%(device_id))
+    def get_IN_handler(self, device_id):
         if device_id == 0xF6:
-            # x04 does:
-            # 005126 d31e d3  OUT xf6 [x80]
-            return 0x04
+            return self.get_status
+        return self.get_IN_op
 
+    def put_OUT_handler(self, device_id):
+        # every port is only logged
+        return self.put_OUT_op
+
+    def get_status(self, cpu, device_id):
+        abstract_io.log("VIO-IN %02x"%(device_id))
+        # x04 does:
+        # 005126 d31e d3  OUT xf6 [x80]
+        return 0x04
+
+    def get_IN_op(self, cpu, device_id):
+        if device_id == 0xF6:
+            return self.get_status(cpu, device_id)
+        abstract_io.log("VIO-IN %02x"%(device_id))
 
     def put_OUT_op(self, device_id, c):
         abstract_io.log("VIO-OUT %02x %02x"%(device_id, c))
@@ -1,14 +1,41 @@
+import os
+import mmap
 import time
+import zlib
+import queue
+import struct
+import json
+import tempfile
+import threading
+import collections
 import abstract_io
+import intel8080
 
 SEC_SZ = 0x80
 
+# IBM 3740 format
+TRACKS = 77
+SECS_PER_TRK = 26
+
+# changed sectors are written out to the image files this often, in instructions
+FLUSH_EVERY = 1000000
+
+# sector cache, per drive
+CACHE_SECTORS = 26*16
+CACHE_DIRTY_AGE = 2.0
+
+# host latency histogram, bucket n counts operations under 2**n microseconds
+LATENCY_BUCKETS = 24
+
 ########################################
 # I/O port by mem-map control
 ########################################
 
 OUT_PORT_GO = 0xFD
 
+# IN_PORT_STATUS while a command is queued for the I/O worker
+STATUS_BUSY = 0x80
+
 ########################################
 # I/O by port control
 ########################################
@@ -42,12 +69,597 @@ PORT_X = 0x11 # always 0
 # code
 ########################################
 
+class DiskImage:
+    """
+    a flat disk image, memory mapped
+    writes land in the mapping, and reach the file when flush is called
+    """
+    def __init__(self, image_file, read_only=False):
+        self.image_file = image_file
+        self.read_only = read_only
+        self.fh = open(image_file, 'rb' if read_only else 'r+b')
+        self.mm = None
+        if os.fstat(self.fh.fileno()).st_size:
+            self.mm = mmap.mmap(self.fh.fileno(), 0,
+                access=mmap.ACCESS_READ if read_only else mmap.ACCESS_WRITE)
+        self.dirty = False
+
+    def size(self):
+        return len(self.mm) if self.mm is not None else 0
+
+    def read(self, offset, size):
+        """
+        returns size bytes, past the end of the image reads as zeros
+        """
+        if self.mm is None or offset + size > len(self.mm):
+            data = self.mm[offset:offset+size] if self.mm is not None else b''
+            return data + bytes(size - len(data))
+        return self.mm[offset:offset+size]
+
+    def write(self, offset, data):
+        if self.read_only:
+            raise Exception("disk image %s is read only"%self.image_file)
+        end = offset + len(data)
+        if self.mm is None:
+            self.fh.truncate(end)
+            self.mm = mmap.mmap(self.fh.fileno(), 0)
+        elif end > len(self.mm):
+            self.mm.resize(end)
+        self.mm[offset:end] = data
+        self.dirty = True
+
+    def flush(self):
+        if self.dirty:
+            self.mm.flush()
+            self.dirty = False
+
+    def close(self):
+        self.flush()
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        self.fh.close()
+
+class Geometry:
+    """
+    the layout of an image: cylinders (tracks) of heads of sectors
+    sectors are numbered from 1, the image holds them in order of
+    cylinder, head, sector
+    """
+    def __init__(self, tracks, secs_per_trk, sec_size, heads=1):
+        self.tracks = tracks
+        self.secs_per_trk = secs_per_trk
+        self.sec_size = sec_size
+        self.heads = heads
+
+    def __repr__(self):
+        return "%dx%dx%dx%d"%(self.tracks, self.secs_per_trk, self.sec_size, self.heads)
+
+    def size(self):
+        return self.tracks * self.heads * self.secs_per_trk * self.sec_size
+
+    def track_bytes(self):
+        return self.secs_per_trk * self.sec_size
+
+    def valid(self, trk, head, sec):
+        return 0 <= trk < self.tracks and 0 <= head < self.heads and 1 <= sec <= self.secs_per_trk
+
+    def offset(self, trk, head, sec):
+        return ((trk * self.heads + head) * self.secs_per_trk + sec - 1) * self.sec_size
+
+GEOMETRIES = {
+    # IBM 3740, single sided single density
+    'sssd': Geometry(TRACKS, SECS_PER_TRK, SEC_SZ),
+    'sssd256': Geometry(TRACKS, 15, 256),
+    'ssdd': Geometry(TRACKS, 26, 256),
+    'dsdd': Geometry(TRACKS, 26, 256, 2),
+    'dsdd1024': Geometry(TRACKS, 8, 1024, 2),
+    # hard disks, 8MB and 32MB
+    'hd8m': Geometry(512, 32, 512),
+    'hd32m': Geometry(512, 32, 512, 4),
+}
+
+def parse_geometry(name):
+    """
+    a name from GEOMETRIES, or <tracks>x<sectors>x<bytes>[x<heads>]
+    """
+    if name in GEOMETRIES:
+        return GEOMETRIES[name]
+    try:
+        return Geometry(*(int(x) for x in name.split('x')))
+    except Exception:
+        raise Exception("bad disk geometry %s, use one of %s or TxSxB[xH]"%(
+            name, " ".join(GEOMETRIES)))
+
+class DiskTiming:
+    """
+    how long a command takes, in clock cycles: stepping to the track, the
+    head settling, waiting for the sector to come round, then transferring it,
+    the drive turns at rpm from cycle 0, rpm 0 is instant
+    """
+    def __init__(self, step_ms=0, settle_ms=0, rpm=0, error_revs=0):
+        self.step_ms = step_ms
+        self.settle_ms = settle_ms
+        self.rpm = rpm
+        self.error_revs = error_revs
+
+    def rev_cycles(self):
+        return 60 * intel8080.CLOCK_HZ / self.rpm
+
+    def cycles(self, geometry, from_trk, trk, sec, now):
+        if not self.rpm:
+            return 0
+        cycles = 0
+        if trk != from_trk:
+            cycles += (abs(trk - from_trk) * self.step_ms + self.settle_ms) * intel8080.CLOCK_HZ / 1000
+        sector_cycles = self.rev_cycles() / geometry.secs_per_trk
+        under_head = ((now + cycles) % self.rev_cycles()) / sector_cycles
+        cycles += ((sec - 1 - under_head) % geometry.secs_per_trk) * sector_cycles
+        return int(cycles + sector_cycles)
+
+    def error_cycles(self):
+        """
+        a controller retries a sector it can't find before giving up
+        """
+        if not self.rpm:
+            return 0
+        return int(self.error_revs * self.rev_cycles())
+
+TIMINGS = {
+    'instant': DiskTiming(),
+    # Shugart SA800 8" floppy
+    'period': DiskTiming(step_ms=8, settle_ms=8, rpm=360, error_revs=10),
+    # 8" winchester hard disk
+    'period_hd': DiskTiming(step_ms=0.1, settle_ms=15, rpm=3600, error_revs=10),
+}
+
+# sparse image file: header, index of one entry per sector, then sector data
+# the header holds the tracks, sectors per track, bytes per sector and heads,
+# version 1 headers have no heads, they are read as 1 head
+DSZ_MAGIC = b'IMSAI-DSZ-2\n'
+DSZ_HEADER = struct.Struct('<12sHHHH')
+DSZ_MAGIC_1 = b'IMSAI-DSZ-1\n'
+DSZ_HEADER_1 = struct.Struct('<12sHHH')
+DSZ_ENTRY = struct.Struct('<IHB')
+
+# how a sector is stored
+DSZ_ZERO = 0
+DSZ_E5 = 1
+DSZ_ZLIB = 2
+DSZ_RAW = 3
+
+class SparseImage:
+    """
+    a disk image with a sector index, each sector is either implicit (all
+    x00, or all xE5 as CP/M formats empty sectors), zlib compressed, or raw
+    changed sectors are rewritten in place when they fit, else appended
+    """
+    def __init__(self, image_file, read_only=False):
+        self.image_file = image_file
+        self.read_only = read_only
+        self.fh = open(image_file, 'rb' if read_only else 'r+b')
+        header = self.fh.read(DSZ_HEADER.size)
+        if header[:len(DSZ_MAGIC)] == DSZ_MAGIC:
+            magic, self.tracks, self.secs_per_trk, self.sec_size, self.heads = DSZ_HEADER.unpack(header)
+            self.index_pos = DSZ_HEADER.size
+        elif header[:len(DSZ_MAGIC_1)] == DSZ_MAGIC_1:
+            magic, self.tracks, self.secs_per_trk, self.sec_size = DSZ_HEADER_1.unpack_from(header)
+            self.heads = 1
+            self.index_pos = DSZ_HEADER_1.size
+        else:
+            raise Exception("%s is not a sparse disk image"%image_file)
+        self.sectors = self.tracks * self.heads * self.secs_per_trk
+        self.fh.seek(self.index_pos)
+        index = self.fh.read(DSZ_ENTRY.size * self.sectors)
+        # sector number -> [file position, stored length, how]
+        self.index = [list(DSZ_ENTRY.unpack_from(index, i * DSZ_ENTRY.size))
+            for i in range(self.sectors)]
+        self.end = self.fh.seek(0, os.SEEK_END)
+
+    @staticmethod
+    def create(image_file, tracks=TRACKS, secs_per_trk=SECS_PER_TRK, sec_size=SEC_SZ, fill=DSZ_E5, heads=1):
+        with open(image_file, 'wb') as fh:
+            fh.write(DSZ_HEADER.pack(DSZ_MAGIC, tracks, secs_per_trk, sec_size, heads))
+            fh.write(DSZ_ENTRY.pack(0, 0, fill) * (tracks * heads * secs_per_trk))
+        return SparseImage(image_file)
+
+    def size(self):
+        return self.sectors * self.sec_size
+
+    def read_sector(self, n):
+        pos, length, how = self.index[n]
+        if how == DSZ_ZERO:
+            return bytes(self.sec_size)
+        if how == DSZ_E5:
+            return b'\xE5' * self.sec_size
+        self.fh.seek(pos)
+        data = self.fh.read(length)
+        if how == DSZ_ZLIB:
+            data = zlib.decompress(data)
+        return data
+
+    def write_sector(self, n, data):
+        if data == bytes(self.sec_size):
+            how, stored = DSZ_ZERO, b''
+        elif data == b'\xE5' * self.sec_size:
+            how, stored = DSZ_E5, b''
+        else:
+            stored = zlib.compress(data)
+            how = DSZ_ZLIB
+            if len(stored) >= len(data):
+                how, stored = DSZ_RAW, data
+        pos, length, old_how = self.index[n]
+        if stored and not (old_how >= DSZ_ZLIB and len(stored) <= length):
+            pos = self.end
+            self.end += len(stored)
+        if stored:
+            self.fh.seek(pos)
+            self.fh.write(stored)
+        self.index[n] = [pos, len(stored), how]
+        self.fh.seek(self.index_pos + n * DSZ_ENTRY.size)
+        self.fh.write(DSZ_ENTRY.pack(pos, len(stored), how))
+
+    def read(self, offset, size):
+        """
+        returns size bytes, past the end of the image reads as zeros
+        """
+        first = offset // self.sec_size
+        last = min((offset + size - 1) // self.sec_size, self.sectors - 1)
+        data = b''.join(self.read_sector(n) for n in range(first, last + 1))
+        start = offset - first * self.sec_size
+        data = data[start:start+size]
+        return data + bytes(size - len(data))
+
+    def write(self, offset, data):
+        if self.read_only:
+            raise Exception("disk image %s is read only"%self.image_file)
+        if offset % self.sec_size or len(data) % self.sec_size:
+            raise Exception("sparse image writes must be whole sectors")
+        if offset + len(data) > self.size():
+            raise Exception("write past the end of %s"%self.image_file)
+        for i in range(0, len(data), self.sec_size):
+            self.write_sector((offset + i) // self.sec_size, bytes(data[i:i+self.sec_size]))
+
+    def flush(self):
+        if not self.read_only:
+            self.fh.flush()
+
+    def close(self):
+        self.flush()
+        self.fh.close()
+
+def open_image(image_file, read_only=False):
+    """
+    a .dsz file is a sparse image, anything else a flat one
+    """
+    if image_file.lower().endswith('.dsz'):
+        return SparseImage(image_file, read_only)
+    return DiskImage(image_file, read_only)
+
+def default_geometry(image):
+    """
+    a .dsz image knows its geometry, a flat one is taken to be IBM 3740
+    """
+    if isinstance(image, SparseImage):
+        return Geometry(image.tracks, image.secs_per_trk, image.sec_size, image.heads)
+    return GEOMETRIES['sssd']
+
+# delta file: the magic, then records of (image offset, size, sector data)
+OVERLAY_MAGIC = b'IMSAI-OVERLAY-1\n'
+OVERLAY_RECORD = struct.Struct('<II')
+
+class OverlayImage:
+    """
+    copy-on-write image: the base image is shared and read only, changed
+    sectors go to a small delta file, indexed by their offset in the image
+    at close the delta is kept for next time, discarded, or committed into
+    the base image
+    """
+    def __init__(self, image_file, delta_file, action='keep'):
+        self.image_file = image_file
+        self.delta_file = delta_file
+        self.action = action
+        self.base = open_image(image_file, read_only=action != 'commit')
+
+        # image offset -> (delta file position of the data, size)
+        self.index = {}
+        # the smallest size in the index, the step a read is made up in
+        self.sec_size = 0
+        if os.path.exists(delta_file):
+            self.fh = open(delta_file, 'r+b')
+            self.read_index()
+        else:
+            self.fh = open(delta_file, 'w+b')
+            self.fh.write(OVERLAY_MAGIC)
+        self.end = self.fh.seek(0, os.SEEK_END)
+
+    def read_index(self):
+        if self.fh.read(len(OVERLAY_MAGIC)) != OVERLAY_MAGIC:
+            raise Exception("%s is not an overlay file"%self.delta_file)
+        while True:
+            record = self.fh.read(OVERLAY_RECORD.size)
+            if len(record) < OVERLAY_RECORD.size:
+                break
+            offset, size = OVERLAY_RECORD.unpack(record)
+            self.index[offset] = (self.fh.tell(), size)
+            self.sec_size = min(self.sec_size or size, size)
+            self.fh.seek(size, os.SEEK_CUR)
+
+    def size(self):
+        size = self.base.size()
+        for offset, (pos, sec_size) in self.index.items():
+            size = max(size, offset + sec_size)
+        return size
+
+    def read(self, offset, size):
+        entry = self.index.get(offset, None)
+        if entry and entry[1] == size:
+            self.fh.seek(entry[0])
+            return self.fh.read(size)
+        if not self.index:
+            return self.base.read(offset, size)
+
+        # a read of more than one sector, such as a track read ahead, is
+        # made up a sector at a time, from the delta where it has the sector
+        data = bytearray(self.base.read(offset, size))
+        sec_size = self.sec_size
+        end = offset + size
+        for sec_offset in range(offset - offset % sec_size, end, sec_size):
+            entry = self.index.get(sec_offset, None)
+            if not entry:
+                continue
+            pos, sec_size_written = entry
+            start = max(sec_offset, offset)
+            stop = min(sec_offset + sec_size_written, end)
+            self.fh.seek(pos + start - sec_offset)
+            data[start-offset:stop-offset] = self.fh.read(stop - start)
+        return bytes(data)
+
+    def write(self, offset, data):
+        entry = self.index.get(offset, None)
+        if entry and entry[1] == len(data):
+            self.fh.seek(entry[0])
+        else:
+            self.fh.seek(self.end)
+            self.fh.write(OVERLAY_RECORD.pack(offset, len(data)))
+            self.index[offset] = (self.end + OVERLAY_RECORD.size, len(data))
+            self.sec_size = min(self.sec_size or len(data), len(data))
+            self.end += OVERLAY_RECORD.size + len(data)
+        self.fh.write(data)
+
+    def flush(self):
+        self.fh.flush()
+
+    def commit(self):
+        """
+        copy the changed sectors into the base image
+        """
+        for offset, (pos, size) in sorted(self.index.items()):
+            self.fh.seek(pos)
+            self.base.write(offset, self.fh.read(size))
+        self.base.flush()
+
+    def close(self):
+        if self.action == 'commit':
+            self.commit()
+        self.fh.close()
+        self.base.close()
+        if self.action in ('commit', 'discard'):
+            os.remove(self.delta_file)
+
+class SectorCache:
+    """
+    LRU cache of sectors in front of a disk image
+    writes are held in the cache, and written back when evicted, on flush,
+    or by flush_aged once they have been dirty for dirty_age seconds
+    a second read on the same track as the previous one reads the rest of
+    the track ahead, CP/M reads a track through its sector skew, not in order
+    """
+    def __init__(self, image, max_sectors=CACHE_SECTORS, dirty_age=CACHE_DIRTY_AGE,
+            track_bytes=SECS_PER_TRK*SEC_SZ):
+        self.image = image
+        self.max_sectors = max_sectors
+        self.dirty_age = dirty_age
+        self.track_bytes = track_bytes
+
+        # offset -> sector data, oldest use first
+        self.sectors = collections.OrderedDict()
+        # offset -> time it was first written since the last flush
+        self.dirty = {}
+        # the track of the previous read
+        self.last_track = -1
+
+        self.hits = 0
+        self.misses = 0
+        self.read_aheads = 0
+        self.write_backs = 0
+        self.evictions = 0
+
+    def size(self):
+        size = self.image.size()
+        for offset in self.dirty:
+            size = max(size, offset + len(self.sectors[offset]))
+        return size
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'read_aheads': self.read_aheads,
+            'write_backs': self.write_backs,
+            'evictions': self.evictions,
+            'cached': len(self.sectors),
+            'dirty': len(self.dirty),
+        }
+
+    def add(self, offset, data):
+        self.sectors[offset] = data
+        self.sectors.move_to_end(offset)
+        while len(self.sectors) > self.max_sectors:
+            old_offset, old_data = self.sectors.popitem(last=False)
+            self.evictions += 1
+            if old_offset in self.dirty:
+                self.write_back(old_offset, old_data)
+
+    def write_back(self, offset, data):
+        del self.dirty[offset]
+        self.image.write(offset, data)
+        self.write_backs += 1
+
+    def read(self, offset, size):
+        track = offset // self.track_bytes
+        sequential = track == self.last_track
+        self.last_track = track
+
+        data = self.sectors.get(offset, None)
+        if data is not None and len(data) == size:
+            self.hits += 1
+            self.sectors.move_to_end(offset)
+            return data
+        self.misses += 1
+
+        if sequential and self.track_bytes % size == 0:
+            # read the whole track, keep the sectors not already cached
+            track_offset = offset - offset % self.track_bytes
+            track = self.image.read(track_offset, self.track_bytes)
+            self.read_aheads += 1
+            for sec_offset in range(track_offset, track_offset + self.track_bytes, size):
+                if sec_offset not in self.sectors:
+                    i = sec_offset - track_offset
+                    self.add(sec_offset, track[i:i+size])
+            data = self.sectors.get(offset, None)
+            if data is None:
+                # a cache smaller than a track
+                i = offset - track_offset
+                data = track[i:i+size]
+            return data
+
+        data = self.image.read(offset, size)
+        self.add(offset, data)
+        return data
+
+    def write(self, offset, data):
+        data = bytes(data)
+        if offset not in self.dirty:
+            self.dirty[offset] = time.monotonic()
+        self.add(offset, data)
+
+    def flush_aged(self):
+        """
+        write back the sectors that have been dirty for too long
+        """
+        too_old = time.monotonic() - self.dirty_age
+        for offset, dirty_time in list(self.dirty.items()):
+            if dirty_time <= too_old:
+                self.write_back(offset, self.sectors[offset])
+        self.image.flush()
+
+    def flush(self):
+        for offset in sorted(self.dirty):
+            self.write_back(offset, self.sectors[offset])
+        self.image.flush()
+
+    def close(self):
+        self.flush()
+        self.image.close()
+
+class DiskStats:
+    """
+    counters and host latency histograms of one drive
+    """
+    def __init__(self):
+        self.counts = {
+            'reads': 0,
+            'writes': 0,
+            'bytes_read': 0,
+            'bytes_written': 0,
+            'seeks': 0,
+            'errors': 0,
+            'flushes': 0,
+        }
+        # operation -> [count per bucket]
+        self.latency = {}
+        self.trk = 0
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+    def seek(self, trk):
+        if trk != self.trk:
+            self.counts['seeks'] += 1
+            self.trk = trk
+
+    def time(self, operation, seconds):
+        bucket = min(int(seconds * 1000000).bit_length(), LATENCY_BUCKETS - 1)
+        if operation not in self.latency:
+            self.latency[operation] = [0]*LATENCY_BUCKETS
+        self.latency[operation][bucket] += 1
+
+    def histograms(self):
+        """
+        operation -> {"<N us": count}, for the buckets that have any
+        """
+        return {
+            operation: {"<%dus"%(1 << n): count for n, count in enumerate(buckets) if count}
+            for operation, buckets in self.latency.items()}
+
+def overlay_file(image_file, overlay_dir=None):
+    """
+    the delta file of an image: kept as <name>.ovl in overlay_dir, or,
+    without a directory, private to this process in the temp directory
+    """
+    name = os.path.basename(image_file)
+    if overlay_dir:
+        return os.path.join(overlay_dir, name + '.ovl')
+    return os.path.join(tempfile.gettempdir(), "%s.%d.ovl"%(name, os.getpid()))
+
 class DiskDevice:
-    def __init__(self, device_factory, disk_type, image_files):
+    def __init__(self, device_factory, disk_type, image_files, cache_sectors=CACHE_SECTORS,
+            overlay_action=None, overlay_dir=None, async_io=False, timing='instant'):
+        """
+        image_files: images or host directories, each may end with
+            @<geometry>, see parse_geometry, the default is the geometry in a
+            .dsz header, or IBM 3740 (sssd), and with @<timing> from TIMINGS,
+            the default is timing
+        overlay_action: None to write to the images, otherwise use copy-on-write
+            overlays, and at exit 'keep', 'discard' or 'commit' their changes
+        async_io: run commands on a worker thread, the guest keeps running and
+            sees the controller busy until the command is done
+        """
         self.disks = [None]*16
+        self.geometries = [None]*16
+        self.timings = [None]*16
+        self.stats = [DiskStats() for i in range(16)]
+        # where each drive's head is
+        self.head_trks = [0]*16
         disk_number = 1
         for image_file in image_files:
-            self.disks[disk_number] = open(image_file, 'r+b')
+            geometry = None
+            disk_timing = TIMINGS[timing]
+            image_file, *options = image_file.split('@')
+            for option in options:
+                if option in TIMINGS:
+                    disk_timing = TIMINGS[option]
+                else:
+                    geometry = parse_geometry(option)
+            if os.path.isdir(image_file):
+                # made up from the host files, see imsai_hostdir, it is
+                # neither cached nor overlaid so host changes show through
+                import imsai_hostdir
+                geometry = geometry or GEOMETRIES['sssd']
+                image = imsai_hostdir.HostDirImage(image_file, geometry)
+            elif overlay_action:
+                image = OverlayImage(image_file, overlay_file(image_file, overlay_dir), overlay_action)
+                base = image.base
+            else:
+                base = image = open_image(image_file)
+            if not geometry:
+                geometry = default_geometry(base)
+            if cache_sectors and not os.path.isdir(image_file):
+                image = SectorCache(image, cache_sectors, track_bytes=geometry.track_bytes())
+            self.disks[disk_number] = image
+            self.geometries[disk_number] = geometry
+            self.timings[disk_number] = disk_timing
             disk_number += 1
         self.state = 0
         self.cmd = [0]*4
@@ -64,56 +676,174 @@ class DiskDevice:
         self.bytes_from_in_ports = [0]*(LAST_PORT-FIRST_PORT+1)
         self.new_status = 0
 
+        # the images are shared by the worker and the emulation thread
+        self.lock = threading.RLock()
+        # commands submitted and not yet finished
+        self.outstanding = 0
+        self.commands = None
+        if async_io:
+            self.commands = queue.Queue()
+            self.worker = threading.Thread(target=self.work, name="disk-io", daemon=True)
+            self.worker.start()
+
     def boot(self, cpu):
         self.cpu = cpu
+        cpu.add_periodic(lambda cpu: self.flush(True), FLUSH_EVERY)
 
         # pg 44, 3-4 System Initialization
 
         # read track 0, sector 1 into x0000
-        fh = self.disks[1]
-        fh.seek(0)
-        sector = fh.read(SEC_SZ)
-        if len(sector) != SEC_SZ:
+        image = self.disks[1]
+        sec_size = self.geometries[1].sec_size
+        if image.size() < sec_size:
             print("can't read boot sector")
             cpu.halt = True
-        for i in range(SEC_SZ):
-            cpu.mem[i] = sector[i]
+        cpu.mem[0:sec_size] = image.read(0, sec_size)
 
-        # IBM 3740 format
+        # the default is IBM 3740 format
         #   77 tracks
         #   26 sectors per track
         #   128 bytes per sector
 
         # up to 16 command strings
 
+    def busy(self):
+        return self.outstanding > 0
+
+    def submit(self, args, done):
+        """
+        execute_cmd(*args), then done(status), on the worker thread if there is
+        one, done is called no earlier than the disk timing allows
+        """
+        request = {'args': args, 'done': done, 'status': None, 'due': True, 'finished': False}
+        with self.lock:
+            self.outstanding += 1
+        cycles = self.command_cycles(*args)
+        if cycles:
+            request['due'] = False
+            self.cpu.add_timer(lambda cpu: self.finish(request, due=True), cycles)
+        if self.commands:
+            self.commands.put(request)
+        else:
+            with self.lock:
+                status = self.execute_cmd(*args)
+            self.finish(request, status)
+
+    def finish(self, request, status=None, due=False):
+        """
+        called with the status when the command is done and with due when its
+        time is up, from either thread, the guest sees the status after both,
+        and only once
+        """
+        with self.lock:
+            if status is not None:
+                request['status'] = status
+            if due:
+                request['due'] = True
+            if request['finished'] or not request['due'] or request['status'] is None:
+                return
+            request['finished'] = True
+            self.outstanding -= 1
+        request['done'](request['status'])
+
+    def work(self):
+        while True:
+            request = self.commands.get()
+            if request is None:
+                self.commands.task_done()
+                return
+            try:
+                with self.lock:
+                    status = self.execute_cmd(*request['args'])
+            except Exception as e:
+                abstract_io.log("D-ERR %s"%e, 1)
+                status = 0xFF
+            self.finish(request, status)
+            self.commands.task_done()
+
+    def decode(self, cmd_byte, fmt, trk):
+        """
+        returns command number, disk number, full track and head
+        """
+        cmd = (cmd_byte >> 4) & 0x0F
+        disk_number = cmd_byte & 0x0F
+
+        # TODO: why?
+        if disk_number >= 3:
+            disk_number -= 1
+
+        trk |= (fmt & 0x01) << 8
+        head = ((fmt >> 2) & 0x0F) * 2 + ((fmt >> 1) & 0x01)
+        return cmd, disk_number, trk, head
+
+    def command_cycles(self, cmd_byte, status, fmt, trk, sec, addr):
+        """
+        how long the command takes, from the timing of its drive, the head is
+        moved to the new track
+        """
+        if status:
+            return 0
+        cmd, disk_number, trk, head = self.decode(cmd_byte, fmt, trk)
+        disk_timing = self.timings[disk_number] or TIMINGS['instant']
+        geometry = self.geometries[disk_number]
+        if not geometry or cmd not in (0x1, 0x2) or not geometry.valid(trk, head, sec):
+            return disk_timing.error_cycles()
+        cycles = disk_timing.cycles(geometry, self.head_trks[disk_number], trk, sec, self.cpu.cycles)
+        self.head_trks[disk_number] = trk
+        return cycles
+
+    def get_IN_handler(self, device_id):
+        if device_id == IN_PORT_STATUS:
+            return self.get_status
+        return self.get_IN_op
+
+    def put_OUT_handler(self, device_id):
+        if device_id == OUT_PORT_GO:
+            return self.put_go
+        return self.put_OUT_op
+
+    def get_status(self, cpu, device_id):
+        if self.busy():
+            return STATUS_BUSY
+        return self.new_status
+
     def get_IN_op(self, cpu, device_id):
         if device_id == IN_PORT_STATUS:
-            return self.new_status
+            return self.get_status(cpu, device_id)
         abstract_io.log("D-STATUS %02x"%device_id, 7)
         return 0
 
+    def put_go(self, device_id, value):
+        """
+        the address of a command string, then 0 to run it
+        """
+        if self.state == 0:
+            if value == 0x00:
+                cmd_byte = self.cpu.mem[self.cmd_addr]
+                status = self.cpu.mem[self.cmd_addr + 1]
+                fmt = self.cpu.mem[self.cmd_addr + 2]
+                trk = self.cpu.mem[self.cmd_addr + 3]
+                sec = self.cpu.mem[self.cmd_addr + 4]
+                addr_l = self.cpu.mem[self.cmd_addr + 5]
+                addr_h = self.cpu.mem[self.cmd_addr + 6]
+                addr = addr_l + addr_h * 0x100
+                # the status byte stays as it is until the command is done
+                status_addr = self.cmd_addr + 1
+                def done(status):
+                    self.cpu.mem[status_addr] = status
+                self.submit((cmd_byte, status, fmt, trk, sec, addr), done)
+            elif value == 0x10:
+                self.state = 1
+        elif self.state == 1:
+            self.cmd_addr = value
+            self.state = 2
+        elif self.state == 2:
+            self.cmd_addr += value * 0x100
+            self.state = 0
+
     def put_OUT_op(self, device_id, value):
         if device_id == OUT_PORT_GO:
-            if self.state == 0:
-                if value == 0x00:
-                    cmd_byte = self.cpu.mem[self.cmd_addr]
-                    status = self.cpu.mem[self.cmd_addr + 1]
-                    fmt = self.cpu.mem[self.cmd_addr + 2]
-                    trk = self.cpu.mem[self.cmd_addr + 3]
-                    sec = self.cpu.mem[self.cmd_addr + 4]
-                    addr_l = self.cpu.mem[self.cmd_addr + 5]
-                    addr_h = self.cpu.mem[self.cmd_addr + 6]
-                    addr = addr_l + addr_h * 0x100
-                    status = self.execute_cmd(cmd_byte, status, fmt, trk, sec, addr)
-                    self.cpu.mem[self.cmd_addr+1] = status
-                elif value == 0x10:
-                    self.state = 1
-            elif self.state == 1:
-                self.cmd_addr = value
-                self.state = 2
-            elif self.state == 2:
-                self.cmd_addr += value * 0x100
-                self.state = 0
+            self.put_go(device_id, value)
         elif FIRST_PORT <= device_id <= LAST_PORT:
             self.bytes_from_in_ports[device_id - FIRST_PORT] = value
             if device_id == OUT_PORT_READ:
@@ -125,12 +855,109 @@ class DiskDevice:
                 trk = cfg(OUT_PORT_TRK)
                 sec = cfg(OUT_PORT_SEC)
                 addr = cfg(OUT_PORT_ADDR_L) + 0x100*cfg(OUT_PORT_ADDR_H)
-                old_status = self.execute_cmd(cmd_byte, status, fmt, trk, sec, addr)
                 abstract_io.log("X: " + repr(self.bytes_from_in_ports))
-                if old_status == 1:
-                    self.new_status = 0
-                else:
-                    self.new_status = 1
+                def done(old_status):
+                    if old_status == 1:
+                        self.new_status = 0
+                    else:
+                        self.new_status = 1
+                self.submit((cmd_byte, status, fmt, trk, sec, addr), done)
+
+    def read_sector(self, disk_number, trk, sec, addr, head=0):
+        """
+        copy one sector from the image into memory at addr
+        """
+        geometry = self.geometries[disk_number]
+        mem = self.cpu.mem
+        size = max(0, min(geometry.sec_size, len(mem) - addr))
+        stats = self.stats[disk_number]
+        with self.lock:
+            start = time.perf_counter()
+            mem[addr:addr+size] = self.disks[disk_number].read(geometry.offset(trk, head, sec), size)
+            stats.time('read', time.perf_counter() - start)
+            stats.seek(trk)
+            stats.count('reads')
+            stats.count('bytes_read', size)
+
+    def write_sector(self, disk_number, trk, sec, addr, head=0):
+        """
+        copy one sector from memory at addr into the image
+        """
+        geometry = self.geometries[disk_number]
+        sector = bytes(self.cpu.mem[addr:addr+geometry.sec_size])
+        sector += bytes(geometry.sec_size - len(sector))
+        stats = self.stats[disk_number]
+        with self.lock:
+            start = time.perf_counter()
+            self.disks[disk_number].write(geometry.offset(trk, head, sec), sector)
+            stats.time('write', time.perf_counter() - start)
+            stats.seek(trk)
+            stats.count('writes')
+            stats.count('bytes_written', len(sector))
+
+    def flush(self, aged_only=False):
+        """
+        write changed sectors out to the image files
+        aged_only: only those a sector cache has held dirty for too long
+        """
+        with self.lock:
+            for disk_number, image in enumerate(self.disks):
+                if image:
+                    start = time.perf_counter()
+                    if aged_only and isinstance(image, SectorCache):
+                        write_backs = image.write_backs
+                        image.flush_aged()
+                        if image.write_backs == write_backs:
+                            # nothing was old enough
+                            continue
+                    else:
+                        image.flush()
+                    self.stats[disk_number].time('flush', time.perf_counter() - start)
+                    self.stats[disk_number].count('flushes')
+
+    def cache_stats(self):
+        """
+        drive name -> sector cache counters
+        """
+        stats = {}
+        with self.lock:
+            for disk_number, image in enumerate(self.disks):
+                if isinstance(image, SectorCache):
+                    stats[chr(ord('A')-1+disk_number)] = image.stats()
+        return stats
+
+    def disk_stats(self):
+        """
+        drive name -> counters, sector cache counters and latency histograms
+        """
+        cache_stats = self.cache_stats()
+        stats = {}
+        with self.lock:
+            for disk_number, image in enumerate(self.disks):
+                drive_stats = self.stats[disk_number]
+                if not image and not any(drive_stats.counts.values()):
+                    continue
+                drive = chr(ord('A')-1+disk_number)
+                stats[drive] = dict(drive_stats.counts)
+                if drive in cache_stats:
+                    stats[drive]['cache'] = cache_stats[drive]
+                stats[drive]['latency'] = drive_stats.histograms()
+        return stats
+
+    def save_stats(self, stats_file):
+        with open(stats_file, 'w') as fh:
+            json.dump(self.disk_stats(), fh, indent=2, sort_keys=True)
+
+    def done(self):
+        if self.commands:
+            # finish what the guest asked for, then stop the worker
+            self.commands.put(None)
+            self.worker.join()
+            self.commands = None
+        with self.lock:
+            for image in self.disks:
+                if image:
+                    image.close()
 
     def execute_cmd(self, cmd_byte, status, fmt, trk, sec, addr):
         """
@@ -170,61 +997,54 @@ class DiskDevice:
             1-15 for SD 256 byte sectors
             1-26 for DD 256 byte sectors
             1-8 for DD 1024 byte sectors
+
+        the sector length must match the geometry of the image, the track
+        is extended by fmt b0, and side and platter select the head
         """
 
         if status:
             return status
 
-        cmd = (cmd_byte >> 4) & 0x0F
-        disk_number = cmd_byte & 0x0F
-
-        # TODO: why?
-        if disk_number >= 3:
-            disk_number -= 1
-
+        cmd, disk_number, trk, head = self.decode(cmd_byte, fmt, trk)
         disk_name = chr(ord('A')-1+disk_number)
-        fh = self.disks[disk_number]
+        image = self.disks[disk_number]
+
+        # which sector
+        if image:
+            geometry = self.geometries[disk_number]
+            if geometry.sec_size != SEC_SZ << (fmt >> 6) or not geometry.valid(trk, head, sec):
+                image = None
 
         # command number is the upper nibble of cmd [page 45 of 160, DSK-35]
         # disk sector write
         if cmd == 0x1:
-            if fh:
+            if image:
                 abstract_io.log("D-WR drive:%s fmt:x%02x trk:%2d sec:%2d addr:x%04x"%(
                     disk_name, fmt, trk, sec, addr), 3)
-                sector = bytearray(SEC_SZ)
-                for i in range(SEC_SZ):
-                    sector[i] = self.cpu.mem[addr + i]
-                fh.seek(SEC_SZ*((sec-1) + 26*trk))
-                fh.write(sector)
+                self.write_sector(disk_number, trk, sec, addr, head)
                 return 1
             else:
                 abstract_io.log("D-WR drive:%s fmt:x%02x trk:%2d sec:%2d addr:x%04x"%(
                     disk_name, fmt, trk, sec, addr), 1)
-                time.sleep(2)
+                self.stats[disk_number].count('errors')
                 return 0x9F
 
         # disk sector read
         # pg "FIF - 7", "page 63 of 160"
         elif cmd == 0x2:
-            if fh and 1 <= sec <= 26 and 0 <= trk <= 1000:
-                seek_addr = SEC_SZ*((sec-1) + 26*trk)
+            if image:
                 abstract_io.log("D-RD drive:%s fmt:x%02x trk:%2d sec:%2d addr:x%04x"%(
                     disk_name, fmt, trk, sec, addr), 3)
-                fh.seek(seek_addr)
-                sector = fh.read(SEC_SZ)
-                if len(sector) != SEC_SZ:
-                    sector = bytearray(SEC_SZ)
-                for i in range(SEC_SZ):
-                    self.cpu.mem[addr + i] = sector[i]
+                self.read_sector(disk_number, trk, sec, addr, head)
                 return 1
             else:
-                time.sleep(2)
                 abstract_io.log("D-RD drive:%s fmt:x%02x trk:%2d sec:%2d addr:x%04x"%(
                     disk_name, fmt, trk, sec, addr), 1)
+                self.stats[disk_number].count('errors')
                 return 2
         else:
             abstract_io.log("D cmd:%d cmd_byte:x%02x fmt:x%02x trk:%2d sec:%2d addr:x%04x"%(
                 cmd, cmd_byte, fmt, trk, sec, addr), 1)
-            time.sleep(2)
+            self.stats[disk_number].count('errors')
             return 0xFF
 
@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+
+# convert between flat .dsk images and sparse .dsz images
+#
+#   ./imsai_dsz.py DISKS/blank1.dsk DISKS/blank1.dsz    flat to sparse
+#   ./imsai_dsz.py DISKS/blank1.dsz DISKS/blank1.dsk    sparse to flat
+#   ./imsai_dsz.py DISKS/blank1.dsz                     show what is stored
+#   ./imsai_dsz.py -g=hd8m DISKS/hd.dsz                 create a blank image
+#
+# options for flat to sparse: -t=<tracks> -s=<sectors per track> -b=<bytes per sector>
+# -h=<heads>, or -g=<geometry> from imsai_disk.GEOMETRIES
+
+import os
+import sys
+
+import imsai_disk
+
+def to_sparse(dsk_file, dsz_file, tracks, secs_per_trk, sec_size, heads):
+    flat = imsai_disk.DiskImage(dsk_file, read_only=True)
+    if not tracks:
+        cylinder_bytes = heads * secs_per_trk * sec_size
+        tracks = max(imsai_disk.TRACKS, (flat.size() + cylinder_bytes - 1) // cylinder_bytes)
+    sparse = imsai_disk.SparseImage.create(dsz_file, tracks, secs_per_trk, sec_size, heads=heads)
+    for offset in range(0, sparse.size(), sec_size):
+        sparse.write(offset, flat.read(offset, sec_size))
+    flat.close()
+    sparse.close()
+
+def to_flat(dsz_file, dsk_file):
+    sparse = imsai_disk.SparseImage(dsz_file, read_only=True)
+    with open(dsk_file, 'wb') as fh:
+        for n in range(sparse.sectors):
+            fh.write(sparse.read_sector(n))
+    sparse.close()
+
+def create(dsz_file, tracks, secs_per_trk, sec_size, heads):
+    imsai_disk.SparseImage.create(dsz_file, tracks or imsai_disk.TRACKS, secs_per_trk, sec_size,
+        heads=heads).close()
+
+def info(dsz_file):
+    sparse = imsai_disk.SparseImage(dsz_file, read_only=True)
+    counts = [0]*4
+    stored = 0
+    for pos, length, how in sparse.index:
+        counts[how] += 1
+        stored += length
+    print("%s: %d tracks, %d heads, %d sectors/track, %d bytes/sector"%(
+        dsz_file, sparse.tracks, sparse.heads, sparse.secs_per_trk, sparse.sec_size))
+    print("  x00 filled: %d  xE5 filled: %d  compressed: %d  raw: %d"%tuple(counts))
+    print("  %d bytes of sector data, %d bytes on disk, %d bytes flat"%(
+        stored, os.path.getsize(dsz_file), sparse.size()))
+    sparse.close()
+
+def main(args):
+    tracks = 0
+    secs_per_trk = imsai_disk.SECS_PER_TRK
+    sec_size = imsai_disk.SEC_SZ
+    heads = 1
+    files = []
+    for arg in args:
+        if arg.startswith('-t='):
+            tracks = int(arg[3:])
+        elif arg.startswith('-s='):
+            secs_per_trk = int(arg[3:])
+        elif arg.startswith('-b='):
+            sec_size = int(arg[3:])
+        elif arg.startswith('-h='):
+            heads = int(arg[3:])
+        elif arg.startswith('-g='):
+            geometry = imsai_disk.parse_geometry(arg[3:])
+            tracks = geometry.tracks
+            secs_per_trk = geometry.secs_per_trk
+            sec_size = geometry.sec_size
+            heads = geometry.heads
+        else:
+            files.append(arg)
+
+    if len(files) == 1 and files[0].lower().endswith('.dsz') and not os.path.exists(files[0]):
+        create(files[0], tracks, secs_per_trk, sec_size, heads)
+    elif len(files) == 1 and files[0].lower().endswith('.dsz'):
+        info(files[0])
+    elif len(files) == 2 and files[1].lower().endswith('.dsz'):
+        to_sparse(files[0], files[1], tracks, secs_per_trk, sec_size, heads)
+    elif len(files) == 2 and files[0].lower().endswith('.dsz'):
+        to_flat(files[0], files[1])
+    else:
+        print("usage: imsai_dsz.py [-t=N -s=N -b=N -h=N | -g=GEOMETRY] in.dsk out.dsz | in.dsz out.dsk | in.dsz")
+        return 2
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
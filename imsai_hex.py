@@ -1,30 +1,174 @@
 import re
 import os
+import json
+import struct
+import hashlib
+import tempfile
+
+# the cache of a loaded .hex file: magic, the lengths of a JSON header that
+# describes the source files and memory segments and of the JSON symbols,
+# then the bytes of the segments
+CACHE_MAGIC = b'IMSAIHX2'
+CACHE_HEADER = struct.Struct('<8sII')
+
+def file_hash(file_name):
+    with open(file_name, 'rb') as fh:
+        return hashlib.sha1(fh.read()).hexdigest()
 
 class HexLoader:
-    def __init__(self, hex_file):
+    def __init__(self, hex_file, use_cache=True):
         self.hex_file = hex_file
         self.sym_file = hex_file[:-3] + 'symbols'
         self.asm_file = hex_file[:-3] + 'asm'
+        self.cache_file = hex_file[:-3] + 'cache'
+        self.use_cache = use_cache
+
+        # memory is loaded by boot, symbols only once the cpu needs them
+        self.segments = []
+        self.signatures = []
+        self.file_symbols = []
+        self.hex_symbols = []
+        self.sources_read = False
+        # the JSON symbols from the cache, not yet parsed
+        self.cached_symbols = None
+        self.checksum_errors = 0
 
     def boot(self, cpu):
         if os.path.exists(self.hex_file):
+            if not (self.use_cache and self.load_cache(cpu)):
+                self.read_hex(cpu)
+                if self.use_cache and not self.checksum_errors:
+                    self.read_sources()
+                    self.save_cache()
+            cpu.add_symbol_loader(self.load_symbols)
+            return True
+
+    def read_sources(self):
+        if not self.sources_read:
             if os.path.exists(self.asm_file):
-                self.read_asm(cpu)
+                self.read_asm()
             if os.path.exists(self.sym_file):
-                self.read_symbols(cpu)
-            self.read_hex(cpu)
-            return True
+                self.read_symbols()
+            self.sources_read = True
+
+    def load_symbols(self, cpu):
+        """
+        add the symbols to the cpu, from the cache or the source files
+        """
+        if self.cached_symbols is not None:
+            cached = json.loads(self.cached_symbols)
+            signatures, symbols = cached['signatures'], cached['symbols']
+        else:
+            self.read_sources()
+            signatures, symbols = self.signatures, self.file_symbols + self.hex_symbols
+        for sym, sym_bytes in signatures:
+            cpu.add_symbol_signature(sym, sym_bytes)
+        for sym, addr in symbols:
+            cpu.add_symbol(sym, addr)
+
+    def set_mem(self, cpu, addr, data):
+        # the segments keep all of the record, for the cache, only what fits
+        # goes into memory
+        fits = data[:max(0, len(cpu.mem) - addr)]
+        cpu.mem[addr:addr+len(fits)] = fits
+        if self.segments and self.segments[-1][0] + len(self.segments[-1][1]) == addr:
+            self.segments[-1][1] += data
+        else:
+            self.segments.append([addr, bytearray(data)])
 
-    def read_symbols(self, cpu):
+    ########################################
+    # cache
+    ########################################
+
+    def sources(self):
+        return [f for f in (self.hex_file, self.asm_file, self.sym_file) if os.path.exists(f)]
+
+    def load_cache(self, cpu):
+        """
+        returns True if the cache is there and its sources haven't changed,
+        a source with a new mtime still counts as unchanged if its hash is,
+        memory is only loaded once the whole cache has been checked
+        """
+        try:
+            with open(self.cache_file, 'rb') as fh:
+                data = fh.read()
+            magic, header_size, symbols_size = CACHE_HEADER.unpack_from(data)
+            if magic != CACHE_MAGIC:
+                return False
+            pos = CACHE_HEADER.size
+            header = json.loads(data[pos:pos+header_size])
+
+            if [source[0] for source in header['sources']] != self.sources():
+                return False
+            for file_name, mtime, size, sha1 in header['sources']:
+                st = os.stat(file_name)
+                if (st.st_mtime_ns, st.st_size) != (mtime, size) and file_hash(file_name) != sha1:
+                    return False
+
+            pos += header_size
+            cached_symbols = data[pos:pos+symbols_size]
+            pos += symbols_size
+            segments = []
+            for addr, size in header['segments']:
+                if addr < 0 or size < 0 or addr + size > len(cpu.mem) or pos + size > len(data):
+                    return False
+                segments.append((addr, data[pos:pos+size]))
+                pos += size
+            if len(cached_symbols) != symbols_size or pos != len(data):
+                return False
+        except (OSError, ValueError, TypeError, KeyError, struct.error):
+            return False
+
+        self.cached_symbols = cached_symbols
+        for addr, segment in segments:
+            cpu.mem[addr:addr+len(segment)] = segment
+        return True
+
+    def save_cache(self):
+        sources = []
+        for file_name in self.sources():
+            st = os.stat(file_name)
+            sources.append((file_name, st.st_mtime_ns, st.st_size, file_hash(file_name)))
+        header = json.dumps({
+            'sources': sources,
+            'segments': [(addr, len(data)) for addr, data in self.segments],
+        }).encode('utf-8')
+        symbols = json.dumps({
+            'signatures': self.signatures,
+            'symbols': self.file_symbols + self.hex_symbols,
+        }).encode('utf-8')
+        # written to a temp file and renamed, so that another process
+        # booting at the same time never reads half a cache
+        try:
+            fd, temp_file = tempfile.mkstemp(prefix=os.path.basename(self.cache_file) + '.',
+                dir=os.path.dirname(self.cache_file) or '.')
+        except OSError:
+            # a read only directory, load from the .hex every time
+            return
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(CACHE_HEADER.pack(CACHE_MAGIC, len(header), len(symbols)))
+                fh.write(header)
+                fh.write(symbols)
+                for addr, data in self.segments:
+                    fh.write(data)
+            os.replace(temp_file, self.cache_file)
+        except OSError:
+            os.remove(temp_file)
+
+    ########################################
+    # sources
+    ########################################
+
+    def read_symbols(self):
         fh = open(self.sym_file)
         for line in fh:
             addr, sym = line.strip().split('|')
             addr = int(addr,16)
-            cpu.add_symbol(sym, addr)
+            self.file_symbols.append((sym, addr))
         fh.close()
 
-    def read_asm(self, cpu):
+    def read_asm(self):
         asm_const_sym = set()
         with open(self.asm_file, 'r') as asm_file :
             for line in asm_file:
@@ -65,7 +209,7 @@ class HexLoader:
                         sym = tokens[0]
                         sym_bytes = 1
                     if sym_bytes:
-                        cpu.add_symbol_signature(sym, sym_bytes)
+                        self.signatures.append((sym, sym_bytes))
 
     def read_hex(self, cpu):
         with open(self.hex_file, 'r') as hex_file:
@@ -80,24 +224,19 @@ class HexLoader:
                     end_count += 1
                     continue
                 if line[0] == ':':
-                    count = int(line[1:3],16)
-                    addr = int(line[3:7],16)
-                    tp = int(line[7:9],16)
+                    # count, address, type, data, checksum
+                    record = bytes.fromhex(line[1:])
+                    count = record[0]
+                    addr = record[1] * 0x100 + record[2]
+                    tp = record[3]
                     if tp == 0:
-                        cksum = count + tp + addr + (addr >> 8)
-                        for i in range(count):
-                            start = 9 + i*2
-                            byte = int(line[start:start+2],16)
-                            cksum += byte
-                            cpu.mem[addr + i] = byte
-                        start = 9 + count*2
-                        byte = int(line[start:start+2],16)
-                        cksum += byte
-                        if cksum & 0xFF:
+                        self.set_mem(cpu, addr, record[4:4+count])
+                        if sum(record[:5+count]) & 0xFF:
                             print("checksum line %d"%line_num)
+                            self.checksum_errors += 1
                 elif end_count == 0:
                     num, sym, addr = re.split('  *', line)
                     if len(addr) == 5:
                         addr = int(addr[:-1],16)
-                        cpu.add_symbol(sym, addr)
+                        self.hex_symbols.append((sym, addr))
 
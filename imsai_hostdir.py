@@ -0,0 +1,254 @@
+# a host directory as a CP/M drive
+#
+# the image is made up as it is read: the directory entries and allocation
+# come from the host files, a data block is read from the host file that
+# owns it, the reserved (system) tracks read as xE5
+#
+# blocks the guest writes are kept, when the guest writes the directory the
+# files whose entries changed are written back to the host from their
+# blocks, and erased files are removed from the host
+#
+# files changed on the host are picked up when the guest next reads the
+# start of the directory, their blocks are taken from the top of the disk
+# since CP/M takes new blocks from the bottom
+#
+# only user 0 files are host files, the guest BIOS has to use the same disk
+# parameters for the drive, see imsai_cpmfs.default_params
+
+import os
+
+import abstract_io
+import imsai_bdos
+import imsai_cpmfs
+from imsai_cpmfs import REC_SZ, DIR_ENTRY_SZ, DIR_USER, DELETED, EOF_BYTE
+
+class HostDirImage(imsai_cpmfs.CpmLayout):
+    def __init__(self, host_dir, geometry, params=None):
+        super().__init__(geometry, params)
+        self.host_dir = host_dir
+        self.directory = bytearray([DELETED] * self.params.dir_entries * DIR_ENTRY_SZ)
+
+        # (0, "NAME.EXT") -> host file name
+        self.host_names = {}
+        # host file name -> (mtime, size) when last read or written
+        self.host_stats = {}
+        # (0, "NAME.EXT") -> (blocks, records) as the host has it
+        self.synced = {}
+        # block -> (host file name, block number in the file)
+        self.block_map = {}
+        # block -> data, written by the guest
+        self.written = {}
+        # offset -> record, written by the guest on the reserved tracks
+        self.system = {}
+
+        self.rescans = 0
+        self.rescan()
+
+    ########################################
+    # image
+    ########################################
+
+    def size(self):
+        return self.geometry.size()
+
+    def read(self, offset, size):
+        data = bytearray()
+        end = offset + size
+        while offset < end:
+            in_rec = offset % REC_SZ
+            record = self.read_record(offset - in_rec)
+            n = min(REC_SZ - in_rec, end - offset)
+            data += record[in_rec:in_rec+n]
+            offset += n
+        return bytes(data)
+
+    def read_record(self, offset):
+        if offset >= self.size():
+            return bytes(REC_SZ)
+        record = self.offset_record(offset)
+        if record is None:
+            return self.system.get(offset, bytes([DELETED] * REC_SZ))
+        if record == 0:
+            # the guest is searching the directory
+            self.rescan()
+        block, i = divmod(record, self.block_recs)
+        return self.block_data(block)[i*REC_SZ:(i+1)*REC_SZ]
+
+    def write(self, offset, data):
+        dir_changed = False
+        for i in range(0, len(data), REC_SZ):
+            record_offset = offset + i
+            record = self.offset_record(record_offset)
+            chunk = bytes(data[i:i+REC_SZ])
+            if record is None:
+                self.system[record_offset] = chunk
+                continue
+            block, n = divmod(record, self.block_recs)
+            if block < self.dir_blocks:
+                start = record * REC_SZ
+                self.directory[start:start+REC_SZ] = chunk[:max(0, len(self.directory) - start)]
+                dir_changed = True
+            else:
+                if block not in self.written:
+                    self.written[block] = bytearray(self.block_data(block))
+                self.written[block][n*REC_SZ:(n+1)*REC_SZ] = chunk
+        if dir_changed:
+            self.sync_to_host()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    ########################################
+    # blocks
+    ########################################
+
+    def block_data(self, block):
+        block_size = self.params.block_size
+        if block < self.dir_blocks:
+            data = bytes(self.directory[block*block_size:(block+1)*block_size])
+        elif block in self.written:
+            return bytes(self.written[block])
+        elif block in self.block_map:
+            name, n = self.block_map[block]
+            try:
+                with open(os.path.join(self.host_dir, name), 'rb') as fh:
+                    fh.seek(n * block_size)
+                    data = fh.read(block_size)
+            except OSError:
+                data = b''
+            if len(data) % REC_SZ:
+                data += bytes([EOF_BYTE]) * (REC_SZ - len(data) % REC_SZ)
+        else:
+            data = b''
+        return data + bytes([DELETED]) * (block_size - len(data))
+
+    def used_blocks(self):
+        used = set(range(self.dir_blocks))
+        used.update(self.written)
+        for entries in self.parse_directory(self.directory).values():
+            for entry in entries:
+                used.update(self.entry_blocks(entry))
+        return used
+
+    ########################################
+    # host to guest
+    ########################################
+
+    def rescan(self):
+        """
+        bring the directory up to date with files added, changed or removed
+        on the host
+        """
+        stats = {}
+        for name in sorted(os.listdir(self.host_dir)):
+            path = os.path.join(self.host_dir, name)
+            if not imsai_bdos.make_fcb_name(name) or not os.path.isfile(path):
+                continue
+            st = os.stat(path)
+            stats[name] = (st.st_mtime_ns, st.st_size)
+
+        changed = [name for name in stats if self.host_stats.get(name, None) != stats[name]]
+        gone = [name for name in self.host_stats if name not in stats]
+        if not changed and not gone:
+            return
+        self.rescans += 1
+        for name in gone + changed:
+            self.drop_file(self.host_key(name))
+        for name in changed:
+            self.add_file(name, stats[name])
+
+    def host_key(self, name):
+        return (0, imsai_cpmfs.from_dir_name(imsai_bdos.make_fcb_name(name)))
+
+    def drop_file(self, key):
+        dir_name = imsai_cpmfs.to_dir_name(key[1])
+        for index in range(self.params.dir_entries):
+            entry = self.directory[index*DIR_ENTRY_SZ:(index+1)*DIR_ENTRY_SZ]
+            if entry[DIR_USER] == key[0] and self.entry_name(entry) == dir_name:
+                for block in self.entry_blocks(entry):
+                    self.block_map.pop(block, None)
+                    self.written.pop(block, None)
+                self.directory[index*DIR_ENTRY_SZ] = DELETED
+        self.synced.pop(key, None)
+        name = self.host_names.pop(key, None)
+        if name:
+            self.host_stats.pop(name, None)
+
+    def add_file(self, name, stat):
+        key = self.host_key(name)
+        if key in self.host_names:
+            abstract_io.log("host dir: %s and %s are both %s"%(self.host_names[key], name, key[1]), 1)
+            return
+        size = stat[1]
+        block_size = self.params.block_size
+        records = -(-size // REC_SZ)
+        n_blocks = -(-size // block_size)
+
+        used = self.used_blocks()
+        free_blocks = [block for block in range(self.blocks - 1, -1, -1) if block not in used]
+        free_entries = [index for index in range(self.params.dir_entries)
+            if self.directory[index*DIR_ENTRY_SZ] == DELETED]
+        blocks = sorted(free_blocks[:n_blocks])
+        entries = self.make_entries(imsai_cpmfs.to_dir_name(name), 0, blocks, records)
+        if len(blocks) < n_blocks or len(entries) > len(free_entries):
+            abstract_io.log("host dir: no room for %s"%name, 1)
+            return
+
+        for index, entry in zip(free_entries, entries):
+            self.directory[index*DIR_ENTRY_SZ:(index+1)*DIR_ENTRY_SZ] = entry
+        for n, block in enumerate(blocks):
+            self.block_map[block] = (name, n)
+        self.host_names[key] = name
+        self.host_stats[name] = stat
+        self.synced[key] = (blocks, records)
+
+    ########################################
+    # guest to host
+    ########################################
+
+    def sync_to_host(self):
+        """
+        write back the files whose directory entries the guest changed
+        """
+        files = {}
+        for key, entries in self.parse_directory(self.directory).items():
+            if key[0] == 0:
+                blocks = [block for entry in entries for block in self.entry_blocks(entry)]
+                files[key] = (blocks, self.file_records(entries))
+
+        # read them all before removing anything, a renamed file's blocks
+        # are still those of the old host file
+        contents = {}
+        for key, state in files.items():
+            if self.synced.get(key, None) != state:
+                blocks, records = state
+                data = b''.join(self.block_data(block) for block in blocks)
+                contents[key] = data[:records*REC_SZ]
+
+        for key in list(self.synced):
+            if key not in files or key in contents:
+                for block in self.synced[key][0]:
+                    self.block_map.pop(block, None)
+            if key not in files:
+                name = self.host_names.pop(key, None)
+                if name:
+                    self.host_stats.pop(name, None)
+                    os.remove(os.path.join(self.host_dir, name))
+                del self.synced[key]
+
+        for key, data in contents.items():
+            name = self.host_names.get(key, None) or key[1].lower()
+            path = os.path.join(self.host_dir, name)
+            with open(path, 'wb') as fh:
+                fh.write(data)
+            st = os.stat(path)
+            blocks, records = files[key]
+            for n, block in enumerate(blocks):
+                self.block_map[block] = (name, n)
+                self.written.pop(block, None)
+            self.host_names[key] = name
+            self.host_stats[name] = (st.st_mtime_ns, st.st_size)
+            self.synced[key] = files[key]
@@ -0,0 +1,204 @@
+#!/usr/bin/python3
+
+# serve many telnet sessions, each on its own machine
+#
+#   ./imsai_server.py                          8K BASIC on localhost:8008
+#   ./imsai_server.py -4                       4K BASIC
+#   ./imsai_server.py DISKS/cpm22.dsk ...      CP/M, see imsai.py for images
+#   ./imsai_server.py -n=16 -h=0.0.0.0 -p=23   16 machines, on all interfaces
+#
+# other options: -baud=N (default 0, no delay), -ku uppercase keys, -bt BIOS
+# traps, file.hex to run another program
+#
+# a pool of worker processes each boot a machine, once its guest is waiting
+# for a key it takes the next connection, so a user gets a booted machine
+# straight away, when the user leaves the worker exits and a new one boots
+#
+# disks are overlaid, and the overlay discarded, so no session changes them
+
+import multiprocessing
+import multiprocessing.connection
+import signal
+import socket
+import sys
+
+import abstract_io
+import intel8080
+import imsai_devices
+import imsai_disk
+import imsai_hex
+import imsai_bios
+
+PORT = 8008
+POOL_SIZE = 4
+
+class SessionSerialDevice(imsai_devices.SocketToSerialDevice):
+    """
+    serial I/O over a connection taken from the pool's server socket, the
+    machine is halted when it closes
+    """
+    def __init__(self, name, serial_status_device, cpu, server_socket, uppercase_keys=False):
+        self.cpu = cpu
+        self.pool_socket = server_socket
+        self.listening = False
+        super().__init__(name, serial_status_device, server_socket.getsockname()[1], uppercase_keys)
+        abstract_io.add_idle_callback(self.callback_idle)
+
+    def listen(self):
+        # the pool's socket is only listened on once the guest is waiting
+        pass
+
+    def callback_idle(self):
+        # the guest has booted, and waits for a key, polling the status port
+        # or in the BIOS CONIN trap
+        if not self.listening and not self.src_socket and not self.keys:
+            self.listening = True
+            abstract_io.select_fd_on("svr_socket:%d"%self.port, self.pool_socket, self.callback_accept_socket)
+
+    def callback_accept_socket(self, name, fd):
+        try:
+            src_socket, src_address = fd.accept()
+        except BlockingIOError:
+            # another machine in the pool took it
+            return
+        abstract_io.select_fd_off(name)
+        print("session from %s:%d"%src_address)
+        self.attach(src_socket, src_address)
+
+    def put_OUT_op(self, device_id, c):
+        # what the guest writes while it boots is kept for the user
+        self.serial_status_device.char_written()
+        if c != 0xFF:
+            self.send(c.to_bytes(1, 'big'))
+
+    def close_socket(self):
+        super().close_socket()
+        self.cpu.halt = True
+
+def boot_hex(cpu, hex_file):
+    if not imsai_hex.HexLoader(hex_file).boot(cpu):
+        raise Exception("can't load %s"%hex_file)
+
+def boot_machine(server_socket, options):
+    """
+    returns the cpu, ready to run, and its disk device, or None
+    """
+    device_factory = imsai_devices.DeviceFactory()
+    cpu = intel8080.CPU8080(device_factory, 64*1024)
+
+    disk_device = None
+    if options['dsk_files']:
+        disk_device = imsai_disk.DiskDevice(device_factory, 2, options['dsk_files'],
+            overlay_action="discard")
+        disk_device.boot(cpu)
+    elif options['hex_file']:
+        boot_hex(cpu, options['hex_file'])
+    elif options['basic_4k']:
+        boot_hex(cpu, 'IMSAI/basic4k.hex')
+        cpu.extend_symbol('IOBUF', -2)
+        cpu.extend_symbol('BEGPR', -2)
+    else:
+        boot_hex(cpu, 'IMSAI/basic8k.hex')
+        cpu.extend_symbol('BEGPR', 250)
+        cpu.set_read_only_end('RAM')
+
+    serial_status = imsai_devices.StatusSerialDevice(cpu)
+    device_factory.add_input_device(3, serial_status)
+    console = SessionSerialDevice("Session", serial_status, cpu, server_socket, options['uppercase_keys'])
+    device_factory.add_input_device(2, console)
+    device_factory.add_output_device(2, console)
+
+    if options['bios_traps'] and disk_device:
+        imsai_bios.BiosTraps(cpu, device_factory, disk_device)
+    imsai_devices.InputPump(cpu)
+
+    cpu.reset(0)
+    return cpu, disk_device
+
+def run_session(server_socket, options):
+    # ^C is for the server, it stops the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    imsai_devices.set_baud(options['baud'])
+
+    cpu, disk_device = boot_machine(server_socket, options)
+    try:
+        cpu.run()
+    except Exception as e:
+        print("session ended: %s"%e)
+    finally:
+        abstract_io.flush_output()
+        if disk_device:
+            disk_device.done()
+
+def main(args):
+    host = 'localhost'
+    port = PORT
+    pool_size = POOL_SIZE
+    options = {
+        'dsk_files': [],
+        'hex_file': None,
+        'basic_4k': False,
+        'baud': 0,
+        'uppercase_keys': False,
+        'bios_traps': False,
+    }
+    for arg in args:
+        if arg.startswith('-h='):
+            host = arg[3:]
+        elif arg.startswith('-p='):
+            port = int(arg[3:])
+        elif arg.startswith('-n='):
+            pool_size = int(arg[3:])
+        elif arg.startswith('-baud='):
+            options['baud'] = int(arg[6:])
+        elif arg == '-ku':
+            options['uppercase_keys'] = True
+        elif arg == '-bt':
+            options['bios_traps'] = True
+        elif arg == '-4':
+            options['basic_4k'] = True
+        elif arg.lower().endswith('.hex'):
+            options['hex_file'] = arg
+        elif arg.split('@')[0].lower().endswith(('.dsk', '.dsz')):
+            options['dsk_files'].append(arg)
+        else:
+            print("unknown arg %s"%arg)
+            return 2
+
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind((host, port))
+    server_socket.listen(0x40)
+    # every worker waits on it, only one gets each connection
+    server_socket.setblocking(False)
+
+    # the workers are forked, they share the server socket
+    context = multiprocessing.get_context('fork')
+    workers = []
+    sessions = 0
+    print("serving %d machines on %s:%d"%(pool_size, host, port))
+    try:
+        while True:
+            while len(workers) < pool_size:
+                worker = context.Process(target=run_session, args=(server_socket, options), daemon=True)
+                worker.start()
+                workers.append(worker)
+            multiprocessing.connection.wait([worker.sentinel for worker in workers])
+            for worker in [worker for worker in workers if not worker.is_alive()]:
+                worker.join()
+                workers.remove(worker)
+                if worker.exitcode:
+                    print("machine failed to boot, exit code %d"%worker.exitcode)
+                    return 1
+                sessions += 1
+    except KeyboardInterrupt:
+        print("\n%d sessions served"%sessions)
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.join()
+        server_socket.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -36,6 +36,36 @@ _RJC_OPS = [
 _DIRECT_OPS = ["SHLD", "LHLD", "STA", "LDA"]
 _LS_EXTENDED_OPS = ["STAX", "LDAX"]
 
+# clock cycles per opcode, conditional CALL and RET take CYCLES_TAKEN more when taken
+_CYCLES = [
+     4, 10,  7,  5,  5,  5,  7,  4,  4, 10,  7,  5,  5,  5,  7,  4, # 0x00
+     4, 10,  7,  5,  5,  5,  7,  4,  4, 10,  7,  5,  5,  5,  7,  4, # 0x10
+     4, 10, 16,  5,  5,  5,  7,  4,  4, 10, 16,  5,  5,  5,  7,  4, # 0x20
+     4, 10, 13,  5, 10, 10, 10,  4,  4, 10, 13,  5,  5,  5,  7,  4, # 0x30
+     5,  5,  5,  5,  5,  5,  7,  5,  5,  5,  5,  5,  5,  5,  7,  5, # 0x40
+     5,  5,  5,  5,  5,  5,  7,  5,  5,  5,  5,  5,  5,  5,  7,  5, # 0x50
+     5,  5,  5,  5,  5,  5,  7,  5,  5,  5,  5,  5,  5,  5,  7,  5, # 0x60
+     7,  7,  7,  7,  7,  7,  7,  7,  5,  5,  5,  5,  5,  5,  7,  5, # 0x70
+     4,  4,  4,  4,  4,  4,  7,  4,  4,  4,  4,  4,  4,  4,  7,  4, # 0x80
+     4,  4,  4,  4,  4,  4,  7,  4,  4,  4,  4,  4,  4,  4,  7,  4, # 0x90
+     4,  4,  4,  4,  4,  4,  7,  4,  4,  4,  4,  4,  4,  4,  7,  4, # 0xA0
+     4,  4,  4,  4,  4,  4,  7,  4,  4,  4,  4,  4,  4,  4,  7,  4, # 0xB0
+     5, 10, 10, 10, 11, 11,  7, 11,  5, 10, 10, 10, 11, 17,  7, 11, # 0xC0
+     5, 10, 10, 10, 11, 11,  7, 11,  5, 10, 10, 10, 11, 17,  7, 11, # 0xD0
+     5, 10, 10, 18, 11, 11,  7, 11,  5,  5, 10,  5, 11, 17,  7, 11, # 0xE0
+     5, 10, 10,  4, 11, 11,  7, 11,  5,  5, 10,  4, 11, 17,  7, 11, # 0xF0
+]
+CYCLES_TAKEN = 6
+
+# the most clock cycles any instruction takes (XTHL)
+MAX_CYCLES = 18
+
+# the IMSAI 8080 clock, for timing devices in emulated time
+CLOCK_HZ = 2000000
+
+# instr_count of the next periodic callback, when there are none
+NO_PERIODIC = 1 << 62
+
 class CPU8080:
     def set_mem_device(self, mem_device, start, end):
         self.mem_devices[mem_device.name] = (start, end, mem_device)
@@ -64,6 +94,7 @@ class CPU8080:
         self.interrupts = True
 
         self.instr_count = 0
+        self.cycles = 0
         self.first_nop = 0
 
         ########################################
@@ -88,15 +119,32 @@ class CPU8080:
         self.dump_instr_addr = set()
         self.debug_fh = None
 
+        # addr -> callback(cpu), called instead of the instruction at addr,
+        # returns True if it handled it (and set the pc), False to run it
+        self.pc_traps = {}
+
+        # [every, next instr_count, callback(cpu)], called every so many instructions
+        self.periodic = []
+        self.next_periodic = NO_PERIODIC
+
+        # [cycles, callback(cpu)], called once when cycles is reached
+        self.timers = []
+
+        # show a disassembled line before each instruction, see intel8080_dis
+        self.show_dis = False
+        self.disassembler = None
+
         # CALL/RET tracking, for debug info, list of (sp where ret addr is stored, the return address
         self.return_stack = []
         self.call_indent = ""
 
-        # symbols
-        self.mem_to_sym = {}
-        self.sym_to_mem = {}
+        # symbols, see mem_to_sym and sym_to_mem
+        self._mem_to_sym = {}
+        self._sym_to_mem = {}
         self.asm_mem_sym = {}
         self.sym5 = {}
+        # callback(cpu)s that add symbols, run the first time symbols are used
+        self.symbol_loaders = []
 
     ########################################
     # 
@@ -299,7 +347,7 @@ class CPU8080:
             self.call_indent = self.call_indent[:-2]
 #            print("%sCP-RET %04x"%(self.call_indent, self.pc))
 
-    def alu(self, op_names, op, value, show_value, pc, instr):
+    def alu(self, op, value, pc, instr):
         a = self.rs[REG_A]
         a_start = a
         c_in = self.get_flag(FLAG_C)
@@ -351,16 +399,26 @@ class CPU8080:
                 s_a = "%d:"%c_out + s_a
                 if op & 0x01:
                     s_value += "%s%d"%(_OPS[op], c_in)
-            print(
-                "%06x x%04x %02x %s %s %s [x%02x%s%s=%s F=%s]"%(
-                    self.instr_count, pc, instr, self.call_indent, op_names[op], show_value,
-                    a_start, _OPS[op], s_value, s_a, self.strFlags()),
-                file=self.debug_fh)
+            self.trace(pc, instr, " [x%02x%s%s=%s F=%s]"%(
+                a_start, _OPS[op], s_value, s_a, self.strFlags()))
+
+    def trace(self, pc, instr, values="", call_indent=None):
+        """
+        one show_inst line, the instruction is shown by the disassembler, so
+        there is one decoder, values show what it did
+        """
+        if call_indent is None:
+            call_indent = self.call_indent
+        size, text = self.get_disassembler().decode(pc)
+        print(
+            "%06x x%04x %02x %s %s%s"%(self.instr_count, pc, instr, call_indent, text, values),
+            file=self.debug_fh)
 
     def step(self):
         self.instr_count += 1
         pc = self.pc
         instr = self.get_instr8()
+        self.cycles += _CYCLES[instr]
         family = instr & 0xC0
 
         if family == 0x00:
@@ -374,7 +432,7 @@ class CPU8080:
                 elif self.pc - self.first_nop > 0x100:
                     self.halt = True
                 if self.show_inst:
-                    print("%06x x%04x %02x %s NOP"%(self.instr_count, pc, instr, self.call_indent), file=self.debug_fh)
+                    self.trace(pc, instr)
             elif family_op == 1:
                 if instr & 0x08 == 0:
                     # LXI, Load Register Pair Immediate
@@ -386,11 +444,7 @@ class CPU8080:
                         self.rs[reg_id] = (data >> 8) & 0xFF
 
                     if self.show_inst:
-                        s_data = self.addr_to_str(data)
-                        print(
-                            "%06x x%04x %02x %s LXI %s %s"%(
-                                self.instr_count, pc, instr, self.call_indent, _RSX_SP[reg_id // 2], s_data),
-                            file=self.debug_fh)
+                        self.trace(pc, instr)
                 else:
                     # DAD, Double Add
                     op1 = hl = self.get_hl()
@@ -407,11 +461,7 @@ class CPU8080:
                     self.rs[REG_L] = hl & 0xFF
 
                     if self.show_inst:
-                        print(
-                            "%06x x%04x %02x %s DAD %s [HL=x%04x+x%04x=x%04x]"%(
-                                self.instr_count, pc, instr, self.call_indent, _RSX_SP[reg_id // 2],
-                                op1, op2, hl),
-                            file=self.debug_fh)
+                        self.trace(pc, instr, " [HL=x%04x+x%04x=x%04x]"%(op1, op2, hl))
             elif family_op == 2:
                 if instr < 0x20:
                     if instr & 0x10:
@@ -426,13 +476,7 @@ class CPU8080:
                         self.set_mem(addr, self.rs[REG_A])
                     if self.show_inst:
                         s_addr = self.addr_to_str(addr)
-                        print(
-                            "%06x x%04x %02x %s %s %s [x%02x, %s]"%(
-                                self.instr_count, pc, instr, self.call_indent,
-                                _LS_EXTENDED_OPS[bool(instr & 0x08)],
-                                "BD"[bool(instr & 0x10)],
-                                self.rs[REG_A], s_addr),
-                            file=self.debug_fh)
+                        self.trace(pc, instr, " [x%02x, %s]"%(self.rs[REG_A], s_addr))
                 else:
                     addr = self.get_instr16()
                     sub_op = (instr >> 3) & 0x3
@@ -462,13 +506,8 @@ class CPU8080:
                         who = 'A'
                         hexes = 2
                     if self.show_inst:
-                        s_addr = self.addr_to_str(addr)
                         value = ("x%%%02dx"%hexes)%value
-                        print(
-                            "%06x x%04x %02x %s %s %s [%s=%s]"%(
-                                self.instr_count, pc, instr, self.call_indent, _DIRECT_OPS[sub_op], s_addr,
-                                who, value),
-                            file=self.debug_fh)
+                        self.trace(pc, instr, " [%s=%s]"%(who, value))
             elif family_op == 3:
                 if instr & 0x08 == 0:
                     # INX, Increment Register Pair
@@ -490,12 +529,7 @@ class CPU8080:
 
                     if self.show_inst:
                         s_value = self.addr_to_str(value)
-                        r_name = _RSX2_SP[reg_id // 2]
-                        print(
-                            "%06x x%04x %02x %s INX %s [%s=%s]"%(
-                                self.instr_count, pc, instr, self.call_indent, _RSX_SP[reg_id // 2],
-                                _RSX2_SP[reg_id // 2], s_value),
-                            file=self.debug_fh)
+                        self.trace(pc, instr, " [%s=%s]"%(_RSX2_SP[reg_id // 2], s_value))
                 else:
                     # DCX, Decrement Register Pair
                     if reg_id == 6:
@@ -516,11 +550,7 @@ class CPU8080:
 
                     if self.show_inst:
                         s_value = self.addr_to_str(value)
-                        print(
-                            "%06x x%04x %02x %s DCX %s [%s=%s]"%(
-                                self.instr_count, pc, instr, self.call_indent, _RSX_SP[reg_id // 2],
-                                _RSX2_SP[reg_id // 2], s_value),
-                            file=self.debug_fh)
+                        self.trace(pc, instr, " [%s=%s]"%(_RSX2_SP[reg_id // 2], s_value))
             elif family_op == 4:
                 # INR, Increment Register or Memory
                 value = self.get_by_id(instr, 3) + 1
@@ -531,11 +561,7 @@ class CPU8080:
 
                 if self.show_inst:
                     r_name = _RS[self.get_ident]
-                    print(
-                        "%06x x%04x %02x %s INR %s [%s=x%02x F=%s]"%(
-                            self.instr_count, pc, instr, self.call_indent, r_name,
-                            r_name, value, self.strFlags()),
-                        file=self.debug_fh)
+                    self.trace(pc, instr, " [%s=x%02x F=%s]"%(r_name, value, self.strFlags()))
             elif family_op == 5:
                 # DCR, Decrement Register or Memory
                 value = self.get_by_id(instr, 3) - 1
@@ -546,22 +572,14 @@ class CPU8080:
 
                 if self.show_inst:
                     r_name = _RS[self.get_ident]
-                    print(
-                        "%06x x%04x %02x %s DCR %s [%s=x%02x F=%s]"%(
-                            self.instr_count, pc, instr, self.call_indent, r_name,
-                            r_name, value, self.strFlags()),
-                        file=self.debug_fh)
+                    self.trace(pc, instr, " [%s=x%02x F=%s]"%(r_name, value, self.strFlags()))
             elif family_op == 6:
                 # MVI, Move Immediate
                 value = self.get_instr8()
                 self.set_by_id(instr, 3, value)
 
                 if self.show_inst:
-                    print(
-                        "%06x x%04x %02x %s MVI %s x%02x [%s=%02x]"%(
-                            self.instr_count, pc, instr, self.call_indent, _RS[self.set_ident], value,
-                            _RS[self.set_ident], value),
-                        file=self.debug_fh)
+                    self.trace(pc, instr, " [%s=%02x]"%(_RS[self.set_ident], value))
             elif family_op == 7:
                 op = (instr >> 3) & 0x7
                 if op < 4:
@@ -614,26 +632,15 @@ class CPU8080:
                     self.set_flag(FLAG_C, not self.get_flag(FLAG_C))
                 if self.show_inst:
                     if op <= 5:
-                        print(
-                            "%06x x%04x %02x %s %s [A=x%02x F=%s]"%(
-                                self.instr_count, pc, instr, self.call_indent, _07_OPS[op],
-                                a, self.strFlags()),
-                            file=self.debug_fh)
+                        self.trace(pc, instr, " [A=x%02x F=%s]"%(a, self.strFlags()))
                     else:
-                        print(
-                            "%06x x%04x %02x %s %s [F=%s]"%(
-                                self.instr_count, pc, instr, self.call_indent, _07_OPS[op],
-                                self.strFlags()),
-                            file=self.debug_fh)
+                        self.trace(pc, instr, " [F=%s]"%(self.strFlags()))
         elif family == 0x40:
                 # MOV [8-bit],[8-bit]
 
                 if instr == 0x76:
                     if self.debug_fh:
-                        print(
-                            "%06x x%04x %02x %s HLT"%(
-                                self.instr_count, pc, instr, self.call_indent),
-                            file=self.debug_fh)
+                        self.trace(pc, instr)
                     self.halt = True
                     return
 
@@ -641,13 +648,7 @@ class CPU8080:
                 self.set_by_id(instr, 3, value)
 
                 if self.show_inst:
-                    r1_name = _RS[self.set_ident]
-                    r2_name = _RS[self.get_ident]
-                    print(
-                        "%06x x%04x %02x %s MOV %s,%s [%s=x%02x]"%(
-                            self.instr_count, pc, instr, self.call_indent, r1_name, r2_name,
-                            r1_name, value),
-                        file=self.debug_fh)
+                    self.trace(pc, instr, " [%s=x%02x]"%(_RS[self.set_ident], value))
 
         elif family == 0x80:
             # ADD,ADC,SUB,SBB,ANA,XRA,ORA,CMP [8-bit]
@@ -655,7 +656,7 @@ class CPU8080:
             family_op = (instr >> 3) & 0x07
             value = self.get_by_id(instr, 0)
 
-            self.alu(_80_OPS, family_op, value, _RS[self.get_ident], pc, instr)
+            self.alu(family_op, value, pc, instr)
 
         elif family == 0xC0:
             family_op7 = instr & 0x07
@@ -703,29 +704,18 @@ class CPU8080:
                     addr = self.get_instr16()
 
                 if self.show_inst:
-                    op_name = _RJC_OPS[(instr >> 1) & 0x1F]
-                    if sub_op == 0:
-                        print(
-                            "%06x x%04x %02x %s %s [%s]"%(
-                                self.instr_count, pc, instr, self.call_indent, op_name,
-                                condition),
-                            file=self.debug_fh)
-                    else:
-                        s_addr = self.addr_to_str(addr)
-                        print(
-                            "%06x x%04x %02x %s %s %s [%s]"%(
-                                self.instr_count, pc, instr, self.call_indent, op_name, s_addr,
-                                condition),
-                            file=self.debug_fh)
+                    self.trace(pc, instr, " [%s]"%(condition))
 
                 if condition:
                     if sub_op == 0:
                         # return
+                        self.cycles += CYCLES_TAKEN
                         self.ret(-2)
                     else:
                         # jump/call
                         if instr & 0x02 == 0:
                             # call
+                            self.cycles += CYCLES_TAKEN
                             self.call(addr)
                         else:
                             self.pc = addr
@@ -734,22 +724,14 @@ class CPU8080:
                 addr = self.get_instr16()
                 self.pc = addr
                 if self.show_inst:
-                    s_addr = self.addr_to_str(addr)
-                    print(
-                        "%06x x%04x %02x %s JMP %s"%(
-                            self.instr_count, pc, instr, self.call_indent, s_addr),
-                        file=self.debug_fh)
+                    self.trace(pc, instr)
             elif instr | 0x70 == 0xFD:
                 # CALL
                 prev_call_indent = self.call_indent
                 addr = self.get_instr16()
                 self.call(addr)
                 if self.show_inst:
-                    s_addr = self.addr_to_str(addr)
-                    print(
-                        "%06x x%04x %02x %s CALL %s"%(
-                            self.instr_count, pc, instr, prev_call_indent, s_addr),
-                        file=self.debug_fh)
+                    self.trace(pc, instr, call_indent=prev_call_indent)
             elif family_opF == 1:
                 # POP (16-bit-reg), Pop Data Off Stack
                 value = self.pop()
@@ -766,11 +748,7 @@ class CPU8080:
                         s_value = "x%04x"%value
                     else:
                         s_value = self.addr_to_str(value)
-                    print(
-                        "%06x x%04x %02x %s POP %s [%s=%s]"%(
-                            self.instr_count, pc, instr, self.call_indent, _RSX[paramF],
-                            _RSX2[paramF], s_value),
-                        file=self.debug_fh)
+                    self.trace(pc, instr, " [%s=%s]"%(_RSX2[paramF], s_value))
             elif family_opF == 5:
                 # PUSH (16-bit-reg), Push Data Onto Stack
                 value_h = self.rs[paramF*2]
@@ -782,15 +760,11 @@ class CPU8080:
                     self.push(value_h * 0x100 + value_l)
 
                 if self.show_inst:
-                    print(
-                        "%06x x%04x %02x %s PUSH %s [x%04x]"%(
-                            self.instr_count, pc, instr, self.call_indent, _RSX[paramF],
-                            value_h * 0x100 + value_l),
-                        file=self.debug_fh)
+                    self.trace(pc, instr, " [x%04x]"%(value_h * 0x100 + value_l))
             elif family_op7 == 6:
                 # ADI, ACI, SUI, SBI, ANI, XRI, ORI, CPI
                 value = self.get_instr8()
-                self.alu(_C0_OPS, param7, value, "x%02x"%value, pc, instr)
+                self.alu(param7, value, pc, instr)
 
             elif family_op7 == 7:
                 # RST (id), Restart
@@ -799,71 +773,50 @@ class CPU8080:
                 self.call(exp*0x08)
 
                 if self.show_inst:
-                    print(
-                        "%06x x%04x %02x %s RST %d"%(
-                            self.instr_count, pc, instr, prev_call_indent, exp),
-                        file=self.debug_fh)
+                    self.trace(pc, instr, call_indent=prev_call_indent)
             elif instr == 0xDB:
                 # IN (device)
                 device_id = self.get_instr8()
 
-                in_device = self.device_factory.get_in_device(device_id)
-                if in_device:
-                    value = in_device.get_IN_op(self, device_id)
-                    if value == -1:
-                        if self.debug_fh:
-                            print("DEVICE EMPTY x%02x %s"%(device_id, in_device.name), file=self.debug_fh)
-                        print("DEVICE EMPTY x%02x %s"%(device_id, in_device.name))
-                        self.halt = True
-                        return
-                else:
-                    value = 0
+                value = self.device_factory.in_ops[device_id](self, device_id)
+                if value == -1:
+                    in_device = self.device_factory.in_devices[device_id]
+                    if self.debug_fh:
+                        print("DEVICE EMPTY x%02x %s"%(device_id, in_device.name), file=self.debug_fh)
+                    print("DEVICE EMPTY x%02x %s"%(device_id, in_device.name))
+                    self.halt = True
+                    return
                 self.rs[REG_A] = value
 
                 if self.show_inst:
                     s_value = "x%02x"%value
                     if 32 <= value < 127:
                         s_value += " chr(%s)"%(chr(value))
-                    print(
-                        "%06x x%04x %02x %s IN x%02x [%s]"%(
-                            self.instr_count, pc, instr, self.call_indent, device_id,
-                            s_value),
-                        file=self.debug_fh)
+                    self.trace(pc, instr, " [%s]"%(s_value))
             elif instr == 0xD3:
                 # OUT (device)
                 device_id = self.get_instr8()
-                out_device = self.device_factory.get_out_device(device_id)
-                if out_device:
-                    out_device.put_OUT_op(device_id, self.rs[REG_A])
+                self.device_factory.out_ops[device_id](device_id, self.rs[REG_A])
 
                 if self.show_inst:
                     value = self.rs[REG_A]
                     s_value = "x%02x"%value
                     if 32 <= value < 127:
                         s_value += " chr(%s)"%(chr(value))
-                    print(
-                        "%06x x%04x %02x %s OUT x%02x [%s]"%(
-                            self.instr_count, pc, instr, self.call_indent, device_id,
-                            s_value),
-                        file=self.debug_fh)
+                    self.trace(pc, instr, " [%s]"%(s_value))
             elif instr == 0xF9:
                 # SPHL, Load SP from H and L
                 self.sp = self.get_hl()
                 if self.show_inst:
-                    print(
-                        "%06x x%04x %02x %s SPHL [SP=x%04x]"%(
-                            self.instr_count, pc, instr, self.call_indent, self.sp),
-                        file=self.debug_fh)
+                    self.trace(pc, instr, " [SP=x%04x]"%(self.sp))
             elif instr == 0xC9:
                 # RET, Return
                 prev_call_indent = self.call_indent
                 self.ret()
                 if self.show_inst:
-                    print(
-                        "%06x x%04x %02x %s RET [A=x%02x HL=x%04x F=%s]"%(
-                            self.instr_count, pc, instr, prev_call_indent,
-                            self.rs[REG_A], self.rs[REG_H] * 0x100 + self.rs[REG_L], self.strFlags()),
-                        file=self.debug_fh)
+                    self.trace(pc, instr, " [A=x%02x HL=x%04x F=%s]"%(
+                        self.rs[REG_A], self.rs[REG_H] * 0x100 + self.rs[REG_L], self.strFlags()),
+                        call_indent=prev_call_indent)
             elif instr == 0xEB:
                 # XCHG, Exchange Registers
                 h = self.rs[REG_H]
@@ -877,11 +830,7 @@ class CPU8080:
                 self.rs[REG_E] = l
 
                 if self.show_inst:
-                    print(
-                        "%06x x%04x %02x %s XCHG [HL=x%02x%02x DE=x%02x%02x]"%(
-                            self.instr_count, pc, instr, self.call_indent,
-                            d, e, h, l),
-                        file=self.debug_fh)
+                    self.trace(pc, instr, " [HL=x%02x%02x DE=x%02x%02x]"%(d, e, h, l))
             elif instr == 0xE3:
                 # XTHL, Exchange Stack
                 reg_l = self.rs[REG_L]
@@ -893,7 +842,7 @@ class CPU8080:
                 self.set_mem(self.sp, reg_h * 0x100 + reg_l, 16)
 
                 if self.show_inst:
-                    print("%06x x%04x %02x %s XTHL"%(self.instr_count, pc, instr, self.call_indent), file=self.debug_fh)
+                    self.trace(pc, instr)
             elif instr == 0xE9:
                 # TODO: can be used as a "RET"
                 # PCHL, H & L to PC
@@ -905,26 +854,17 @@ class CPU8080:
                     if self.return_stack:
                         ret_sp, ret_pc = self.return_stack[-1]
                         dbg = " [frame.SP=%04x frame.PC=%04x SP=%04x HL=%04x]"%(ret_sp, ret_pc, self.sp, addr)
-                    print(
-                        "%06x x%04x %02x %s PCHL%s"%(
-                            self.instr_count, pc, instr, self.call_indent, dbg),
-                        file=self.debug_fh)
+                    self.trace(pc, instr, dbg)
             elif instr == 0xF3:
                 # DI, Disable Interrupts
                 self.interrupts = False
                 if self.show_inst:
-                    print(
-                        "%06x x%04x %02x %s DI"%(
-                            self.instr_count, pc, instr, self.call_indent),
-                        file=self.debug_fh)
+                    self.trace(pc, instr)
             elif instr == 0xFB:
                 # EI, Enable Interrupts
                 self.interrupts = True
                 if self.show_inst:
-                    print(
-                        "%06x x%04x %02x %s EI"%(
-                            self.instr_count, pc, instr, self.call_indent),
-                        file=self.debug_fh)
+                    self.trace(pc, instr)
             elif instr == 0xF3:
                 # DI
                 self.interrupts = False
@@ -1006,19 +946,72 @@ class CPU8080:
         self.show_mem_set = True
         self.show_mem_get = True
 
+    def trdis(self):
+        if not self.debug_fh:
+            self.debug_fh = open('dbg.txt', 'w')
+            abstract_io.add_log_file(self.debug_fh)
+        self.show_dis = True
+
     def troff(self):
         self.show_inst = False
         self.show_mem_set = False
         self.show_mem_get = False
+        self.show_dis = False
+
+    def add_periodic(self, callback, every):
+        self.periodic.append([every, self.instr_count, callback])
+        self.next_periodic = self.instr_count
+
+    def add_timer(self, callback, cycles):
+        """
+        call callback(cpu) once, after at least cycles more clock cycles
+        """
+        self.timers.append([self.cycles + cycles, callback])
+        self.next_periodic = min(self.next_periodic, self.instr_count + max(1, cycles // MAX_CYCLES))
+
+    def run_periodic(self):
+        next_periodic = NO_PERIODIC
+        for entry in self.periodic:
+            every, next_count, callback = entry
+            if self.instr_count >= next_count:
+                callback(self)
+                next_count = entry[1] = self.instr_count + every
+            next_periodic = min(next_periodic, next_count)
+        if self.timers:
+            # a timer can't be reached in fewer instructions than this, look
+            # again then
+            timers = self.timers
+            self.timers = []
+            for entry in timers:
+                if self.cycles >= entry[0]:
+                    entry[1](self)
+                else:
+                    self.timers.append(entry)
+            for at_cycles, callback in self.timers:
+                next_periodic = min(next_periodic,
+                    self.instr_count + max(1, (at_cycles - self.cycles) // MAX_CYCLES))
+        self.next_periodic = next_periodic
+
+    def get_disassembler(self):
+        if not self.disassembler:
+            import intel8080_dis
+            self.disassembler = intel8080_dis.Disassembler(self)
+        return self.disassembler
 
     def run(self):
-        if self.show_inst or self.show_mem_set or self.show_mem_get:
+        if self.show_inst or self.show_mem_set or self.show_mem_get or self.show_dis:
             self.debug_fh = open('dbg.txt', 'w')
             abstract_io.add_log_file(self.debug_fh)
         bp_next = False
         while not self.halt and (self.limit_steps <= 0 or self.instr_count < self.limit_steps):
+            if self.instr_count >= self.next_periodic:
+                self.run_periodic()
+            if self.pc in self.pc_traps and self.pc_traps[self.pc](self):
+                continue
             if self.show_inst and self.pc in self.mem_to_sym:
                 print(":%s:"%(self.mem_to_sym[self.pc]), file=self.debug_fh)
+            if self.show_dis:
+                print("%06x %s"%(self.instr_count, self.get_disassembler().line(self.pc)), file=self.debug_fh)
             if bp_next or self.pc in self.dump_instr_addr:
                 self.dump_reg()
             bp_next = self.pc in self.dump_instr_addr
@@ -1060,7 +1053,51 @@ class CPU8080:
     # load symbols
     ########################################
 
+    def add_symbol_loader(self, loader):
+        """
+        loader(cpu) adds symbols, it is put off until something looks one up
+        """
+        self.symbol_loaders.append(loader)
+
+    def load_symbols(self):
+        while self.symbol_loaders:
+            loaders = self.symbol_loaders
+            self.symbol_loaders = []
+            for loader in loaders:
+                loader(self)
+
+    @property
+    def mem_to_sym(self):
+        if self.symbol_loaders:
+            self.load_symbols()
+        return self._mem_to_sym
+
+    @mem_to_sym.setter
+    def mem_to_sym(self, mem_to_sym):
+        self._mem_to_sym = mem_to_sym
+        self.symbols_changed()
+
+    @property
+    def sym_to_mem(self):
+        if self.symbol_loaders:
+            self.load_symbols()
+        return self._sym_to_mem
+
+    @sym_to_mem.setter
+    def sym_to_mem(self, sym_to_mem):
+        self._sym_to_mem = sym_to_mem
+        self.symbols_changed()
+
+    def symbols_changed(self):
+        # disassembled lines show symbols
+        if self.disassembler:
+            self.disassembler.invalidate()
+
     def extend_symbol(self, sym, count):
+        # put off with the symbols it extends
+        if self.symbol_loaders:
+            self.add_symbol_loader(lambda cpu: cpu.extend_symbol(sym, count))
+            return
         addr = self.sym_to_mem.get(sym, None)
         if True: # addr and addr >= 0x40:
             self.mem_to_sym[addr] = sym + '+0'
@@ -1072,6 +1109,7 @@ class CPU8080:
                 if (addr + i) in self.mem_to_sym:
                     break
                 self.mem_to_sym[addr + i] = sym + '+%d'%i
+        self.symbols_changed()
 
     def add_symbol_signature(self, sym, sym_bytes):
         self.asm_mem_sym[sym] = sym_bytes
@@ -1095,4 +1133,5 @@ class CPU8080:
             self.sym_to_mem[sym] = addr
             if sym_bytes > 1:
                 self.extend_symbol(sym, sym_bytes)
+            self.symbols_changed()
 
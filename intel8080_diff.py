@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+
+# lockstep differential execution of two 8080 engines
+#
+# both engines start from the same memory image and registers, they are
+# stepped side by side and compared after every block of instructions:
+# registers, flags, SP, PC, halt state and the memory writes each one did,
+# the first divergence stops the run with a report
+#
+#   ./intel8080_diff.py -fuzz=1000                random opcode streams
+#   ./intel8080_diff.py -fuzz=1000 -seed=7 -steps=500
+#   ./intel8080_diff.py IMSAI/basic8k.hex -steps=100000
+#   ./intel8080_diff.py TEST.COM -block=16
+#   ./intel8080_diff.py test.bin@0100
+#   ./intel8080_diff.py -engine=fast8080.CPU8080 -fuzz=1000
+#
+# an engine is any class built as Engine(device_factory, mem_size) that has
+# step(), pc, sp, rs, mem, halt and set_mem_device() like CPU8080
+
+import sys
+import random
+import importlib
+
+import intel8080
+import imsai_devices
+import imsai_hex
+import imsai_bin
+
+MEM_SIZE = 64*1024
+
+class WriteRecorder:
+    """a memory device over all of memory, it remembers every write"""
+    def __init__(self):
+        self.name = 'diff-writes'
+        self.writes = []
+
+    def set_mem_op(self, addr, old_value, new_value):
+        self.writes.append((addr, new_value))
+
+def snapshot(cpu):
+    return {
+        'PC': cpu.pc,
+        'SP': cpu.sp,
+        'A': cpu.rs[intel8080.REG_A],
+        'F': cpu.rs[intel8080.REG_FLAG],
+        'B': cpu.rs[intel8080.REG_B],
+        'C': cpu.rs[intel8080.REG_C],
+        'D': cpu.rs[intel8080.REG_D],
+        'E': cpu.rs[intel8080.REG_E],
+        'H': cpu.rs[intel8080.REG_H],
+        'L': cpu.rs[intel8080.REG_L],
+        'HALT': int(bool(cpu.halt)),
+    }
+
+def str_flags(flags):
+    return "".join((
+        n if n != '.' and b == '1' else "-"
+        for b,n in zip(bin(0x100 + flags)[3:], "SZ.A.P.C")))
+
+class Lockstep:
+    def __init__(self, ref_cpu, test_cpu, block=1):
+        self.ref_cpu = ref_cpu
+        self.test_cpu = test_cpu
+        self.block = block
+        self.steps = 0
+
+        self.ref_writes = WriteRecorder()
+        self.test_writes = WriteRecorder()
+        ref_cpu.set_mem_device(self.ref_writes, 0, len(ref_cpu.mem))
+        test_cpu.set_mem_device(self.test_writes, 0, len(test_cpu.mem))
+
+    def run(self, max_steps):
+        """
+        returns None if both engines agree for max_steps instructions or until
+        both halt, otherwise a report of the first divergence
+        """
+        ref_cpu = self.ref_cpu
+        test_cpu = self.test_cpu
+        while self.steps < max_steps:
+            # remember where the block started, to report it
+            block_pcs = []
+            for i in range(self.block):
+                if ref_cpu.halt or test_cpu.halt:
+                    break
+                block_pcs.append(ref_cpu.pc)
+                ref_cpu.step()
+                test_cpu.step()
+                self.steps += 1
+            report = self.compare(block_pcs)
+            if report:
+                return report
+            if ref_cpu.halt or test_cpu.halt or not block_pcs:
+                return None
+        return None
+
+    def compare(self, block_pcs):
+        ref_state = snapshot(self.ref_cpu)
+        test_state = snapshot(self.test_cpu)
+        ref_writes = self.ref_writes.writes
+        test_writes = self.test_writes.writes
+        self.ref_writes.writes = []
+        self.test_writes.writes = []
+        if ref_state == test_state and ref_writes == test_writes:
+            return None
+        return self.report(block_pcs, ref_state, test_state, ref_writes, test_writes)
+
+    def report(self, block_pcs, ref_state, test_state, ref_writes, test_writes):
+        cpu = self.ref_cpu
+        dis = cpu.get_disassembler()
+        lines = ["DIVERGENCE after %d instructions"%self.steps]
+        lines.append("block:")
+        for pc in block_pcs:
+            lines.append("  %s"%dis.line(pc))
+
+        lines.append("registers:      ref     test")
+        for name in ref_state:
+            ref_value = ref_state[name]
+            test_value = test_state[name]
+            mark = "" if ref_value == test_value else "   <--"
+            if name == 'F':
+                lines.append("  %-4s  %8s %8s%s"%(
+                    name, str_flags(ref_value), str_flags(test_value), mark))
+            elif name in ('PC', 'SP'):
+                lines.append("  %-4s  %8s %8s%s"%(
+                    name, cpu.addr_to_str(ref_value), cpu.addr_to_str(test_value), mark))
+            else:
+                lines.append("  %-4s  %8s %8s%s"%(
+                    name, "x%02x"%ref_value, "x%02x"%test_value, mark))
+
+        if ref_writes != test_writes:
+            lines.append("memory writes:")
+            for i in range(max(len(ref_writes), len(test_writes))):
+                ref_write = "mem[%s]<-x%02x"%(cpu.addr_to_str(ref_writes[i][0]), ref_writes[i][1]) \
+                    if i < len(ref_writes) else "-"
+                test_write = "mem[%s]<-x%02x"%(cpu.addr_to_str(test_writes[i][0]), test_writes[i][1]) \
+                    if i < len(test_writes) else "-"
+                mark = "" if ref_write == test_write else "   <--"
+                lines.append("  %-20s %-20s%s"%(ref_write, test_write, mark))
+        return "\n".join(lines)
+
+########################################
+# building engines
+########################################
+
+def get_engine_class(spec):
+    """
+    spec is module.Class, the default is the reference intel8080.CPU8080
+    """
+    if not spec:
+        return intel8080.CPU8080
+    module_name, class_name = spec.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+def new_pair(test_class, mem):
+    ref_cpu = intel8080.CPU8080(imsai_devices.DeviceFactory(), len(mem))
+    test_cpu = test_class(imsai_devices.DeviceFactory(), len(mem))
+    for cpu in (ref_cpu, test_cpu):
+        cpu.mem[:] = mem
+        # random code would trip these guard rails differently than real code
+        cpu.sp_fault = False
+    return ref_cpu, test_cpu
+
+def set_state(cpu, pc, sp, rs):
+    cpu.pc = pc
+    cpu.sp = sp
+    cpu.rs[:] = rs
+
+def fuzz(test_class, cases, steps, seed, block):
+    """
+    each case runs a random opcode stream from random registers and memory
+    returns the number of divergent cases
+    """
+    rnd = random.Random(seed)
+    failures = 0
+    for case in range(cases):
+        # xd9 (an alias of RET) is not executed by CPU8080.step, it would end most cases early
+        mem = [0xC9 if b == 0xD9 else b for b in rnd.randbytes(MEM_SIZE)]
+        ref_cpu, test_cpu = new_pair(test_class, mem)
+        pc = rnd.randrange(MEM_SIZE)
+        sp = rnd.randrange(MEM_SIZE)
+        rs = [rnd.randrange(0x100) for i in range(8)]
+        rs[intel8080.REG_FLAG] = (rs[intel8080.REG_FLAG] & 0xD7) | intel8080.FLAG_1
+        for cpu in (ref_cpu, test_cpu):
+            set_state(cpu, pc, sp, rs)
+        report = Lockstep(ref_cpu, test_cpu, block).run(steps)
+        if report:
+            failures += 1
+            print("case %d (seed %d)"%(case, seed))
+            print(report)
+            break
+    return failures
+
+def load_image(file_name):
+    """
+    returns (cpu holding the image and its symbols, start pc) for a .hex
+    file, or a .com, .bin or .rom file, see imsai_bin
+    """
+    cpu = intel8080.CPU8080(imsai_devices.DeviceFactory(), MEM_SIZE)
+    loader = imsai_bin.get_loader(file_name)
+    if loader:
+        loader.boot(cpu)
+        return cpu, loader.addr
+    imsai_hex.HexLoader(file_name).boot(cpu)
+    return cpu, 0
+
+def main(args):
+    engine = None
+    cases = 0
+    steps = 1000
+    seed = 1
+    block = 1
+    image_file = None
+    for arg in args:
+        if arg.startswith('-fuzz='):
+            cases = int(arg[6:])
+        elif arg.startswith('-steps='):
+            steps = int(arg[7:])
+        elif arg.startswith('-seed='):
+            seed = int(arg[6:])
+        elif arg.startswith('-block='):
+            block = int(arg[7:])
+        elif arg.startswith('-engine='):
+            engine = arg[8:]
+        else:
+            image_file = arg
+    test_class = get_engine_class(engine)
+
+    if cases:
+        failures = fuzz(test_class, cases, steps, seed, block)
+        if not failures:
+            print("%d cases, no divergence"%cases)
+        return 1 if failures else 0
+
+    if image_file:
+        image_cpu, pc = load_image(image_file)
+        ref_cpu, test_cpu = new_pair(test_class, image_cpu.mem)
+        for cpu in (ref_cpu, test_cpu):
+            cpu.mem_to_sym = image_cpu.mem_to_sym
+            cpu.sym_to_mem = image_cpu.sym_to_mem
+            cpu.reset(pc)
+        lockstep = Lockstep(ref_cpu, test_cpu, block)
+        report = lockstep.run(steps)
+        if report:
+            print(report)
+            return 1
+        print("%d instructions, no divergence"%lockstep.steps)
+        return 0
+
+    print("usage: intel8080_diff.py [-engine=module.Class] [-block=N] [-steps=N] (-fuzz=N [-seed=N] | file.hex | file.com | file.bin[@addr])")
+    return 2
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+
+# disassembler for the 8080, used by the monitor and the trace output
+#
+# decoded lines are cached per address, each cache entry remembers the
+# instruction bytes it was decoded from, and is thrown away when those bytes
+# no longer match memory, so writes from the cpu, disk DMA or the hex loader
+# all invalidate the cache without any hook on the memory write path
+
+from intel8080 import _RS, _RSX_SP, _RSX, _07_OPS, _80_OPS, _C0_OPS, _RJC_OPS, _DIRECT_OPS, _LS_EXTENDED_OPS
+
+# operand kinds
+_NONE = 0
+_IMM8 = 1
+_IMM16 = 2
+_ADDR16 = 3
+_PORT = 4
+
+def _build_table():
+    """
+    one entry per opcode: (size, mnemonic, fixed operand text, operand kind)
+    decoding follows the same opcode families as CPU8080.step
+    """
+    table = [None]*256
+    for instr in range(256):
+        family = instr & 0xC0
+        entry = None
+        if family == 0x00:
+            family_op = instr & 0x07
+            rp = (instr >> 4) & 0x3
+            if family_op == 0:
+                entry = (1, "NOP", "", _NONE)
+            elif family_op == 1:
+                if instr & 0x08 == 0:
+                    entry = (3, "LXI", _RSX_SP[rp] + ",", _IMM16)
+                else:
+                    entry = (1, "DAD", _RSX_SP[rp], _NONE)
+            elif family_op == 2:
+                if instr < 0x20:
+                    entry = (1, _LS_EXTENDED_OPS[bool(instr & 0x08)], "BD"[bool(instr & 0x10)], _NONE)
+                else:
+                    entry = (3, _DIRECT_OPS[(instr >> 3) & 0x3], "", _ADDR16)
+            elif family_op == 3:
+                entry = (1, ["INX", "DCX"][bool(instr & 0x08)], _RSX_SP[rp], _NONE)
+            elif family_op == 4:
+                entry = (1, "INR", _RS[(instr >> 3) & 0x7], _NONE)
+            elif family_op == 5:
+                entry = (1, "DCR", _RS[(instr >> 3) & 0x7], _NONE)
+            elif family_op == 6:
+                entry = (2, "MVI", _RS[(instr >> 3) & 0x7] + ",", _IMM8)
+            else:
+                entry = (1, _07_OPS[(instr >> 3) & 0x7], "", _NONE)
+        elif family == 0x40:
+            if instr == 0x76:
+                entry = (1, "HLT", "", _NONE)
+            else:
+                entry = (1, "MOV", "%s,%s"%(_RS[(instr >> 3) & 0x7], _RS[instr & 0x7]), _NONE)
+        elif family == 0x80:
+            entry = (1, _80_OPS[(instr >> 3) & 0x7], _RS[instr & 0x7], _NONE)
+        else:
+            family_op7 = instr & 0x07
+            family_opF = instr & 0x0F
+            paramF = (instr >> 4) & 0x3
+            if family_opF & 0x1 == 0 and family_op7 != 6:
+                op_name = _RJC_OPS[(instr >> 1) & 0x1F]
+                if (instr >> 1) & 0x3 == 0:
+                    entry = (1, op_name, "", _NONE)
+                else:
+                    entry = (3, op_name, "", _ADDR16)
+            elif instr | 0x08 == 0xCB:
+                entry = (3, "JMP", "", _ADDR16)
+            elif instr | 0x70 == 0xFD:
+                entry = (3, "CALL", "", _ADDR16)
+            elif family_opF == 1 and instr != 0xC9 and instr != 0xD9:
+                entry = (1, "POP", _RSX[paramF], _NONE)
+            elif family_opF == 5:
+                entry = (1, "PUSH", _RSX[paramF], _NONE)
+            elif family_op7 == 6:
+                entry = (2, _C0_OPS[(instr >> 3) & 0x7], "", _IMM8)
+            elif family_op7 == 7:
+                entry = (1, "RST", "%d"%((instr >> 3) & 0x7), _NONE)
+            elif instr == 0xDB:
+                entry = (2, "IN", "", _PORT)
+            elif instr == 0xD3:
+                entry = (2, "OUT", "", _PORT)
+            else:
+                entry = {
+                    0xF9: (1, "SPHL", "", _NONE),
+                    0xC9: (1, "RET", "", _NONE),
+                    0xEB: (1, "XCHG", "", _NONE),
+                    0xE3: (1, "XTHL", "", _NONE),
+                    0xE9: (1, "PCHL", "", _NONE),
+                    0xF3: (1, "DI", "", _NONE),
+                    0xFB: (1, "EI", "", _NONE),
+                }.get(instr, None)
+        if not entry:
+            # not executed by CPU8080.step, show it as data
+            entry = (1, "DB", "x%02x"%instr, _NONE)
+        table[instr] = entry
+    return table
+
+_TABLE = _build_table()
+
+class Disassembler:
+    def __init__(self, cpu):
+        self.cpu = cpu
+
+        # addr -> (instruction bytes, size, text)
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self, start=None, end=None):
+        """
+        drop cached lines, all of them or those starting in [start, end)
+        needed after symbols change, memory changes are detected on lookup
+        """
+        if start is None:
+            self.cache = {}
+            return
+        if end is None:
+            end = start + 1
+        # an instruction starting up to 2 bytes before start can overlap it
+        for addr in range(max(0, start - 2), end):
+            self.cache.pop(addr, None)
+
+    def decode(self, addr):
+        """
+        returns (size, text) for the instruction at addr
+        """
+        mem = self.cpu.mem
+        cached = self.cache.get(addr, None)
+        if cached:
+            raw, size, text = cached
+            if tuple(mem[addr:addr+size]) == raw:
+                self.hits += 1
+                return size, text
+        self.misses += 1
+
+        if addr >= len(mem):
+            return 1, "DB ??"
+        size, op_name, operand, kind = _TABLE[mem[addr]]
+        if addr + size > len(mem):
+            size, op_name, operand, kind = 1, "DB", "x%02x"%mem[addr], _NONE
+        if kind == _IMM8:
+            operand += "x%02x"%mem[addr+1]
+        elif kind == _PORT:
+            operand = "x%02x"%mem[addr+1]
+        elif kind == _IMM16 or kind == _ADDR16:
+            operand += self.cpu.addr_to_str(mem[addr+1] | (mem[addr+2] * 0x100))
+        if operand:
+            text = "%-4s %s"%(op_name, operand)
+        else:
+            text = op_name
+
+        self.cache[addr] = (tuple(mem[addr:addr+size]), size, text)
+        return size, text
+
+    def line(self, addr):
+        """
+        one listing line: address, instruction bytes and the decoded text
+        """
+        size, text = self.decode(addr)
+        return self.format_line(addr, size, text)
+
+    def format_line(self, addr, size, text):
+        s_bytes = " ".join("%02x"%b for b in self.cpu.mem[addr:addr+size])
+        return "x%04x %-8s  %s"%(addr, s_bytes, text)
+
+    def disassemble(self, addr, count=16):
+        """
+        returns (lines, next addr) for count instructions starting at addr
+        symbols that land on an instruction get their own label line
+        """
+        lines = []
+        mem_to_sym = self.cpu.mem_to_sym
+        for i in range(count):
+            if addr >= len(self.cpu.mem):
+                break
+            sym = mem_to_sym.get(addr, None)
+            if sym and not '+' in sym:
+                lines.append("%s:"%sym)
+            size, text = self.decode(addr)
+            lines.append(self.format_line(addr, size, text))
+            addr += size
+        return lines, addr
@@ -0,0 +1,38 @@
+# run with: python3 -m pytest -q
+
+import pytest
+
+import imsai_cpmfs
+
+def make_disk(tmp_path):
+    # a blank IBM 3740 image, 243 1K blocks, 2 of them the directory
+    image_file = str(tmp_path / "blank.dsk")
+    with open(image_file, 'wb') as fh:
+        fh.write(b'\xE5' * 77 * 26 * 128)
+    return image_file
+
+def test_failed_replace_keeps_the_file(tmp_path):
+    image_file = make_disk(tmp_path)
+    disk = imsai_cpmfs.CpmDisk(image_file)
+    free = len(disk.free_blocks())
+    disk.write_file("OLD.TXT", b'x' * 4096)
+    with pytest.raises(Exception, match="disk full"):
+        disk.write_file("OLD.TXT", b'y' * (free + 1) * 1024)
+    disk.close()
+
+    disk = imsai_cpmfs.CpmDisk(image_file)
+    assert disk.read_file("OLD.TXT") == b'x' * 4096
+    disk.close()
+
+def test_replace_reuses_the_file_blocks(tmp_path):
+    image_file = make_disk(tmp_path)
+    disk = imsai_cpmfs.CpmDisk(image_file)
+    free = len(disk.free_blocks())
+    disk.write_file("BIG.DAT", b'x' * free * 1024)
+    assert disk.free_blocks() == []
+    disk.write_file("BIG.DAT", b'y' * free * 1024)
+    disk.close()
+
+    disk = imsai_cpmfs.CpmDisk(image_file)
+    assert disk.read_file("BIG.DAT") == b'y' * free * 1024
+    disk.close()
@@ -0,0 +1,98 @@
+# run with: python3 -m pytest -q
+
+import os
+
+import imsai_disk
+
+SEC_SZ = imsai_disk.SEC_SZ
+TRACK_BYTES = imsai_disk.SECS_PER_TRK * SEC_SZ
+
+def make_image(tmp_path):
+    image_file = str(tmp_path / "base.dsk")
+    with open(image_file, 'wb') as fh:
+        fh.write(bytes(TRACK_BYTES * 2))
+    return image_file
+
+def test_overlay_track_read_through_cache(tmp_path):
+    image_file = make_image(tmp_path)
+    delta_file = str(tmp_path / "base.dsk.ovl")
+
+    overlay = imsai_disk.OverlayImage(image_file, delta_file, 'keep')
+    overlay.write(SEC_SZ, bytes([0x11]) * SEC_SZ)
+    overlay.close()
+
+    overlay = imsai_disk.OverlayImage(image_file, delta_file, 'keep')
+    cache = imsai_disk.SectorCache(overlay, track_bytes=TRACK_BYTES)
+    # the second read is on the same track, so the whole track is read ahead
+    assert cache.read(0, SEC_SZ) == bytes(SEC_SZ)
+    assert cache.read(SEC_SZ, SEC_SZ) == bytes([0x11]) * SEC_SZ
+    assert cache.read_aheads == 1
+
+    track = overlay.read(0, TRACK_BYTES)
+    assert track[SEC_SZ:2*SEC_SZ] == bytes([0x11]) * SEC_SZ
+    assert track[:SEC_SZ] + track[2*SEC_SZ:] == bytes(TRACK_BYTES - SEC_SZ)
+    # a read that starts inside an overlaid sector
+    assert overlay.read(SEC_SZ + 64, SEC_SZ) == bytes([0x11]) * 64 + bytes(64)
+    cache.close()
+    assert os.path.exists(delta_file)
+
+def test_sparse_image_keeps_its_heads(tmp_path):
+    import imsai_dsz
+    dsz_file = str(tmp_path / "ds.dsz")
+    assert imsai_dsz.main(['-g=dsdd', dsz_file]) == 0
+
+    sparse = imsai_disk.open_image(dsz_file)
+    geometry = imsai_disk.default_geometry(sparse)
+    assert repr(geometry) == repr(imsai_disk.GEOMETRIES['dsdd'])
+    assert sparse.size() == geometry.size()
+    # the last sector of the second head
+    sparse.write(geometry.offset(76, 1, 26), bytes([0x22]) * 256)
+    sparse.close()
+
+    sparse = imsai_disk.open_image(dsz_file, read_only=True)
+    assert sparse.read(geometry.offset(76, 1, 26), 256) == bytes([0x22]) * 256
+    sparse.close()
+
+def test_sparse_image_version_1(tmp_path):
+    dsz_file = str(tmp_path / "old.dsz")
+    with open(dsz_file, 'wb') as fh:
+        fh.write(imsai_disk.DSZ_HEADER_1.pack(imsai_disk.DSZ_MAGIC_1, 2, 4, SEC_SZ))
+        fh.write(imsai_disk.DSZ_ENTRY.pack(0, 0, imsai_disk.DSZ_ZERO) * 8)
+
+    sparse = imsai_disk.open_image(dsz_file)
+    assert repr(imsai_disk.default_geometry(sparse)) == "2x4x%dx1"%SEC_SZ
+    sparse.write(7 * SEC_SZ, bytes([0x33]) * SEC_SZ)
+    sparse.close()
+
+    sparse = imsai_disk.open_image(dsz_file, read_only=True)
+    assert sparse.read(6 * SEC_SZ, 2 * SEC_SZ) == bytes(SEC_SZ) + bytes([0x33]) * SEC_SZ
+    sparse.close()
+
+def test_command_finishes_once(tmp_path):
+    import imsai_devices
+    disk_device = imsai_disk.DiskDevice(imsai_devices.DeviceFactory(), 2, [make_image(tmp_path)])
+    statuses = []
+    request = {'args': None, 'done': statuses.append, 'status': None, 'due': False, 'finished': False}
+    disk_device.outstanding = 1
+
+    # the timer and the worker can both see the command complete, in
+    # either order, it is finished once
+    disk_device.finish(request, 0x01)
+    disk_device.finish(request, due=True)
+    disk_device.finish(request, due=True)
+    assert statuses == [0x01]
+    assert disk_device.outstanding == 0
+    assert not disk_device.busy()
+    disk_device.done()
+
+def test_skewed_reads_read_ahead(tmp_path):
+    import imsai_cpmfs
+    image = imsai_disk.DiskImage(make_image(tmp_path), read_only=True)
+    cache = imsai_disk.SectorCache(image, track_bytes=TRACK_BYTES)
+    # CP/M reads through the skew of 6, 1, 7, 13, ... a track at a time
+    for track in range(2):
+        for sec in imsai_cpmfs.skew_table(imsai_disk.SECS_PER_TRK, 6):
+            cache.read(track * TRACK_BYTES + (sec - 1) * SEC_SZ, SEC_SZ)
+    assert cache.read_aheads == 2
+    assert cache.misses == 4
+    cache.close()
@@ -0,0 +1,71 @@
+# run with: python3 -m pytest -q
+
+import os
+
+import imsai_hex
+
+PROGRAM = bytes(range(0x20))
+
+class Cpu:
+    def __init__(self, mem_size):
+        self.mem = [0] * mem_size
+        self.symbol_loaders = []
+
+    def add_symbol_loader(self, loader):
+        self.symbol_loaders.append(loader)
+
+def write_hex(hex_file, addr, data):
+    with open(hex_file, 'w') as fh:
+        for i in range(0, len(data), 16):
+            record = [len(data[i:i+16]), (addr + i) >> 8, (addr + i) & 0xFF, 0] + list(data[i:i+16])
+            fh.write(":%s%02X\n"%("".join("%02X"%b for b in record), -sum(record) & 0xFF))
+        fh.write(":00000001FF\n")
+
+def boot(hex_file, mem_size=0x10000):
+    cpu = Cpu(mem_size)
+    loader = imsai_hex.HexLoader(hex_file)
+    assert loader.boot(cpu)
+    return cpu
+
+def test_cache_is_used_and_checked(tmp_path):
+    hex_file = str(tmp_path / "prog.hex")
+    write_hex(hex_file, 0x1000, PROGRAM)
+    boot(hex_file)
+    cache_file = str(tmp_path / "prog.cache")
+    assert os.path.exists(cache_file)
+    assert [name for name in os.listdir(tmp_path) if name.startswith("prog.cache.")] == []
+
+    cpu = boot(hex_file)
+    assert bytes(cpu.mem[0x1000:0x1020]) == PROGRAM
+
+    # a cache cut short loads from the .hex
+    with open(cache_file, 'rb') as fh:
+        data = fh.read()
+    with open(cache_file, 'wb') as fh:
+        fh.write(data[:-8])
+    cpu = boot(hex_file)
+    assert len(cpu.mem) == 0x10000
+    assert bytes(cpu.mem[0x1000:0x1020]) == PROGRAM
+
+def test_cache_past_end_of_memory(tmp_path):
+    hex_file = str(tmp_path / "prog.hex")
+    write_hex(hex_file, 0x1000, PROGRAM)
+    boot(hex_file)
+
+    # the memory doesn't reach the segment, nothing is loaded, and the
+    # memory keeps its size
+    cpu = Cpu(0x800)
+    loader = imsai_hex.HexLoader(hex_file)
+    assert not loader.load_cache(cpu)
+    assert len(cpu.mem) == 0x800
+
+def test_cache_from_smaller_memory(tmp_path):
+    hex_file = str(tmp_path / "prog.hex")
+    write_hex(hex_file, 0xF000, PROGRAM)
+
+    # booted in 48K, the program doesn't fit, but the cache keeps all of it
+    cpu = boot(hex_file, 0xC000)
+    assert len(cpu.mem) == 0xC000
+
+    cpu = boot(hex_file)
+    assert bytes(cpu.mem[0xF000:0xF020]) == PROGRAM